@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks für allmy_notes.py ohne echten Export und ohne LLM:
+
+    python allmy_bench.py generate -o bench_allmystery.json --threads 2000
+    python allmy_bench.py run --threads 2000 --repeat 5 --label "vor Umbau"
+    python allmy_bench.py compare
+    python allmy_bench.py scale --threads 20000 --workers 1,2,4,8
+    python allmy_bench.py serve --port 11435 --latency 1.5 --error-rate 0.05
+
+'generate' erzeugt einen synthetischen Export im Format von allmy_monkey.js,
+'run' misst die einzelnen Verarbeitungsschritte (mit einem Fake-LLM im Prozess)
+und hängt die Ergebnisse an BENCH_RESULTS_FILE an, 'compare' vergleicht die
+letzten Läufe mit denselben Parametern, 'scale' misst Filterung und Vorbereitung
+mit unterschiedlich vielen Prozessen (--workers von allmy_notes.py), 'serve' startet einen Fake-Ollama-Server
+für komplette Läufe von allmy_notes.py (OLLAMA_BASE_URL=http://127.0.0.1:11435).
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import allmy_notes as notes
+
+# --- Konstanten ---
+BENCH_RESULTS_FILE = 'allmy_bench_results.jsonl' # One JSON line per benchmark run
+BENCH_REFERENCE_DATE = date(2024, 1, 1) # Last day of the synthetic exports, so results stay comparable over time
+BENCH_SYSTEM_PROMPT = "Fasse die Beiträge des Themas als Markdown-Notiz zusammen."
+CATEGORIES = ("Politik", "Mystery", "Kriminalfälle", "Verschwörungen", "Menschen", "Wissenschaft", "Weltgeschehen")
+WORDS = ("der", "die", "das", "und", "nicht", "Thema", "Beitrag", "Zeuge", "Bericht", "Quelle", "Frage", "damals",
+         "wirklich", "vielleicht", "Ermittlung", "Polizei", "Aussage", "Theorie", "Beweis", "später", "Spur",
+         "Zeitung", "Interview", "unklar", "offensichtlich", "Video", "Foto", "Dokument", "Ort", "Nacht")
+
+# --- Synthetischer Export ---
+def _text(rng, chars):
+    """Random German-looking text of roughly 'chars' characters."""
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).capitalize() + "."
+
+def _size(rng, mean):
+    """Text size around the mean (exponential, so there are few very long posts)."""
+    return max(1, int(rng.expovariate(1 / mean))) if mean > 0 else 0
+
+def generate_export(threads=1000, posts=30, article_chars=600, quote_chars=200, years=8, gap_rate=0.02,
+                    quote_rate=0.3, link_rate=0.2, seed=1):
+    """
+    Builds a synthetic export {thread_id: {title, category, diary}} in the shape
+    produced by allmy_monkey.js. Posts per thread vary around 'posts', the dates
+    spread over 'years' years with a jump of several months at 'gap_rate' per
+    post (so the time-gap split has work to do), ending at BENCH_REFERENCE_DATE.
+    Same seed, same export.
+    """
+    rng = random.Random(seed)
+    end = BENCH_REFERENCE_DATE
+    start = end - timedelta(days=365 * years)
+    data = {}
+    post_number = 1000000
+    for number in range(threads):
+        category = rng.choice(CATEGORIES)
+        slug = "".join(c for c in category.lower() if "a" <= c <= "z")
+        thread_id = f"{slug}{100000 + number}"
+        day = start + timedelta(days=rng.randrange(max(1, (end - start).days)))
+        diary = {}
+        post_keys = []
+        for position in range(max(1, int(rng.uniform(0.2, 1.8) * posts))):
+            day += timedelta(days=rng.randrange(120, 400) if rng.random() < gap_rate else rng.randrange(0, 4))
+            post_number += 1
+            post_key = f"themen/{thread_id}-{position // 20 + 1}#id{post_number}"
+            post = {"date": day.strftime('%d.%m.%Y')}
+            if article_chars:
+                post["article"] = _text(rng, _size(rng, article_chars))
+            if post_keys and rng.random() < quote_rate:
+                quoted = rng.sample(post_keys, min(len(post_keys), rng.randint(1, 2)))
+                post["memberquotes"] = {key: _text(rng, _size(rng, quote_chars)) for key in quoted}
+            if rng.random() < quote_rate / 2:
+                post["quotes"] = [_text(rng, _size(rng, quote_chars))]
+            if rng.random() < link_rate:
+                post["links"] = [f"https://www.example.org/quelle/{rng.randrange(10**6)}"]
+            diary[post_key] = post
+            post_keys.append(post_key)
+        data[thread_id] = {"title": f"{_text(rng, 30)[:-1]} ({number})", "category": category, "diary": diary}
+    return data
+
+# --- Fake-LLM (im Prozess) ---
+class FakeLLM:
+    """
+    Stand-in for invoke_langchain_llm: answers after 'latency' seconds (± jitter)
+    and fails with a retryable error at 'error_rate', as the real function does
+    after its retries are used up.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, answer_words=300, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.answer = _text(random.Random(seed), answer_words * 7)
+        self.calls = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, system_prompt, user_prompt, stream_to=None):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            failed = self._rng.random() < self.error_rate
+            self.errors += failed
+        time.sleep(delay)
+        if failed:
+            error = notes.LLMCallError("unavailable", "Fake-LLM: simulierter Ausfall", True)
+            return notes._llm_error_text(error, ConnectionError("Fake-LLM"))
+        if stream_to is not None:
+            stream_to.write(self.answer)
+        return self.answer
+
+@contextlib.contextmanager
+def fake_llm(llm):
+    """Routes all LLM calls of allmy_notes to the fake for the duration of the block."""
+    original = notes.invoke_langchain_llm
+    notes.invoke_langchain_llm = llm
+    try:
+        yield llm
+    finally:
+        notes.invoke_langchain_llm = original
+
+# --- Fake-Ollama-Server (HTTP) ---
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal Ollama API: '/', '/api/tags' and '/api/chat' (streamed NDJSON or a single JSON answer)."""
+    server_version = "FakeOllama/1.0"
+
+    def log_message(self, format, *args):
+        logging.debug("Fake-Ollama: " + format % args)
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._json(200, {"models": [{"name": self.server.model, "model": self.server.model}]})
+        else:
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._json(400, {"error": "invalid JSON"})
+            return
+        if self.path != "/api/chat":
+            self._json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        llm = self.server.llm
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        start_time = time.perf_counter()
+        answer = llm(None, prompt)
+        if answer.startswith("[FEHLER"):
+            self._json(503, {"error": "server busy (simulated by allmy_bench)"})
+            return
+        model = request.get("model") or self.server.model
+        final = {"model": model, "created_at": datetime.now().isoformat(), "done": True, "done_reason": "stop",
+                 "total_duration": int((time.perf_counter() - start_time) * 1e9),
+                 "prompt_eval_count": len(prompt) // notes.CHARS_PER_TOKEN,
+                 "prompt_eval_duration": int(llm.latency * 0.2 * 1e9),
+                 "eval_count": len(answer) // notes.CHARS_PER_TOKEN, "eval_duration": int(llm.latency * 0.8 * 1e9)}
+        if request.get("stream", True) is False:
+            self._json(200, {**final, "message": {"role": "assistant", "content": answer}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for position in range(0, len(answer), 200):
+            chunk = {"model": model, "created_at": datetime.now().isoformat(), "done": False,
+                     "message": {"role": "assistant", "content": answer[position:position + 200]}}
+            self.wfile.write(json.dumps(chunk).encode('utf-8') + b"\n")
+        self.wfile.write(json.dumps({**final, "message": {"role": "assistant", "content": ""}}).encode('utf-8') + b"\n")
+
+def serve_fake_ollama(host, port, llm, model="fake"):
+    """Runs the fake Ollama server until Ctrl+C."""
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.llm = llm
+    server.model = model
+    print(f"Fake-Ollama läuft auf http://{host}:{port} (Latenz {llm.latency}s, Fehlerrate {llm.error_rate:.0%}). Beenden mit Strg+C.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nBeendet: {llm.calls} Anfragen, davon {llm.errors} simulierte Fehler.")
+    finally:
+        server.server_close()
+
+# --- Benchmarks ---
+def measure(function, repeat):
+    """Runs function() 'repeat' times; returns the timings and the last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return timings, result
+
+def _timing_entry(timings, items):
+    median = statistics.median(timings)
+    return {"min": round(min(timings), 4), "median": round(median, 4), "mean": round(statistics.mean(timings), 4),
+            "items": items, "items_per_second": round(items / median, 1) if median else None}
+
+def _bench_filter_spec(params):
+    start_date = BENCH_REFERENCE_DATE - timedelta(days=365 * params["years"] // 2)
+    return notes.FilterSpec(start_date=start_date, split_targets=["*alle*"], split_gap_days=90,
+                            min_article_length=params["article_chars"] * 10,
+                            min_memberquote_length=params["quote_chars"] // 2)
+
+def run_benchmarks(params, repeat=3, concurrency=4, latency=0.0, error_rate=0.0):
+    """
+    Times the pipeline steps on a synthetic export with the given parameters.
+    Returns {benchmark: timings}. The LLM is the in-process FakeLLM.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="allmy_bench_") as directory:
+        directory = Path(directory)
+        export_file = directory / "allmystery.json"
+        notes.save_data(generate_export(**params), export_file)
+
+        timings, raw = measure(lambda: notes.load_data(export_file), repeat)
+        results["load_data"] = _timing_entry(timings, len(raw))
+        timings, model = measure(lambda: notes.build_thread_model(raw), repeat)
+        results["build_thread_model"] = _timing_entry(timings, len(model))
+        views = notes.make_thread_views(model)
+
+        start_date = BENCH_REFERENCE_DATE - timedelta(days=365 * params["years"] // 2)
+        for name, function in (
+            ("filter_by_date_range", lambda: notes.filter_by_date_range(views, start_date, BENCH_REFERENCE_DATE)),
+            ("filter_by_total_article_length", lambda: notes.filter_by_total_article_length(views, params["article_chars"] * 10)),
+            ("filter_by_memberquote_length", lambda: notes.filter_by_memberquote_length(views, params["quote_chars"] // 2)),
+            ("split_threads_by_time_gap", lambda: notes.split_threads_by_time_gap(views, ["*alle*"], 90)),
+        ):
+            timings, _ = measure(function, repeat)
+            results[name] = _timing_entry(timings, len(views))
+        spec = _bench_filter_spec(params)
+        timings, (filtered, _) = measure(lambda: notes.apply_filter_spec(views, spec), repeat)
+        results["apply_filter_spec"] = _timing_entry(timings, len(views))
+
+        timings, llm_requests = measure(lambda: notes.prepare_llm_requests(filtered, BENCH_SYSTEM_PROMPT), repeat)
+        results["prepare_llm_requests"] = _timing_entry(timings, len(llm_requests))
+
+        answer = FakeLLM(answer_words=300).answer
+        def save_all():
+            output_dir = Path(tempfile.mkdtemp(dir=directory, prefix="save_"))
+            for request in llm_requests:
+                notes.save_llm_output(request["title"], request["category"], answer, request["links"], output_dir)
+        timings, _ = measure(save_all, repeat)
+        results["save_llm_output"] = _timing_entry(timings, len(llm_requests))
+
+        llm = FakeLLM(latency=latency, error_rate=error_rate)
+        def dispatch():
+            output_dir = Path(tempfile.mkdtemp(dir=directory, prefix="dispatch_"))
+            with contextlib.redirect_stdout(io.StringIO()): # Progress lines per request
+                return notes.dispatch_llm_requests(llm_requests, output_dir, concurrency)
+        with fake_llm(llm):
+            timings, counts = measure(dispatch, repeat)
+        results["dispatch_llm_requests"] = {**_timing_entry(timings, len(llm_requests)),
+                                            "errors": counts["error"], "requeued": counts["requeued"]}
+    return results
+
+def run_scaling(params, worker_counts, repeat=3):
+    """
+    Times filtering and prompt preparation with each number of worker processes
+    and checks that every count yields the same threads and requests as one process.
+    Returns ({benchmark: timings}, results_identical).
+    """
+    results = {}
+    identical = True
+    model = notes.build_thread_model(generate_export(**params))
+    spec = _bench_filter_spec(params)
+    baseline = None
+    for workers in worker_counts:
+        if workers == 1:
+            filter_step = lambda: notes.apply_filter_spec(model, spec)
+            prepare_step = lambda: notes.prepare_llm_requests(filtered, BENCH_SYSTEM_PROMPT)
+        else:
+            filter_step = lambda: notes.apply_filter_spec_parallel(model, spec, workers)
+            prepare_step = lambda: notes.prepare_llm_requests_parallel(filtered, BENCH_SYSTEM_PROMPT, workers)
+        filter_timings, (filtered, _) = measure(filter_step, repeat)
+        prepare_timings, llm_requests = measure(prepare_step, repeat)
+        results[f"apply_filter_spec[{workers}]"] = _timing_entry(filter_timings, len(model))
+        results[f"prepare_llm_requests[{workers}]"] = _timing_entry(prepare_timings, len(llm_requests))
+        outcome = (list(filtered), notes.materialize_threads(filtered), llm_requests)
+        if baseline is None:
+            baseline = outcome
+        elif outcome != baseline:
+            identical = False
+            print(f"FEHLER: Ergebnis mit {workers} Prozessen weicht vom ersten Lauf ab.")
+    return results, identical
+
+def print_scaling(results, worker_counts):
+    print(f"{'Prozesse':>8} {'Filter':>10} {'Vorbereitung':>13} {'Gesamt':>10} {'Speedup':>8} {'Effizienz':>10}")
+    base_total = None
+    for workers in worker_counts:
+        filter_median = results[f"apply_filter_spec[{workers}]"]["median"]
+        prepare_median = results[f"prepare_llm_requests[{workers}]"]["median"]
+        total = filter_median + prepare_median
+        base_total = base_total or total
+        speedup = base_total / total if total else 0.0
+        print(f"{workers:>8} {filter_median:>9.3f}s {prepare_median:>12.3f}s {total:>9.3f}s {speedup:>7.2f}x {speedup / workers:>9.0%}")
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def save_results(entry, filename=BENCH_RESULTS_FILE):
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def load_results(filename=BENCH_RESULTS_FILE):
+    if not Path(filename).exists():
+        return []
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def print_results(results):
+    print(f"{'Benchmark':<32} {'Median':>10} {'Min':>10} {'Einheiten/s':>12}")
+    for name, entry in results.items():
+        rate = f"{entry['items_per_second']:.1f}" if entry["items_per_second"] else "-"
+        print(f"{name:<32} {entry['median']:>9.4f}s {entry['min']:>9.4f}s {rate:>12}")
+
+def compare_results(entries):
+    """Prints the change of the medians between the last two runs with identical parameters."""
+    if not entries:
+        print(f"Keine Ergebnisse in '{BENCH_RESULTS_FILE}'.")
+        return
+    latest = entries[-1]
+    earlier = [entry for entry in entries[:-1] if entry["params"] == latest["params"]]
+    if not earlier:
+        print("Kein früherer Lauf mit denselben Parametern zum Vergleich.")
+        return
+    previous = earlier[-1]
+    print(f"Vergleich: {previous.get('label') or previous.get('revision')} ({previous['timestamp']}) "
+          f"-> {latest.get('label') or latest.get('revision')} ({latest['timestamp']})")
+    print(f"{'Benchmark':<32} {'vorher':>10} {'nachher':>10} {'Änderung':>10}")
+    for name, entry in latest["results"].items():
+        before = previous["results"].get(name)
+        if not before:
+            continue
+        change = (entry["median"] - before["median"]) / before["median"] * 100 if before["median"] else 0.0
+        print(f"{name:<32} {before['median']:>9.4f}s {entry['median']:>9.4f}s {change:>+9.1f}%")
+
+# --- Kommandozeile ---
+def _default_worker_counts():
+    """1, 2, 4, ... up to the number of cores (which is always included)."""
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    if cores > 1:
+        counts.append(cores)
+    return counts
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Synthetische Exporte, Fake-LLM und Benchmarks für allmy_notes.py.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_export_options(command):
+        command.add_argument("--threads", type=int, default=1000, help="Anzahl Themen (Standard: 1000).")
+        command.add_argument("--posts", type=int, default=30, help="Mittlere Beiträge pro Thema (Standard: 30).")
+        command.add_argument("--article-chars", type=int, default=600, help="Mittlere Artikellänge in Zeichen (Standard: 600).")
+        command.add_argument("--quote-chars", type=int, default=200, help="Mittlere Zitatlänge in Zeichen (Standard: 200).")
+        command.add_argument("--years", type=int, default=8, help="Zeitraum der Beiträge in Jahren (Standard: 8).")
+        command.add_argument("--gap-rate", type=float, default=0.02,
+                             help="Anteil der Beiträge mit mehrmonatiger Lücke davor (Standard: 0.02).")
+        command.add_argument("--seed", type=int, default=1, help="Zufalls-Seed (Standard: 1).")
+
+    def add_llm_options(command, latency):
+        command.add_argument("--latency", type=float, default=latency, help=f"Antwortzeit des Fake-LLM in Sekunden (Standard: {latency}).")
+        command.add_argument("--error-rate", type=float, default=0.0, help="Anteil simulierter Ausfälle (Standard: 0).")
+
+    generate = commands.add_parser("generate", help="Synthetischen Export schreiben.")
+    add_export_options(generate)
+    generate.add_argument("-o", "--output", default="bench_allmystery.json", help="Zieldatei (Standard: bench_allmystery.json).")
+
+    run = commands.add_parser("run", help="Benchmarks ausführen und Ergebnisse anhängen.")
+    add_export_options(run)
+    add_llm_options(run, 0.0)
+    run.add_argument("--repeat", type=int, default=3, help="Wiederholungen pro Benchmark (Standard: 3).")
+    run.add_argument("--concurrency", type=int, default=notes.LLM_MAX_CONCURRENCY, help="Parallelität beim Dispatch.")
+    run.add_argument("--label", help="Bezeichnung des Laufs für den Vergleich (z. B. Branch oder Änderung).")
+    run.add_argument("--with-logging", action="store_true", help="Logging von allmy_notes (bis WARNING) während der Messung nicht abschalten.")
+
+    commands.add_parser("compare", help="Letzten Lauf mit dem vorherigen mit denselben Parametern vergleichen.")
+
+    scale = commands.add_parser("scale", help="Filterung und Vorbereitung mit 1..N Prozessen messen.")
+    add_export_options(scale)
+    default_workers = ",".join(str(count) for count in _default_worker_counts())
+    scale.add_argument("--workers", default=default_workers,
+                       help=f"Prozessanzahlen, kommasepariert (Standard: {default_workers}).")
+    scale.add_argument("--repeat", type=int, default=3, help="Wiederholungen pro Messung (Standard: 3).")
+    scale.add_argument("--label", help="Bezeichnung des Laufs für den Vergleich.")
+
+    serve = commands.add_parser("serve", help="Fake-Ollama-Server für komplette Läufe starten.")
+    add_llm_options(serve, 1.0)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=11435)
+    serve.add_argument("--model", default="fake", help="Modellname in /api/tags (Standard: fake).")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "compare":
+        compare_results(load_results())
+        return 0
+    if args.command == "serve":
+        serve_fake_ollama(args.host, args.port, FakeLLM(latency=args.latency, jitter=args.latency / 4,
+                                                         error_rate=args.error_rate), args.model)
+        return 0
+
+    params = {"threads": args.threads, "posts": args.posts, "article_chars": args.article_chars,
+              "quote_chars": args.quote_chars, "years": args.years, "gap_rate": args.gap_rate, "seed": args.seed}
+    if args.command == "generate":
+        data = generate_export(**params)
+        if not notes.save_data(data, args.output):
+            return 1
+        print(f"{len(data)} Themen mit {sum(len(t['diary']) for t in data.values())} Beiträgen in '{args.output}' geschrieben.")
+        return 0
+
+    if args.command == "scale":
+        worker_counts = sorted({max(1, int(count)) for count in args.workers.split(",") if count.strip()} | {1})
+        logging.disable(logging.WARNING)
+        print(f"Skalierung: {args.threads} Themen, Ø {args.posts} Beiträge, {os.cpu_count()} Kerne, "
+              f"Prozesse {', '.join(map(str, worker_counts))} ...")
+        results, identical = run_scaling(params, worker_counts, args.repeat)
+        logging.disable(logging.NOTSET)
+        print_scaling(results, worker_counts)
+        save_results({
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "label": args.label,
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "params": {**params, "repeat": args.repeat, "workers": worker_counts, "cores": os.cpu_count()},
+            "results": results,
+        })
+        print(f"Ergebnisse angehängt an '{BENCH_RESULTS_FILE}'.")
+        return 0 if identical else 1
+
+    if args.with_logging:
+        notes.setup_logging()
+    else:
+        logging.disable(logging.WARNING) # Per-thread log lines would dominate the filter timings
+    print(f"Benchmark: {args.threads} Themen, Ø {args.posts} Beiträge, {args.repeat} Wiederholungen ...")
+    results = run_benchmarks(params, args.repeat, max(1, args.concurrency), args.latency, args.error_rate)
+    logging.disable(logging.NOTSET)
+    notes.flush_logging()
+    print_results(results)
+    save_results({
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "label": args.label,
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "params": {**params, "repeat": args.repeat, "concurrency": args.concurrency, "latency": args.latency,
+                   "error_rate": args.error_rate, "with_logging": args.with_logging},
+        "results": results,
+    })
+    print(f"Ergebnisse angehängt an '{BENCH_RESULTS_FILE}' (Vergleich: python allmy_bench.py compare).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,38 @@
 # -*- coding: utf-8 -*-
+import time
+_IMPORT_START = time.perf_counter() # Startup time is reported in the run profile
+import argparse
+import csv
 import json
 import os
+import sys
 import logging
-import copy
-from datetime import datetime, timedelta
+import logging.handlers
+import atexit
+import gzip
+import queue
+import shutil
+from collections import Counter
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from dataclasses import dataclass, field, replace
+from typing import List, Optional
 import re
-import time
+import mmap
+import struct
+import zlib
+import threading
+import hashlib
+import random
+import math
+import importlib.util
+import sqlite3
+import tracemalloc
+import multiprocessing
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from langchain_core.messages import HumanMessage, SystemMessage
 from dotenv import load_dotenv, find_dotenv
 
 # --- Load Environment Variables ---
@@ -16,65 +40,278 @@ load_dotenv(find_dotenv())
 LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini").lower()
 MODEL_NAME = os.environ.get("MODEL_NAME") # Required for both providers
 
-# --- Provider Specific Configuration & Availability ---
-OLLAMA_AVAILABLE = False
-GEMINI_AVAILABLE = False
-OLLAMA_BASE_URL = ""
-GEMINI_API_KEY = ""
-
-# Attempt to import provider-specific modules and check configuration
-try:
-    if LLM_PROVIDER == "ollama":
-        from langchain_ollama import ChatOllama # Updated import
-        OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
-        if not OLLAMA_BASE_URL:
-             logging.warning("LLM_PROVIDER is 'ollama', but 'OLLAMA_BASE_URL' is missing in .env. Using default.")
-             # Default is already set above, just logging the warning.
-        OLLAMA_AVAILABLE = True # Mark as potentially available
-
-    elif LLM_PROVIDER == "gemini":
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        # HarmCategory/HarmBlockThreshold needed for safety settings
-        try:
-            from langchain_google_vertexai import HarmCategory, HarmBlockThreshold
-        except ImportError:
-            # Fallback if vertexai is not installed but genai is
-            from google.generativeai.types import HarmCategory, HarmBlockThreshold
-            logging.warning("Imported HarmCategory/HarmBlockThreshold from google.generativeai.types (fallback). Consider installing langchain-google-vertexai.")
-
-        GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-        if not GEMINI_API_KEY:
-            logging.error("LLM_PROVIDER is 'gemini', but 'GEMINI_API_KEY' is missing in .env.")
-            # Keep GEMINI_AVAILABLE False
-        else:
-             GEMINI_AVAILABLE = True # Mark as potentially available
-
-except ImportError as e:
-    logging.error(f"Import Error for provider '{LLM_PROVIDER}': {e}. Please ensure the required package is installed.")
-    if LLM_PROVIDER == "ollama":
-        logging.error("-> For Ollama, run: pip install langchain-ollama")
-        OLLAMA_AVAILABLE = False
-    if LLM_PROVIDER == "gemini":
-        logging.error("-> For Gemini, run: pip install langchain-google-genai google-generativeai")
-        GEMINI_AVAILABLE = False
-
+# --- Provider-Konfiguration ---
+# Only settings are read here; the LangChain integrations are imported on first
+# use by their provider plugin (see "Provider-Plugins")
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL") or "http://localhost:11434"
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 
 # --- Konstanten ---
 INPUT_JSON_FILE = 'allmystery.json'
-INTERMEDIATE_JSON_FILE = 'allmy_llm_input.json'
+INTERMEDIATE_STORE_FILE = 'allmy_llm_input.bin' # Filtered threads (binary thread store)
+INTERMEDIATE_JSON_FILE = 'allmy_llm_input.json' # Optional JSON export / older runs
 SYSTEM_PROMPT_FILE = 'allmy_prompt.md'
+FILTER_SPEC_FILE = 'allmy_filter_spec.json'
+RUN_SUMMARY_FILE = 'allmy_run_summary.json'
+MANIFEST_FILE = 'allmy_manifest.json'
+RUN_JOURNAL_FILE = 'allmy_run_journal.jsonl' # Append-only state of the last LLM run (for --resume)
 LOG_FILE = 'allmy_log.log'
-
-# --- Logging Setup ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+# Streaming ingest: read the export thread by thread instead of loading it completely
+STREAM_INGEST = os.environ.get("STREAM_INGEST", "0").lower() in ("1", "true", "ja", "yes")
+# Optional SQLite backend: filter with indexed queries instead of loading the export
+THREAD_DB_FILE = 'allmy_threads.sqlite'
+THREAD_DB_ENABLED = os.environ.get("THREAD_DB", "0").lower() in ("1", "true", "ja", "yes")
+# Worker processes for filtering and prompt preparation of a loaded export (1 = none, 0 = one per core)
+FILTER_WORKERS = int(os.environ.get("FILTER_WORKERS", "1"))
+# Threads per shard and worker; several shards per worker even out uneven thread sizes
+FILTER_SHARDS_PER_WORKER = 4
+# Additionally write the filtered threads as readable JSON (INTERMEDIATE_JSON_FILE)
+INTERMEDIATE_JSON_EXPORT = os.environ.get("INTERMEDIATE_JSON_EXPORT", "0").lower() in ("1", "true", "ja", "yes")
+
+# --- Exit-Codes ---
+EXIT_OK = 0
+EXIT_FAILURE = 1 # Unexpected error
+EXIT_CONFIG_ERROR = 2 # LLM configuration, options or profile invalid
+EXIT_DATA_ERROR = 3 # Input data missing or unreadable
+EXIT_LLM_ERRORS = 4 # Finished, but some requests failed
+EXIT_ABORTED = 5 # Aborted by the user
+EXIT_INTERRUPTED = 130 # Ctrl+C
+
+# --- Parallelität & Ratenbegrenzung ---
+# Number of LLM requests that may be in flight at the same time
+LLM_MAX_CONCURRENCY = max(1, int(os.environ.get("LLM_MAX_CONCURRENCY", "4")))
+# Default token bucket per provider: (requests per second, burst size)
+DEFAULT_RATE_LIMITS = {
+    "gemini": (1.0, 2),
+    "ollama": (4.0, 4),
+}
+
+# --- Backend-Pool ---
+# Optional JSON file with several backends (Ollama hosts, Gemini keys); without it
+# the single backend from LLM_PROVIDER / MODEL_NAME / OLLAMA_BASE_URL is used
+BACKENDS_FILE = os.environ.get("LLM_BACKENDS_FILE", "allmy_backends.json")
+# Weight of the newest response time in the smoothed latency per backend
+BACKEND_LATENCY_SMOOTHING = 0.3
+
+# --- Wiederholungen & Circuit-Breaker ---
+# Retryable failures (rate limit, timeout, provider unavailable) are retried with
+# exponential backoff and jitter; Retry-After hints from the provider win if longer
+LLM_RETRY_MAX = max(0, int(os.environ.get("LLM_RETRY_MAX", "4")))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", "2"))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get("LLM_RETRY_MAX_SECONDS", "120"))
+# Requests still failing with a retryable error are queued again at the end (rounds per request)
+LLM_REQUEUE_MAX = max(0, int(os.environ.get("LLM_REQUEUE_MAX", "2")))
+# After this many consecutive provider failures all calls pause (doubling up to the maximum)
+LLM_BREAKER_THRESHOLD = max(1, int(os.environ.get("LLM_BREAKER_THRESHOLD", "5")))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_BREAKER_MAX_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_MAX_COOLDOWN_SECONDS", "600"))
+
+# --- Token-Budget & Map-Reduce ---
+# Rough token estimate without a tokenizer (German text averages ~4 characters per token)
+CHARS_PER_TOKEN = 4
+# Threads whose prompt exceeds this many tokens are summarized in chunks first (0 = off)
+LLM_MAX_PROMPT_TOKENS = max(0, int(os.environ.get("LLM_MAX_PROMPT_TOKENS", "0")))
+MAP_SYSTEM_PROMPT = (
+    "Du erhältst einen Ausschnitt aus den Beiträgen eines Forenthemas: nummerierte eigene Gedanken "
+    "mit Datum und Zitate als Kontext. Fasse diesen Ausschnitt sachlich und vollständig zusammen. "
+    "Behalte die Nummern und Daten der Gedanken bei, übernimm die zentralen Argumente, Thesen und "
+    "offenen Fragen sowie wichtige Zitate sinngemäß. Keine Einleitung, kein Fazit."
 )
 
+# --- Prompt-Präfix-Cache ---
+# Gemini: put the system prompt into an explicit context cache once per run (needs a minimum size)
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "1").lower() not in ("0", "false", "nein", "no")
+GEMINI_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CACHE_MIN_TOKENS", "1024"))
+GEMINI_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CACHE_TTL_SECONDS", "3600"))
+# Ollama: keep the model (and the KV cache of the shared prefix) loaded between calls and runs
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# --- Streaming-Ausgabe ---
+# Consume the token stream and write it to '<note>.md.partial' while it arrives;
+# the finished note is renamed into place atomically
+LLM_STREAM_OUTPUT = os.environ.get("LLM_STREAM_OUTPUT", "0").lower() in ("1", "true", "ja", "yes")
+# Keep the partial file of failed or interrupted generations for diagnosis (off: they sit in the vault)
+LLM_KEEP_PARTIAL_OUTPUT = os.environ.get("LLM_KEEP_PARTIAL_OUTPUT", "0").lower() in ("1", "true", "ja", "yes")
+PARTIAL_OUTPUT_SUFFIX = '.partial'
+
+# --- Sammelanfragen für kleine Themen ---
+# Small threads are packed into one call up to this many user-prompt tokens (0 = off)
+LLM_BATCH_MAX_TOKENS = max(0, int(os.environ.get("LLM_BATCH_MAX_TOKENS", "0")))
+LLM_BATCH_MAX_THREADS = max(2, int(os.environ.get("LLM_BATCH_MAX_THREADS", "8")))
+BATCH_MARKER = "<<<THEMA {number}>>>"
+
+# --- Planung (Tokens, Kosten, Laufzeit) ---
+LLM_HISTORY_FILE = 'allmy_llm_history.json' # Measured tokens and latency per provider/model
+PLAN_FILE = 'allmy_plan.json'
+# Context window per provider in tokens (LLM_CONTEXT_TOKENS overrides)
+DEFAULT_CONTEXT_TOKENS = {
+    "gemini": 1048576,
+    "ollama": 8192,
+}
+LLM_CONTEXT_TOKENS = int(os.environ.get("LLM_CONTEXT_TOKENS", "0")) or DEFAULT_CONTEXT_TOKENS.get(LLM_PROVIDER, 8192)
+# Output tokens assumed per call until the history has measurements
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get("LLM_EXPECTED_OUTPUT_TOKENS", "1500"))
+# Gemini prices in USD per million tokens (example values, adjust to the model used)
+GEMINI_PRICE_INPUT_PER_MTOK = float(os.environ.get("GEMINI_PRICE_INPUT_PER_MTOK", "0.30"))
+GEMINI_PRICE_OUTPUT_PER_MTOK = float(os.environ.get("GEMINI_PRICE_OUTPUT_PER_MTOK", "2.50"))
+GEMINI_PRICE_CACHED_INPUT_PER_MTOK = float(os.environ.get("GEMINI_PRICE_CACHED_INPUT_PER_MTOK", "0.075"))
+
+# --- Laufzeitprofil ---
+# Written next to LOG_FILE at the end of every run: JSON report of the last run,
+# CSV with one line per stage and run for comparisons across runs
+PROFILE_REPORT_FILE = 'allmy_profile.json'
+PROFILE_HISTORY_FILE = 'allmy_profile.csv'
+# Peak memory per stage via tracemalloc (slows down the Python-heavy stages)
+PROFILE_MEMORY = os.environ.get("PROFILE_MEMORY", "0").lower() in ("1", "true", "ja", "yes")
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+
+# --- LLM-Antwort-Cache ---
+LLM_CACHE_FILE = 'allmy_llm_cache.sqlite'
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1").lower() not in ("0", "false", "nein", "no")
+LLM_CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", "180"))
+LLM_CACHE_MAX_MB = float(os.environ.get("LLM_CACHE_MAX_MB", "200"))
+
+# --- Logging ---
+# Per-item events (deleted posts/threads/quotes, splits): "detail" logs every one,
+# "summary" only counts them and logs the first and every LOG_SAMPLE_EVERY-th
+LOG_MODE = os.environ.get("LOG_MODE", "detail").lower()
+LOG_SAMPLE_EVERY = max(0, int(os.environ.get("LOG_SAMPLE_EVERY", "100")))
+# The log of the previous runs is kept gzip-compressed as LOG_FILE.1.gz, .2.gz, ...
+# (0 = overwrite on every run); a run rotates early once the file exceeds LOG_MAX_MB
+LOG_BACKUP_COUNT = max(0, int(os.environ.get("LOG_BACKUP_COUNT", "5")))
+LOG_MAX_MB = float(os.environ.get("LOG_MAX_MB", "50"))
+
+_log_queue = None
+_log_listener = None
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Passes records on unformatted, so formatting happens on the listener thread."""
+
+    def prepare(self, record):
+        # The queue stays in this process; the arguments are plain values that do not change
+        return record
+
+def _gzip_rotated_log(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def _create_log_file_handler():
+    """File handler for LOG_FILE; moves the log of the previous run to the compressed backups."""
+    if LOG_BACKUP_COUNT <= 0:
+        return logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8', delay=True)
+    handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=int(LOG_MAX_MB * 1024 * 1024),
+                                                   backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = _gzip_rotated_log
+    try:
+        if os.path.getsize(LOG_FILE) > 0:
+            handler.doRollover()
+    except OSError:
+        pass # No log of a previous run
+    return handler
+
+def setup_logging():
+    """
+    Logs to LOG_FILE (created with the first message) and the console. Callers
+    only put records on a queue; a listener thread formats and writes them.
+    """
+    global _log_queue, _log_listener
+    if _log_listener is not None: return
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [_create_log_file_handler(), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _log_queue = queue.Queue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(shutdown_logging) # Runs before logging's own shutdown
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(_DeferredQueueHandler(_log_queue))
+
+def flush_logging():
+    """Waits until all queued records are written (e.g. before asking the user)."""
+    if _log_listener is not None:
+        _log_queue.join()
+
+def shutdown_logging():
+    """Writes the remaining records and stops the listener thread."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+def read_input(prompt):
+    """input() that first lets pending log output reach the console."""
+    flush_logging()
+    return input(prompt)
+
+# Labels of the per-item events for the summary
+ITEM_EVENT_LABELS = {
+    "post_removed": "Beiträge außerhalb des Zeitraums",
+    "thread_emptied": "Themen nach Datumsfilter leer",
+    "thread_too_short": "Themen unter Artikellänge",
+    "quote_removed": "Mitgliedszitate zu kurz",
+    "split": "Aufteilungen bei Zeitlücken",
+    "invalid_date": "Beiträge mit ungültigem Datum",
+    "invalid_post": "ungültige Post-Einträge ignoriert",
+    "undated_post": "Beiträge ohne gültiges Datum beim Split ignoriert",
+}
+
+class ItemEventLog:
+    """Logs per-item events, or in summary mode counts them and logs a sample."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def log(self, kind, level, msg, *args):
+        if LOG_MODE != "summary":
+            logging.log(level, msg, *args)
+            return
+        with self._lock:
+            self.counts[kind] += 1
+            count = self.counts[kind]
+        if count == 1 or (LOG_SAMPLE_EVERY and count % LOG_SAMPLE_EVERY == 0):
+            logging.log(level, "[#%d] " + msg, count, *args)
+
+    def log_summary(self):
+        """Logs and resets the counters (summary mode only)."""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        for kind, count in counts.items():
+            logging.info("Zusammengefasst: %d %s.", count, ITEM_EVENT_LABELS.get(kind, kind))
+
+ITEM_EVENTS = ItemEventLog()
+
+def _log_post_removed(key, thread_id, start_str, end_str, date_str, reason):
+    ITEM_EVENTS.log("post_removed", logging.INFO, "LÖSCHE Post '%s' in '%s' - Außerhalb %s-%s (Datum: %s, Grund: %s)",
+                    key, thread_id, start_str, end_str, date_str, reason)
+
+def _log_thread_emptied(thread_id, title):
+    ITEM_EVENTS.log("thread_emptied", logging.INFO, "LÖSCHE Thema '%s' (%s): Keine Posts nach Datumsfilter.",
+                    thread_id, title or 'Unbekannt')
+
+def _log_thread_too_short(thread_id, title, total_length, threshold):
+    ITEM_EVENTS.log("thread_too_short", logging.INFO, "LÖSCHE Thema '%s' (%s): Artikellänge (%d) < %d",
+                    thread_id, title or 'Unbekannt', total_length, threshold)
+
+def _log_invalid_post_date(date_str, key, thread_id):
+    ITEM_EVENTS.log("invalid_date", logging.WARNING, "Ungültiges oder fehlendes Datum '%s' in Post '%s', Thema '%s'. Beitrag wird beibehalten.",
+                    date_str, key, thread_id)
+
+def _log_invalid_post(key, thread_id, purpose):
+    ITEM_EVENTS.log("invalid_post", logging.WARNING, "Ignoriere ungültigen Post-Eintrag (kein dict) '%s' in Thema '%s' für %s.",
+                    key, thread_id, purpose)
+
+def _log_undated_post(key, thread_id):
+    ITEM_EVENTS.log("undated_post", logging.WARNING, "Post '%s' in Thema '%s' hat ungültiges Datum, wird beim Sortieren ignoriert.",
+                    key, thread_id)
+
 # --- Core Functions (File I/O, Input Handling, Parsing, Sanitizing) ---
 def load_data(filename):
     filepath = Path(filename)
@@ -93,6 +330,126 @@ def load_data(filename):
         logging.error(f"Allgemeiner Fehler beim Laden von '{filename}': {e}")
         return None
 
+def iter_threads(filename, chunk_size=1 << 16):
+    """
+    Streams the top-level thread map of a JSON export and yields
+    (thread_id, thread_data) pairs one at a time. Only the thread currently
+    being decoded is held in memory. Raises ValueError on malformed input.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = not buf
+
+        def fill():
+            # Drop the consumed prefix and append more data; False at end of file
+            nonlocal buf, pos, eof
+            if eof: return False
+            more = f.read(max(chunk_size, len(buf) - pos)) # Grow geometrically for large threads
+            if not more:
+                eof = True
+                return False
+            buf = buf[pos:] + more
+            pos = 0
+            return True
+
+        def next_char():
+            # Skips whitespace and returns the next significant character ('' at EOF)
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf): return buf[pos]
+                if not fill(): return ''
+
+        def decode_value():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # A value touching the buffer end may be truncated (e.g. numbers)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof: raise
+                if not fill():
+                    value, pos = decoder.raw_decode(buf, pos)
+                    return value
+
+        def expect(char):
+            nonlocal pos
+            found = next_char()
+            if found != char:
+                raise ValueError(f"'{char}' erwartet, '{found}' gefunden")
+            pos += 1
+
+        expect('{')
+        if next_char() == '}': return
+        while True:
+            next_char()
+            thread_id = decode_value()
+            expect(':')
+            next_char()
+            yield thread_id, decode_value()
+            separator = next_char()
+            pos += 1
+            if separator == '}': return
+            if separator != ',':
+                raise ValueError(f"',' oder '}}' erwartet, '{separator}' gefunden")
+
+class ThreadFileStream:
+    """Re-iterable source that streams the threads of a JSON file on every pass."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __iter__(self):
+        return iter_threads(self.filename)
+
+    def keys(self):
+        """Thread IDs in file order (one streaming pass)."""
+        return [thread_id for thread_id, _ in iter_threads(self.filename)]
+
+def load_source_data(filename):
+    """Loads the export into the thread model, or returns a ThreadFileStream in streaming mode."""
+    if Path(filename).suffix == '.bin':
+        return load_thread_store(filename)
+    # Only the export goes into the thread database; a reused intermediate file
+    # (already filtered) is streamed so it does not replace the export there
+    if THREAD_DB_ENABLED and filename == INPUT_JSON_FILE:
+        if not Path(filename).exists():
+            logging.error(f"Fehler: Datei '{filename}' nicht gefunden.")
+            return None
+        return open_thread_db(filename)
+    if not (STREAM_INGEST or THREAD_DB_ENABLED):
+        data = load_data(filename)
+        return build_thread_model(data) if data is not None else None
+    if not Path(filename).exists():
+        logging.error(f"Fehler: Datei '{filename}' nicht gefunden.")
+        return None
+    logging.info(f"'{filename}' wird im Streaming-Modus gelesen.")
+    return ThreadFileStream(filename)
+
+def save_data_stream(thread_items, filename):
+    """
+    Writes (thread_id, thread_data) pairs incrementally as a JSON object and
+    passes them through, so the intermediate file can be written while streaming.
+    """
+    filepath = Path(filename)
+    count = 0
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write("{")
+        for thread_id, thread_data in thread_items:
+            f.write(",\n    " if count else "\n    ")
+            thread_dict = thread_data.to_dict() if isinstance(thread_data, ThreadView) else thread_data
+            f.write(json.dumps(thread_id, ensure_ascii=False) + ": " + json.dumps(thread_dict, ensure_ascii=False))
+            count += 1
+            yield thread_id, thread_data
+        f.write("\n}\n")
+    logging.info(f"Daten erfolgreich in '{filepath}' gespeichert ({count} Themen, Streaming).")
+
 def save_data(data, filename):
     filepath = Path(filename)
     try:
@@ -104,10 +461,186 @@ def save_data(data, filename):
         logging.error(f"Fehler beim Speichern in '{filepath}': {e}")
         return False
 
+# --- Binärer Zwischenspeicher ---
+# Layout (little endian):
+#   header  : magic (8 bytes), format version (uint16), flags (uint16)
+#   records : per thread a uint32 length followed by the compact JSON of the thread dict
+#   index   : uint32 count, then per thread: uint64 offset, uint32 length, uint32 crc32,
+#             uint16 id length, utf-8 thread_id (in original order)
+#   footer  : uint64 index offset, uint32 index length, uint32 index crc32, magic
+# The index allows reading a single thread without touching the others.
+STORE_MAGIC = b'ALLMYTS\x00'
+STORE_VERSION = 1
+_STORE_HEADER = struct.Struct('<8sHH')
+_STORE_LENGTH = struct.Struct('<I')
+_STORE_INDEX_ENTRY = struct.Struct('<QIIH')
+_STORE_FOOTER = struct.Struct('<QII8s')
+
+class ThreadStoreWriter:
+    """Writes a thread store to a temporary file and moves it into place on close()."""
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+        self._tmp_path = self.filename.with_name(self.filename.name + '.tmp')
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(_STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, 0))
+        self._entries = []
+
+    def write(self, thread_id, thread_dict):
+        payload = json.dumps(thread_dict, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        offset = self._file.tell() + _STORE_LENGTH.size
+        self._file.write(_STORE_LENGTH.pack(len(payload)))
+        self._file.write(payload)
+        self._entries.append((str(thread_id).encode('utf-8'), offset, len(payload), zlib.crc32(payload)))
+
+    def close(self):
+        index = [_STORE_LENGTH.pack(len(self._entries))]
+        for id_bytes, offset, length, crc in self._entries:
+            index.append(_STORE_INDEX_ENTRY.pack(offset, length, crc, len(id_bytes)))
+            index.append(id_bytes)
+        index = b''.join(index)
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_STORE_FOOTER.pack(index_offset, len(index), zlib.crc32(index), STORE_MAGIC))
+        self._file.close()
+        os.replace(self._tmp_path, self.filename)
+        return len(self._entries)
+
+    def abort(self):
+        """Discards the partially written file."""
+        self._file.close()
+        try:
+            self._tmp_path.unlink()
+        except OSError:
+            pass
+
+class ThreadStore:
+    """
+    Read access to a thread store. Iterating yields (thread_id, thread_dict) in
+    the saved order (re-iterable like ThreadFileStream); get() reads one thread
+    via the index. The index is parsed and checked once per file version.
+    Raises ValueError on a wrong format, version or checksum.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._index = None # (file stamp, entries in saved order, {thread_id: (offset, length, crc)})
+
+    @contextmanager
+    def _open(self):
+        """Maps the file; yields (mm, entries, {thread_id: (offset, length, crc)})."""
+        with open(self.filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with mm:
+            # A rewritten store (os.replace) has a new inode, size or mtime
+            stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            index = self._index
+            if index is None or index[0] != stamp:
+                entries = self._read_index(mm)
+                by_id = {}
+                for thread_id, *location in entries:
+                    by_id.setdefault(thread_id, tuple(location))
+                index = self._index = (stamp, entries, by_id)
+            yield mm, index[1], index[2]
+
+    def _read_index(self, mm):
+        if len(mm) < _STORE_HEADER.size + _STORE_FOOTER.size:
+            raise ValueError(f"'{self.filename}' ist zu kurz für einen Themenspeicher")
+        magic, version, _flags = _STORE_HEADER.unpack_from(mm, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"'{self.filename}' ist kein Themenspeicher")
+        if version != STORE_VERSION:
+            raise ValueError(f"'{self.filename}' hat Formatversion {version}, erwartet {STORE_VERSION}")
+        index_offset, index_length, index_crc, end_magic = _STORE_FOOTER.unpack_from(mm, len(mm) - _STORE_FOOTER.size)
+        if end_magic != STORE_MAGIC or index_offset + index_length + _STORE_FOOTER.size != len(mm):
+            raise ValueError(f"'{self.filename}' ist unvollständig (Index fehlt)")
+        index = mm[index_offset:index_offset + index_length]
+        if zlib.crc32(index) != index_crc:
+            raise ValueError(f"Prüfsumme des Index in '{self.filename}' ungültig")
+        (count,) = _STORE_LENGTH.unpack_from(index, 0)
+        pos = _STORE_LENGTH.size
+        entries = []
+        for _ in range(count):
+            offset, length, crc, id_length = _STORE_INDEX_ENTRY.unpack_from(index, pos)
+            pos += _STORE_INDEX_ENTRY.size
+            entries.append((index[pos:pos + id_length].decode('utf-8'), offset, length, crc))
+            pos += id_length
+        return entries
+
+    def _read_record(self, mm, thread_id, offset, length, crc):
+        payload = mm[offset:offset + length]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Prüfsumme von Thema '{thread_id}' in '{self.filename}' ungültig")
+        return json.loads(payload.decode('utf-8'))
+
+    def check(self):
+        """Validates header, footer and index; returns the number of threads."""
+        with self._open() as (_, entries, _):
+            return len(entries)
+
+    def keys(self):
+        with self._open() as (_, entries, _):
+            return [entry[0] for entry in entries]
+
+    def get(self, thread_id, default=None):
+        with self._open() as (mm, _, by_id):
+            location = by_id.get(thread_id)
+            return default if location is None else self._read_record(mm, thread_id, *location)
+
+    def items(self):
+        with self._open() as (mm, entries, _):
+            for entry in entries:
+                yield entry[0], self._read_record(mm, *entry)
+
+    def __iter__(self):
+        return self.items()
+
+def load_thread_store(filename):
+    """Opens a thread store: as thread model, or as re-iterable store in streaming mode."""
+    if not Path(filename).exists():
+        logging.error(f"Fehler: Datei '{filename}' nicht gefunden.")
+        return None
+    store = ThreadStore(filename)
+    try:
+        count = store.check()
+        logging.info(f"'{filename}' erfolgreich geöffnet ({count} Themen).")
+        return store if STREAM_INGEST else build_thread_model(store)
+    except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+        logging.error(f"Fehler beim Lesen des Themenspeichers '{filename}': {e}")
+        return None
+
+def save_thread_store_stream(thread_items, filename):
+    """
+    Writes (thread_id, thread_data) pairs to a thread store and passes them
+    through, like save_data_stream. The file only replaces an existing one once
+    all threads were written.
+    """
+    writer = ThreadStoreWriter(filename)
+    try:
+        for thread_id, thread_data in thread_items:
+            writer.write(thread_id, thread_data.to_dict() if isinstance(thread_data, ThreadView) else thread_data)
+            yield thread_id, thread_data
+    except BaseException:
+        writer.abort()
+        raise
+    count = writer.close()
+    logging.info(f"Daten erfolgreich in '{filename}' gespeichert ({count} Themen, Themenspeicher).")
+
+def save_thread_store(thread_items, filename):
+    """Writes all (thread_id, thread_data) pairs to a thread store; returns True on success."""
+    try:
+        for _ in save_thread_store_stream(thread_items, filename):
+            pass
+        return True
+    except Exception as e:
+        logging.error(f"Fehler beim Speichern in '{filename}': {e}")
+        return False
+
 def get_int_threshold(prompt, default=0):
     while True:
         try:
-            user_input = input(prompt + f" (Standard: {default}): ")
+            user_input = read_input(prompt + f" (Standard: {default}): ")
             if not user_input:
                 return default
             value = int(user_input)
@@ -121,7 +654,7 @@ def get_int_threshold(prompt, default=0):
 def get_date_input(prompt):
     while True:
         try:
-            user_input = input(prompt + " (Format DD.MM.YYYY, leer lassen für keine Grenze): ").strip()
+            user_input = read_input(prompt + " (Format DD.MM.YYYY, leer lassen für keine Grenze): ").strip()
             if not user_input:
                 return None
             # Use datetime.strptime to parse and then .date() to get only the date part
@@ -130,12 +663,47 @@ def get_date_input(prompt):
             print("Ungültiges Datumsformat. Bitte verwenden Sie DD.MM.YYYY oder lassen Sie das Feld leer.")
 
 def get_comma_separated_list(prompt):
-    user_input = input(prompt).strip()
+    user_input = read_input(prompt).strip()
     if user_input.lower() == '*alle*':
         return ['*alle*']
     # Split by comma, strip whitespace from each item, filter out empty strings
     return [item.strip() for item in user_input.split(',') if item.strip()] if user_input else []
 
+def ask_filter_parameters():
+    """Asks for all filter settings at once and returns them as a FilterSpec."""
+    print("Datumsbereich (leer lassen für keine Grenze):")
+    start_date = get_date_input("  Startdatum (einschließlich DD.MM.YYYY): ")
+    end_date = get_date_input("  Enddatum (einschließlich DD.MM.YYYY):   ")
+
+    print("\nThemen für Zeitlückenprüfung (kommasepariert: Kategorie/IDs ODER '*alle*'):")
+    filter_list = get_comma_separated_list("  Auswahl (leer=kein Split): ")
+    days_threshold = 0
+    if filter_list:
+        days_threshold = get_int_threshold("  Max. Tage Lücke für Split (0=kein Split): ", 0)
+
+    length_threshold = get_int_threshold("Min. Artikel-Gesamtlänge pro Thema (0=kein Filter): ", 0)
+    memberquote_threshold = get_int_threshold("Min. Länge einzelner Mitgliedszitate (0=kein Filter): ", 0)
+    return FilterSpec(
+        start_date=start_date,
+        end_date=end_date,
+        split_targets=filter_list,
+        split_gap_days=days_threshold,
+        min_article_length=length_threshold,
+        min_memberquote_length=memberquote_threshold,
+    )
+
+def get_filter_spec():
+    """Offers to replay the last saved FilterSpec, otherwise asks for new settings."""
+    saved_spec = load_filter_spec() if Path(FILTER_SPEC_FILE).exists() else None
+    if saved_spec is not None:
+        print(f"Gespeicherte Filtereinstellungen ('{FILTER_SPEC_FILE}'): {json.dumps(saved_spec.to_dict(), ensure_ascii=False)}")
+        while True:
+            choice = read_input("Wiederverwenden? [(j)a, (n)ein]: ").lower()
+            if choice == 'j': return saved_spec
+            if choice == 'n': break
+            print("Ungültige Wahl. Bitte 'j' oder 'n' eingeben.")
+    return ask_filter_parameters()
+
 def parse_date_safe(date_str):
     """Safely parses a date string in DD.MM.YYYY format."""
     if not isinstance(date_str, str): return None # Handle non-string inputs
@@ -160,239 +728,955 @@ def sanitize_filename(filename):
 
     return sanitized if sanitized else "unbenanntes_thema"
 
+# --- Datenmodell ---
+# Compact representation built once at load time: dates are parsed a single
+# time into ordinals, lengths are precomputed and repeated strings/tuples are
+# shared, so filters and prompt building never touch the raw dicts again.
+def _intern_tuple(values, table):
+    """Returns a shared tuple for equal contents (strings are interned as well)."""
+    values = tuple(sys.intern(v) if isinstance(v, str) else v for v in values)
+    try:
+        return table.setdefault(values, values)
+    except TypeError: # Unhashable content, keep the private tuple
+        return values
+
+class Post:
+    """One diary entry with its date parsed once (ordinal, None if invalid)."""
+    __slots__ = ('key', 'date_str', 'date_ord', 'article', 'article_len',
+                 'memberquotes', 'memberquote_lens', 'quotes', 'links', 'raw')
+
+    def __init__(self, key, post_data, table):
+        self.key = sys.intern(key) if isinstance(key, str) else key
+        self.raw = None
+        if not isinstance(post_data, dict):
+            # Malformed entry: kept as-is so the filters can report it like before
+            self.raw = post_data
+            self.date_str = self.article = self.memberquotes = self.memberquote_lens = self.quotes = self.links = None
+            self.date_ord = None
+            self.article_len = 0
+            return
+        self.date_str = post_data.get('date')
+        post_date = parse_date_safe(self.date_str)
+        self.date_ord = post_date.toordinal() if post_date else None
+        self.article = post_data.get('article')
+        self.article_len = len(self.article) if isinstance(self.article, str) else 0
+        member_quotes = post_data.get('memberquotes')
+        if isinstance(member_quotes, dict):
+            self.memberquotes = tuple((sys.intern(k), v) for k, v in member_quotes.items())
+            self.memberquote_lens = tuple(len(v) if isinstance(v, str) else None for v in member_quotes.values())
+        else:
+            self.memberquotes = self.memberquote_lens = None
+        quotes = post_data.get('quotes')
+        self.quotes = _intern_tuple(quotes, table) if isinstance(quotes, list) else None
+        links = post_data.get('links')
+        self.links = _intern_tuple(links, table) if isinstance(links, list) else None
+
+    @property
+    def is_valid(self):
+        return self.raw is None
+
+    @property
+    def date(self):
+        return date.fromordinal(self.date_ord) if self.date_ord is not None else None
+
+    def to_dict(self, dropped_quotes=frozenset()):
+        """Rebuilds the export format, leaving out masked member quotes."""
+        if not self.is_valid:
+            return self.raw
+        post = {}
+        if self.date_str is not None: post['date'] = self.date_str
+        if self.article is not None: post['article'] = self.article
+        if self.memberquotes is not None:
+            remaining = {k: v for k, v in self.memberquotes if k not in dropped_quotes}
+            if remaining or not dropped_quotes:
+                post['memberquotes'] = remaining
+        if self.quotes is not None: post['quotes'] = list(self.quotes)
+        if self.links is not None: post['links'] = list(self.links)
+        return post
+
+class Thread:
+    """One thread with its posts in diary order (posts is None without a valid diary)."""
+    __slots__ = ('thread_id', 'title', 'category', 'posts')
+
+    def __init__(self, thread_id, title, category, posts):
+        self.thread_id = thread_id
+        self.title = title
+        self.category = category
+        self.posts = posts
+
+    @classmethod
+    def from_dict(cls, thread_id, thread_data, table=None):
+        table = {} if table is None else table
+        diary = thread_data.get('diary')
+        posts = tuple(Post(k, v, table) for k, v in diary.items()) if isinstance(diary, dict) else None
+        category = thread_data.get('category')
+        return cls(thread_id, thread_data.get('title'),
+                   sys.intern(category) if isinstance(category, str) else category, posts)
+
+def build_thread_model(data):
+    """Converts the loaded export into {thread_id: Thread}, sharing repeated tuples."""
+    table = {}
+    model = {thread_id: Thread.from_dict(thread_id, thread_data, table) for thread_id, thread_data in data.items()}
+    logging.info(f"Datenmodell erstellt: {len(model)} Themen, {sum(len(t.posts or ()) for t in model.values())} Beiträge.")
+    return model
+
+# --- Thread-Ansichten ---
+class ThreadView:
+    """
+    Lightweight, non-mutating view of one thread: the selected posts, the
+    masked member quotes and an optional title/category override on top of the
+    untouched Thread. Filters derive new views instead of editing data.
+    """
+    __slots__ = ('thread_id', 'source', 'title', 'category', 'posts', 'dropped_quotes')
+
+    def __init__(self, thread_id, source, title=None, category=None, posts=None, dropped_quotes=None):
+        self.thread_id = thread_id
+        self.source = source
+        self.title = title
+        self.category = category
+        self.posts = posts # Selected Post objects, None if the source has no valid diary
+        self.dropped_quotes = dropped_quotes or {} # post key -> set of removed memberquote keys
+
+    @classmethod
+    def from_source(cls, thread_id, thread):
+        """Creates a view selecting all posts of a Thread (raw dicts are converted first)."""
+        if not isinstance(thread, Thread):
+            thread = Thread.from_dict(thread_id, thread)
+        return cls(thread_id, thread, thread.title, thread.category,
+                   list(thread.posts) if thread.posts is not None else None)
+
+    def derive(self, **changes):
+        """Returns a copy of this view with some attributes replaced."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return ThreadView(**fields)
+
+    @property
+    def has_diary(self):
+        return self.posts is not None
+
+    def member_quotes(self, post):
+        """Yields the (key, text) member quotes of a post that are not masked."""
+        dropped = self.dropped_quotes.get(post.key, ())
+        for key, text in post.memberquotes or ():
+            if key not in dropped:
+                yield key, text
+
+    def to_dict(self):
+        """Materializes the view as a thread dict in the export format."""
+        thread = {}
+        if self.title is not None: thread['title'] = self.title
+        if self.category is not None: thread['category'] = self.category
+        if self.has_diary:
+            thread['diary'] = {p.key: p.to_dict(self.dropped_quotes.get(p.key, frozenset())) for p in self.posts}
+        return thread
+
+def make_thread_views(data):
+    """Wraps a thread model (or raw thread dict) into views without copying any post data."""
+    return {thread_id: ThreadView.from_source(thread_id, thread) for thread_id, thread in data.items()}
+
+def materialize_threads(views):
+    """Turns a view mapping back into a plain thread dict (e.g. for saving)."""
+    return {thread_id: view.to_dict() for thread_id, view in views.items()}
+
 # --- Filterfunktionen ---
+# Filters take and return {thread_id: ThreadView} mappings and never modify the
+# source data, so re-filtering does not require a copy of the export. Each
+# filter is split into a per-thread step (shared with the streaming pipeline)
+# and a wrapper applying it to all threads.
+def _view_article_length(view):
+    if not view.has_diary: return None # Diary is missing or not a dict
+    return sum(p.article_len for p in view.posts)
+
 def filter_by_total_article_length(data, threshold):
     if threshold <= 0: return data
-    threads_to_delete = []
+    result = {}
     original_count = len(data)
     logging.info(f"Filtere Artikelgesamtlänge (< {threshold} Zeichen)...")
-    for thread_id, thread_data in data.items():
-        # Ensure 'diary' exists and is a dictionary
-        diary = thread_data.get('diary')
-        if not isinstance(diary, dict): continue # Skip if diary is missing or not a dict
-
-        total_length = sum(len(p.get('article', '')) for p in diary.values() if isinstance(p, dict))
-        if total_length < threshold:
-            threads_to_delete.append(thread_id)
+    for thread_id, view in data.items():
+        total_length = _view_article_length(view)
+        if total_length is not None and total_length < threshold:
+            _log_thread_too_short(thread_id, view.title, total_length, threshold)
+            continue
+        result[thread_id] = view
+    ITEM_EVENTS.log_summary()
+    logging.info(f"Artikelgesamtlänge: {original_count - len(result)} von {original_count} Themen entfernt.")
+    return result
 
-    for thread_id in threads_to_delete:
-        logging.info(f"LÖSCHE Thema '{thread_id}' ({data[thread_id].get('title', 'Unbekannt')}): Artikellänge ({sum(len(p.get('article', '')) for p in data[thread_id].get('diary', {}).values())}) < {threshold}")
-        del data[thread_id]
-    logging.info(f"Artikelgesamtlänge: {len(threads_to_delete)} von {original_count} Themen entfernt.")
-    return data
+def _filter_view_memberquotes(view, threshold):
+    """Masks too short member quotes of one thread; returns (view, number removed)."""
+    deleted_quotes_count = 0
+    dropped_quotes = dict(view.dropped_quotes)
+    for post in view.posts or ():
+        if not post.memberquotes: continue
+        already_dropped = dropped_quotes.get(post.key, frozenset())
+        quotes_to_delete = set()
+        for (key, _), quote_len in zip(post.memberquotes, post.memberquote_lens):
+            # Only string quotes have a length
+            if quote_len is not None and quote_len < threshold and key not in already_dropped:
+                quotes_to_delete.add(key)
+                ITEM_EVENTS.log("quote_removed", logging.DEBUG, "LÖSCHE Mitgliedszitat '%s' in Post '%s', Thema '%s': Länge < %d",
+                                key, post.key, view.thread_id, threshold)
+        if quotes_to_delete:
+            dropped_quotes[post.key] = already_dropped | quotes_to_delete
+            deleted_quotes_count += len(quotes_to_delete)
+    if not deleted_quotes_count:
+        return view, 0
+    return view.derive(dropped_quotes=dropped_quotes), deleted_quotes_count
 
 def filter_by_memberquote_length(data, threshold):
     if threshold <= 0: return data
     logging.info(f"Filtere Mitgliedszitatlänge (< {threshold} Zeichen)...")
+    result = {}
     deleted_quotes_count = 0
-    for thread_id, thread_data in data.items():
-        diary = thread_data.get('diary')
-        if isinstance(diary, dict):
-            for post_key, post_data in diary.items():
-                 if isinstance(post_data, dict) and 'memberquotes' in post_data and isinstance(post_data['memberquotes'], dict):
-                    quotes_to_delete = []
-                    for k, v in post_data['memberquotes'].items():
-                         # Ensure value is a string before checking length
-                         if isinstance(v, str) and len(v) < threshold:
-                              quotes_to_delete.append(k)
-                    for key in quotes_to_delete:
-                        logging.debug(f"LÖSCHE Mitgliedszitat '{key}' in Post '{post_key}', Thema '{thread_id}': Länge < {threshold}")
-                        del post_data['memberquotes'][key]
-                        deleted_quotes_count += 1
-                    # Remove 'memberquotes' dict if it becomes empty
-                    if not post_data['memberquotes']:
-                        del post_data['memberquotes']
+    for thread_id, view in data.items():
+        result[thread_id], deleted = _filter_view_memberquotes(view, threshold)
+        deleted_quotes_count += deleted
+    ITEM_EVENTS.log_summary()
     logging.info(f"Mitgliedszitatlänge: {deleted_quotes_count} Zitate entfernt.")
-    return data
+    return result
 
-def filter_by_date_range(data, start_date, end_date):
-    if start_date is None and end_date is None: return data
+def _date_range_labels(start_date, end_date):
     start_str = start_date.strftime('%d.%m.%Y') if start_date else "Anfang"
     end_str = end_date.strftime('%d.%m.%Y') if end_date else "Ende"
+    return start_str, end_str
+
+def _filter_view_by_date(view, start_date, end_date):
+    """Drops posts outside the date range from one thread; returns (view, number removed)."""
+    if not view.has_diary: return view, 0
+    start_str, end_str = _date_range_labels(start_date, end_date)
+    start_ord = start_date.toordinal() if start_date else None
+    end_ord = end_date.toordinal() if end_date else None
+    kept_posts = []
+    for post in view.posts:
+        if not post.is_valid: # Keep invalid post data untouched
+            kept_posts.append(post)
+            continue
+        reason = ""
+        if post.date_ord is None:
+            _log_invalid_post_date(post.date_str, post.key, view.thread_id)
+        elif start_ord is not None and post.date_ord < start_ord:
+            reason = f"vor {start_str}"
+        elif end_ord is not None and post.date_ord > end_ord:
+            reason = f"nach {end_str}"
+
+        if reason:
+            _log_post_removed(post.key, view.thread_id, start_str, end_str, post.date_str, reason)
+        else:
+            kept_posts.append(post)
+
+    deleted = len(view.posts) - len(kept_posts)
+    if not deleted:
+        return view, 0
+    return view.derive(posts=kept_posts), deleted
+
+def filter_by_date_range(data, start_date, end_date):
+    if start_date is None and end_date is None: return data
+    start_str, end_str = _date_range_labels(start_date, end_date)
     logging.info(f"Filtere Beiträge außerhalb des Zeitraums: {start_str} bis {end_str}...")
+    result = {}
     deleted_posts_count = 0
-    threads_potentially_empty = []
-
-    for thread_id, thread_data in data.items():
-        diary = thread_data.get('diary')
-        if isinstance(diary, dict):
-            posts_to_delete = []
-            for post_key, post_data in diary.items():
-                if not isinstance(post_data, dict): continue # Skip invalid post data
-                post_date_str = post_data.get('date')
-                post_date = parse_date_safe(post_date_str)
-                delete_post = False
-                reason = ""
-
-                if post_date is None:
-                    logging.warning(f"Ungültiges oder fehlendes Datum '{post_date_str}' in Post '{post_key}', Thema '{thread_id}'. Beitrag wird beibehalten.")
-                    continue # Keep posts with invalid dates
-
-                if start_date and post_date < start_date:
-                    delete_post = True
-                    reason = f"vor {start_str}"
-                elif end_date and post_date > end_date:
-                    delete_post = True
-                    reason = f"nach {end_str}"
-
-                if delete_post:
-                    posts_to_delete.append(post_key)
-                    logging.debug(f"Markiere Post '{post_key}' in Thema '{thread_id}' zum Löschen (Datum: {post_date_str}, Grund: {reason}).")
-
-            if posts_to_delete:
-                for key in posts_to_delete:
-                     if key in data[thread_id]['diary']: # Check existence before deleting
-                         del data[thread_id]['diary'][key]
-                         deleted_posts_count += 1
-                         logging.info(f"LÖSCHE Post '{key}' in '{thread_id}' - Außerhalb {start_str}-{end_str}")
-                # If posts were deleted, mark the thread for potential emptiness check
-                if not data[thread_id]['diary']:
-                     threads_potentially_empty.append(thread_id)
-
-    # Check threads marked as potentially empty and remove them if they are truly empty
     deleted_empty_threads_count = 0
-    for thread_id in threads_potentially_empty:
-        # Ensure the thread still exists and its diary is empty
-        if thread_id in data and isinstance(data[thread_id].get('diary'), dict) and not data[thread_id]['diary']:
-           logging.info(f"LÖSCHE Thema '{thread_id}' ({data[thread_id].get('title', 'Unbekannt')}): Keine Posts nach Datumsfilter.")
-           del data[thread_id]
-           deleted_empty_threads_count +=1
 
+    for thread_id, view in data.items():
+        view, deleted = _filter_view_by_date(view, start_date, end_date)
+        deleted_posts_count += deleted
+        # Remove threads that were emptied by the date filter
+        if deleted and not view.posts:
+            _log_thread_emptied(thread_id, view.title)
+            deleted_empty_threads_count += 1
+            continue
+        result[thread_id] = view
+
+    ITEM_EVENTS.log_summary()
     logging.info(f"Datumsfilter: {deleted_posts_count} Beiträge entfernt. {deleted_empty_threads_count} Themen wurden dadurch geleert und entfernt.")
-    return data
+    return result
+
+def _parse_split_filter(filter_list):
+    """Returns (split_all, filter_ids, filter_categories) for the split selection."""
+    if '*alle*' in filter_list:
+        return True, set(), set()
+    # Separate categories and IDs from the user input
+    filter_categories = {item.lower() for item in filter_list if not item.replace('_','').isalnum() or not any(char.isdigit() for char in item)} # Allow underscore in IDs
+    filter_ids = {item for item in filter_list if item not in filter_categories}
+    return False, filter_ids, filter_categories
+
+def _is_split_target(view, split_filter):
+    split_all, filter_ids, filter_categories = split_filter
+    return split_all or view.thread_id in filter_ids or (view.category or '').lower() in filter_categories
+
+def _split_view_by_time_gap(view, days_threshold):
+    """
+    Splits one thread at gaps larger than days_threshold. The first part keeps
+    the original ID, further parts get '_partN' IDs.
+    Returns ([(thread_id, view), ...], split_count).
+    """
+    thread_id = view.thread_id
+    title = view.title or 'Unbekannt'
+    category = view.category or 'Unkategorisiert'
+
+    # Check if splitting is feasible
+    if not view.has_diary or len(view.posts) < 2:
+        return [(thread_id, view)], 0 # Skip if no diary or less than 2 posts
+
+    logging.debug("Prüfe '%s' (%s) auf Zeitlücken...", thread_id, title)
+
+    # Sort posts by date
+    valid_posts = []
+    for post in view.posts:
+         if not post.is_valid:
+              _log_invalid_post(post.key, thread_id, "Zeitlückenprüfung")
+         elif post.date_ord is None:
+              _log_undated_post(post.key, thread_id)
+         else:
+              valid_posts.append(post)
+
+    if len(valid_posts) < 2:
+         logging.debug("Thema '%s' hat weniger als 2 Posts mit gültigem Datum. Überspringe Split.", thread_id)
+         return [(thread_id, view)], 0 # Not enough valid posts to compare dates
+
+    sorted_posts = sorted(valid_posts, key=lambda post: post.date_ord)
+
+    # --- Splitting Logic ---
+    parts = [[sorted_posts[0]]]
+    for previous, post in zip(sorted_posts, sorted_posts[1:]):
+        gap_days = post.date_ord - previous.date_ord
+        if gap_days > days_threshold:
+            # --- GAP DETECTED - start a new part ---
+            ITEM_EVENTS.log("split", logging.INFO, "SPLIT in '%s' nach Post vom %s vor Post vom %s: %d Tage Lücke. Erstelle '%s Teil %d'.",
+                            thread_id, previous.date.strftime('%d.%m.%Y'), post.date.strftime('%d.%m.%Y'), gap_days, title, len(parts))
+            parts.append([])
+        parts[-1].append(post)
+
+    # --- Finalize the parts ---
+    # Only add "Teil X" if a split occurred; the first part keeps the original thread ID.
+    # Posts without a valid date are not part of any split result.
+    if len(parts) == 1:
+        return [(thread_id, view.derive(title=title, posts=parts[0]))], 0
+
+    result = [(thread_id, view.derive(title=f"{title} Teil 1", posts=parts[0]))]
+    for index, part_posts in enumerate(parts[1:], start=2):
+        new_thread_id = f"{thread_id}_part{index}"
+        logging.debug("Erstelle neuen Teil: '%s' für '%s Teil %d'", new_thread_id, title, index)
+        result.append((new_thread_id, view.derive(thread_id=new_thread_id, title=f"{title} Teil {index}",
+                                                  category=category, posts=part_posts)))
+    return result, len(parts) - 1
 
 def split_threads_by_time_gap(data, filter_list, days_threshold):
     if days_threshold <= 0 or not filter_list: return data
 
-    split_all = '*alle*' in filter_list
+    split_filter = _parse_split_filter(filter_list)
+    split_all, filter_ids, filter_categories = split_filter
     if split_all:
         logging.info(f"Prüfe *ALLE* Themen auf Aufteilung bei Zeitlücken > {days_threshold} Tage...")
-        # Create a list of all valid thread IDs to iterate over if '*alle*' is selected
-        target_thread_ids = list(data.keys())
     else:
-        # Separate categories and IDs from the user input
-        filter_categories = {item.lower() for item in filter_list if not item.replace('_','').isalnum() or not any(char.isdigit() for char in item)} # Allow underscore in IDs
-        filter_ids = {item for item in filter_list if item not in filter_categories}
         logging.info(f"Prüfe Themen (IDs: {filter_ids}, Kategorien: {filter_categories}) auf Aufteilung bei Zeitlücken > {days_threshold} Tage...")
-        # Determine target threads based on IDs or categories
-        target_thread_ids = [
-            tid for tid, tdata in data.items()
-            if tid in filter_ids or tdata.get('category', '').lower() in filter_categories
-        ]
 
     split_count = 0
-    newly_created_threads = {} # Store newly created parts here temporarily
-
-    # Iterate only over the target threads
-    for thread_id in target_thread_ids:
-        if thread_id not in data: continue # Thread might have been deleted by previous filters
-
-        thread_data = data[thread_id]
-        title = thread_data.get('title', 'Unbekannt')
-        category = thread_data.get('category', 'Unkategorisiert')
-        diary = thread_data.get('diary')
-
-        # Check if splitting is feasible
-        if not isinstance(diary, dict) or len(diary) < 2:
-            continue # Skip if no diary or less than 2 posts
-
-        logging.debug(f"Prüfe '{thread_id}' ({title}) auf Zeitlücken...")
-
-        # Sort posts by date
-        valid_posts = []
-        for item in diary.items():
-             post_key, post_data = item
-             if isinstance(post_data, dict):
-                  post_date = parse_date_safe(post_data.get('date'))
-                  if post_date:
-                       valid_posts.append((post_key, post_data, post_date))
-                  else:
-                       logging.warning(f"Post '{post_key}' in Thema '{thread_id}' hat ungültiges Datum, wird beim Sortieren ignoriert.")
-             else:
-                  logging.warning(f"Ungültiger Post-Eintrag (kein dict) bei Schlüssel '{post_key}' in Thema '{thread_id}'.")
+    result = {}
+    newly_created_threads = {} # Newly created parts are appended after all existing threads
 
+    for thread_id, view in data.items():
+        if not _is_split_target(view, split_filter):
+            result[thread_id] = view
+            continue
+        parts, thread_split_count = _split_view_by_time_gap(view, days_threshold)
+        split_count += thread_split_count
+        result[thread_id] = parts[0][1]
+        newly_created_threads.update(parts[1:])
 
-        if len(valid_posts) < 2:
-             logging.debug(f"Thema '{thread_id}' hat weniger als 2 Posts mit gültigem Datum. Überspringe Split.")
-             continue # Not enough valid posts to compare dates
-
-        sorted_posts = sorted(valid_posts, key=lambda item: item[2]) # Sort by the parsed date (item[2])
-
-        # --- Splitting Logic ---
-        current_part_index = 1
-        original_thread_id_base = thread_id # Keep track of the original ID
-        current_part_posts = {} # Dictionary to hold posts for the current part
-        last_post_date = sorted_posts[0][2] # Date of the first post in the current part
-        current_part_posts[sorted_posts[0][0]] = sorted_posts[0][1] # Add first post
-
-        current_part_thread_id = original_thread_id_base # ID for the first part
-
-        for i in range(1, len(sorted_posts)):
-            post_key, post_data, current_post_date = sorted_posts[i]
-            time_diff = current_post_date - last_post_date
+    if newly_created_threads:
+         logging.info(f"Füge {len(newly_created_threads)} neu erstellte Thread-Teile hinzu.")
+         result.update(newly_created_threads)
 
-            if time_diff.days > days_threshold:
-                # --- GAP DETECTED - Finalize the previous part ---
-                split_count += 1
-                part_title = f"{title} Teil {current_part_index}"
-                logging.info(f"SPLIT in '{original_thread_id_base}' nach Post vom {last_post_date.strftime('%d.%m.%Y')} vor Post vom {current_post_date.strftime('%d.%m.%Y')}: {time_diff.days} Tage Lücke. Erstelle '{part_title}'.")
+    ITEM_EVENTS.log_summary()
+    logging.info(f"Themenaufteilung abgeschlossen: {split_count} Aufteilungen durchgeführt.")
+    return result
+
+# --- Filter-Pipeline ---
+FILTER_STAGES = ("date", "split", "article_length", "memberquote_length")
+
+@dataclass
+class FilterSpec:
+    """Declarative description of one filter run; can be saved as JSON and replayed."""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    split_targets: List[str] = field(default_factory=list) # Categories/IDs or ['*alle*']
+    split_gap_days: int = 0
+    min_article_length: int = 0
+    min_memberquote_length: int = 0
+
+    @property
+    def split_active(self):
+        return bool(self.split_targets) and self.split_gap_days > 0
+
+    def to_dict(self):
+        return {
+            "start_date": self.start_date.strftime('%d.%m.%Y') if self.start_date else None,
+            "end_date": self.end_date.strftime('%d.%m.%Y') if self.end_date else None,
+            "split_targets": list(self.split_targets),
+            "split_gap_days": self.split_gap_days,
+            "min_article_length": self.min_article_length,
+            "min_memberquote_length": self.min_memberquote_length,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        """Builds a spec from its JSON form; raises ValueError on invalid values."""
+        def as_date(value):
+            return datetime.strptime(value, '%d.%m.%Y').date() if value else None
+        def as_threshold(name):
+            value = int(values.get(name) or 0)
+            if value < 0: raise ValueError(f"'{name}' darf nicht negativ sein")
+            return value
+        targets = values.get("split_targets") or []
+        if isinstance(targets, str):
+            targets = [item.strip() for item in targets.split(',') if item.strip()]
+        return cls(
+            start_date=as_date(values.get("start_date")),
+            end_date=as_date(values.get("end_date")),
+            split_targets=list(targets),
+            split_gap_days=as_threshold("split_gap_days"),
+            min_article_length=as_threshold("min_article_length"),
+            min_memberquote_length=as_threshold("min_memberquote_length"),
+        )
+
+def save_filter_spec(spec, filename=FILTER_SPEC_FILE):
+    return save_data(spec.to_dict(), filename)
+
+def load_filter_spec(filename=FILTER_SPEC_FILE):
+    """Loads a saved FilterSpec, or None if missing/invalid."""
+    values = load_data(filename)
+    if values is None: return None
+    try:
+        return FilterSpec.from_dict(values)
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.error(f"Ungültige Filterspezifikation in '{filename}': {e}")
+        return None
 
-                # Update the diary and title of the *previous* part
-                if current_part_thread_id == original_thread_id_base:
-                    # This is the original thread ID, update it directly in 'data'
-                    if current_part_thread_id in data:
-                         data[current_part_thread_id]['title'] = part_title
-                         data[current_part_thread_id]['diary'] = current_part_posts
-                else:
-                    # This part was newly created, update it in 'newly_created_threads'
-                     if current_part_thread_id in newly_created_threads:
-                          newly_created_threads[current_part_thread_id]['title'] = part_title
-                          newly_created_threads[current_part_thread_id]['diary'] = current_part_posts
-
-                # --- Start the NEW part ---
-                current_part_index += 1
-                new_thread_id = f"{original_thread_id_base}_part{current_part_index}"
-                new_title_placeholder = f"{title} Teil {current_part_index} (Platzhalter)"
-                logging.debug(f"Erstelle neuen Teil: '{new_thread_id}' für '{new_title_placeholder}'")
-
-                # Add the new part structure to the temporary dict
-                newly_created_threads[new_thread_id] = {
-                    "title": new_title_placeholder, # Placeholder title for now
-                    "category": category,
-                    "diary": {} # Start with empty diary for the new part
-                }
-
-                # Reset for the new part
-                current_part_posts = {post_key: post_data} # Start with the current post
-                current_part_thread_id = new_thread_id # Update the ID we are working on
+def new_filter_stats():
+    """Per-stage counters of removed posts/quotes/threads (and created parts)."""
+    stats = {stage: {"threads_removed": 0, "posts_removed": 0, "quotes_removed": 0, "parts_created": 0} for stage in FILTER_STAGES}
+    stats["threads_in"] = 0
+    stats["threads_out"] = 0
+    return stats
+
+def log_filter_stats(stats):
+    ITEM_EVENTS.log_summary()
+    logging.info(f"Filter-Pipeline: {stats['threads_out']} von {stats['threads_in']} Themen übrig.")
+    for stage in FILTER_STAGES:
+        s = stats[stage]
+        logging.info(f"  {stage}: {s['threads_removed']} Themen, {s['posts_removed']} Beiträge, {s['quotes_removed']} Zitate entfernt, {s['parts_created']} Teile erstellt.")
+
+def _apply_spec_to_view(view, spec, split_filter, stats):
+    """
+    Runs all stages of the spec on one thread in a single traversal
+    (date -> split -> article length -> quote length).
+    Returns the surviving [(thread_id, view), ...]; the first entry keeps the original ID.
+    """
+    # 1. Date range
+    if spec.start_date is not None or spec.end_date is not None:
+        view, deleted = _filter_view_by_date(view, spec.start_date, spec.end_date)
+        stats["date"]["posts_removed"] += deleted
+        if deleted and not view.posts:
+            _log_thread_emptied(view.thread_id, view.title)
+            stats["date"]["threads_removed"] += 1
+            return []
+
+    # 2. Split by time gap
+    parts = [(view.thread_id, view)]
+    if split_filter and _is_split_target(view, split_filter):
+        parts, split_count = _split_view_by_time_gap(view, spec.split_gap_days)
+        stats["split"]["parts_created"] += split_count
+
+    survivors = []
+    for part_id, part_view in parts:
+        # 3. Total article length
+        if spec.min_article_length > 0:
+            total_length = _view_article_length(part_view)
+            if total_length is not None and total_length < spec.min_article_length:
+                _log_thread_too_short(part_id, part_view.title, total_length, spec.min_article_length)
+                stats["article_length"]["threads_removed"] += 1
+                stats["article_length"]["posts_removed"] += len(part_view.posts)
+                continue
+        # 4. Member quote length
+        if spec.min_memberquote_length > 0:
+            part_view, deleted = _filter_view_memberquotes(part_view, spec.min_memberquote_length)
+            stats["memberquote_length"]["quotes_removed"] += deleted
+        survivors.append((part_id, part_view))
+    return survivors
+
+def _as_view(thread_id, thread):
+    return thread if isinstance(thread, ThreadView) else ThreadView.from_source(thread_id, thread)
+
+def apply_filter_spec(data, spec):
+    """
+    Applies the spec to {thread_id: Thread/ThreadView} in one traversal per thread.
+    Keeps today's ordering: split parts are appended after all original threads.
+    Returns ({thread_id: ThreadView}, stats).
+    """
+    stats = new_filter_stats()
+    split_filter = _parse_split_filter(spec.split_targets) if spec.split_active else None
+    results = ((thread_id, _apply_spec_to_view(_as_view(thread_id, thread), spec, split_filter, stats))
+               for thread_id, thread in data.items())
+    result = merge_filter_results(data.keys(), results)
+    stats["threads_in"] = len(data)
+    stats["threads_out"] = len(result)
+    log_filter_stats(stats)
+    return result, stats
+
+def merge_filter_results(input_ids, results):
+    """
+    Builds the filtered mapping from (thread_id, survivors) in input order:
+    the surviving threads first, then all split parts. A part ID that already
+    names an input thread or an earlier part gets a numeric suffix, so no
+    thread is replaced by a part.
+    """
+    result = {}
+    new_parts = []
+    for thread_id, survivors in results:
+        for part_id, part_view in survivors:
+            if part_id == thread_id:
+                result[part_id] = part_view
             else:
-                # No gap, add post to the current part's diary
-                current_part_posts[post_key] = post_data
-
-            # Update last_post_date for the next iteration
-            last_post_date = current_post_date
-
-        # --- Finalize the LAST part ---
-        # After the loop, assign the collected posts to the last part's diary and set its final title
-        final_part_title = f"{title} Teil {current_part_index}" if current_part_index > 1 else title # Only add "Teil X" if split occurred
-        if current_part_thread_id == original_thread_id_base:
-             if current_part_thread_id in data:
-                  data[current_part_thread_id]['title'] = final_part_title
-                  data[current_part_thread_id]['diary'] = current_part_posts
-        else:
-             if current_part_thread_id in newly_created_threads:
-                  newly_created_threads[current_part_thread_id]['title'] = final_part_title
-                  newly_created_threads[current_part_thread_id]['diary'] = current_part_posts
+                new_parts.append((part_id, part_view))
+    taken = set(input_ids)
+    for part_id, part_view in new_parts:
+        unique_id, part_view = _unique_part(part_id, part_view, taken)
+        result[unique_id] = part_view
+    return result
+
+def _unique_part(part_id, part_view, taken):
+    """
+    Split part with an ID that is not in taken (input thread IDs and earlier
+    parts): a numeric suffix is appended if needed. Adds the ID to taken and
+    returns (part_id, part_view).
+    """
+    unique_id, number = part_id, 2
+    while unique_id in taken:
+        unique_id = f"{part_id}_{number}"
+        number += 1
+    if unique_id != part_id:
+        logging.warning(f"Teil-ID '{part_id}' ist bereits vergeben, der Teil erhält die ID '{unique_id}'.")
+        part_view = part_view.derive(thread_id=unique_id)
+    taken.add(unique_id)
+    return unique_id, part_view
+
+def iter_filtered_threads(thread_items, spec, stats=None, input_ids=None):
+    """
+    Streaming variant of apply_filter_spec: consumes (thread_id, thread) pairs
+    one at a time and yields (thread_id, ThreadView) for the surviving threads
+    and parts (parts directly follow their thread), so memory is bounded by a
+    single thread. Pass a dict from new_filter_stats() to collect statistics.
+    With a split, pass all input_ids so part IDs can be kept unique (as in
+    merge_filter_results); otherwise only the threads read so far are known.
+    """
+    stats = new_filter_stats() if stats is None else stats
+    split_filter = _parse_split_filter(spec.split_targets) if spec.split_active else None
+    taken = set(input_ids or ())
+    for thread_id, thread in thread_items:
+        stats["threads_in"] += 1
+        taken.add(thread_id)
+        for part_id, part_view in _apply_spec_to_view(_as_view(thread_id, thread), spec, split_filter, stats):
+            if part_id != thread_id:
+                part_id, part_view = _unique_part(part_id, part_view, taken)
+            stats["threads_out"] += 1
+            yield part_id, part_view
+    log_filter_stats(stats)
+
+
+# --- SQLite-Themendatenbank (optional) ---
+def _db_value(value):
+    # Scalars are stored natively; anything else (never produced by allmy_monkey.js) as JSON text
+    return value if value is None or isinstance(value, (str, int, float)) else json.dumps(value, ensure_ascii=False)
+
+class ThreadDatabase:
+    """
+    Normalized copy of the export (threads, posts, member quotes, quotes, links)
+    in SQLite. The filter stage selects posts and threads with indexed queries
+    and only the surviving threads are loaded into Thread objects, one at a time.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = sqlite3.connect(filename)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS threads (
+                seq INTEGER PRIMARY KEY, thread_id TEXT NOT NULL, title, category,
+                category_lower TEXT, has_diary INTEGER, article_total INTEGER);
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY, thread_seq INTEGER NOT NULL, seq INTEGER, key,
+                date_str, date_ord INTEGER, article, article_len INTEGER,
+                has_memberquotes INTEGER, has_quotes INTEGER, has_links INTEGER, raw_json TEXT);
+            CREATE TABLE IF NOT EXISTS memberquotes (post_id INTEGER, seq INTEGER, key, text, length INTEGER);
+            CREATE TABLE IF NOT EXISTS quotes (post_id INTEGER, seq INTEGER, text);
+            CREATE TABLE IF NOT EXISTS links (post_id INTEGER, seq INTEGER, url);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_threads_thread_id ON threads(thread_id);
+            CREATE INDEX IF NOT EXISTS idx_threads_category ON threads(category_lower);
+            CREATE INDEX IF NOT EXISTS idx_threads_article_total ON threads(article_total);
+            CREATE INDEX IF NOT EXISTS idx_posts_thread ON posts(thread_seq, date_ord, article_len);
+            CREATE INDEX IF NOT EXISTS idx_posts_date ON posts(date_ord);
+            CREATE INDEX IF NOT EXISTS idx_posts_article_len ON posts(article_len);
+            CREATE INDEX IF NOT EXISTS idx_memberquotes_post ON memberquotes(post_id, seq);
+            CREATE INDEX IF NOT EXISTS idx_quotes_post ON quotes(post_id, seq);
+            CREATE INDEX IF NOT EXISTS idx_links_post ON links(post_id, seq);
+        """)
+
+    def close(self):
+        self._conn.close()
+
+    def ingest(self, filename):
+        """Imports the export (streamed thread by thread) unless it is unchanged since the last import."""
+        source = Path(filename)
+        stat = source.stat()
+        signature = f"{source.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if row and row[0] == signature:
+            logging.info(f"Themendatenbank '{self.filename}' ist aktuell, kein erneuter Import von '{filename}'.")
+            return False
+
+        logging.info(f"Importiere '{filename}' in die Themendatenbank '{self.filename}'...")
+        conn = self._conn
+        with conn:
+            for table in ("threads", "posts", "memberquotes", "quotes", "links", "meta"):
+                conn.execute(f"DELETE FROM {table}")
+        thread_count = post_count = 0
+        with conn:
+            for thread_seq, (thread_id, thread_data) in enumerate(iter_threads(filename)):
+                self._insert_thread(thread_seq, thread_id, thread_data)
+                diary = thread_data.get('diary')
+                thread_count += 1
+                post_count += len(diary) if isinstance(diary, dict) else 0
+            conn.execute("INSERT INTO meta (key, value) VALUES ('source', ?)", (signature,))
+        conn.execute("ANALYZE")
+        logging.info(f"Import abgeschlossen: {thread_count} Themen, {post_count} Beiträge.")
+        return True
 
+    def _insert_thread(self, thread_seq, thread_id, thread_data):
+        conn = self._conn
+        diary = thread_data.get('diary')
+        category = thread_data.get('category')
+        article_total = 0
+        if isinstance(diary, dict):
+            for post_seq, (key, post_data) in enumerate(diary.items()):
+                article_total += self._insert_post(thread_seq, post_seq, key, post_data)
+        conn.execute(
+            "INSERT INTO threads (seq, thread_id, title, category, category_lower, has_diary, article_total)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (thread_seq, str(thread_id), _db_value(thread_data.get('title')), _db_value(category),
+             (category or '').lower() if isinstance(category, str) or category is None else None,
+             int(isinstance(diary, dict)), article_total if isinstance(diary, dict) else None))
+
+    def _insert_post(self, thread_seq, post_seq, key, post_data):
+        conn = self._conn
+        if not isinstance(post_data, dict): # Malformed entry, kept as-is
+            conn.execute("INSERT INTO posts (thread_seq, seq, key, article_len, raw_json) VALUES (?, ?, ?, 0, ?)",
+                         (thread_seq, post_seq, key, json.dumps(post_data, ensure_ascii=False)))
+            return 0
+        date_str = post_data.get('date')
+        post_date = parse_date_safe(date_str)
+        article = post_data.get('article')
+        article_len = len(article) if isinstance(article, str) else 0
+        member_quotes = post_data.get('memberquotes')
+        quotes = post_data.get('quotes')
+        links = post_data.get('links')
+        cursor = conn.execute(
+            "INSERT INTO posts (thread_seq, seq, key, date_str, date_ord, article, article_len,"
+            " has_memberquotes, has_quotes, has_links) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_seq, post_seq, key, _db_value(date_str), post_date.toordinal() if post_date else None,
+             _db_value(article), article_len, int(isinstance(member_quotes, dict)),
+             int(isinstance(quotes, list)), int(isinstance(links, list))))
+        post_id = cursor.lastrowid
+        if isinstance(member_quotes, dict):
+            conn.executemany("INSERT INTO memberquotes (post_id, seq, key, text, length) VALUES (?, ?, ?, ?, ?)",
+                             [(post_id, i, k, _db_value(v), len(v) if isinstance(v, str) else None)
+                              for i, (k, v) in enumerate(member_quotes.items())])
+        if isinstance(quotes, list):
+            conn.executemany("INSERT INTO quotes (post_id, seq, text) VALUES (?, ?, ?)",
+                             [(post_id, i, _db_value(v)) for i, v in enumerate(quotes)])
+        if isinstance(links, list):
+            conn.executemany("INSERT INTO links (post_id, seq, url) VALUES (?, ?, ?)",
+                             [(post_id, i, _db_value(v)) for i, v in enumerate(links)])
+        return article_len
+
+    @staticmethod
+    def date_condition(start_date, end_date):
+        """SQL condition (on table alias p) keeping posts inside the range, undated and malformed posts."""
+        bounds, params = [], []
+        if start_date is not None:
+            bounds.append("p.date_ord >= ?"); params.append(start_date.toordinal())
+        if end_date is not None:
+            bounds.append("p.date_ord <= ?"); params.append(end_date.toordinal())
+        if not bounds:
+            return "1", []
+        return f"(p.date_ord IS NULL OR ({' AND '.join(bounds)}))", params
+
+    def iter_posts_outside(self, start_date, end_date):
+        """Yields (thread_id, post key, date_str, date_ord) of posts outside the range (date index)."""
+        ranges, params = [], []
+        if start_date is not None:
+            ranges.append("p.date_ord < ?"); params.append(start_date.toordinal())
+        if end_date is not None:
+            ranges.append("p.date_ord > ?"); params.append(end_date.toordinal())
+        if not ranges:
+            return
+        yield from self._conn.execute(
+            f"SELECT t.thread_id, p.key, p.date_str, p.date_ord FROM posts p JOIN threads t ON t.seq = p.thread_seq"
+            f" WHERE {' OR '.join(ranges)} ORDER BY p.thread_seq, p.seq", params)
+
+    def split_target_seqs(self, split_filter):
+        """Threads selected for splitting (thread_id and category indexes)."""
+        split_all, filter_ids, filter_categories = split_filter
+        if split_all:
+            return None # All threads
+        ids, categories = sorted(filter_ids), sorted(filter_categories)
+        rows = self._conn.execute(
+            f"SELECT seq FROM threads WHERE thread_id IN ({','.join('?' * len(ids))})"
+            f" OR category_lower IN ({','.join('?' * len(categories))})", ids + categories)
+        return {seq for (seq,) in rows}
+
+    def iter_thread_rows(self, start_date, end_date):
+        """Yields (seq, thread_id, title, category, has_diary, kept posts, article total) in export order."""
+        condition, params = self.date_condition(start_date, end_date)
+        yield from self._conn.execute(
+            f"SELECT t.seq, t.thread_id, t.title, t.category, t.has_diary, COUNT(p.id), COALESCE(SUM(p.article_len), 0)"
+            f" FROM threads t LEFT JOIN posts p ON p.thread_seq = t.seq AND {condition}"
+            f" GROUP BY t.seq ORDER BY t.seq", params).fetchall()
+
+    def load_thread(self, seq, thread_id, title, category, has_diary, start_date=None, end_date=None, table=None):
+        """Builds the Thread with the posts inside the date range, in diary order."""
+        if not has_diary:
+            return Thread(thread_id, title, sys.intern(category) if isinstance(category, str) else category, None)
+        condition, params = self.date_condition(start_date, end_date)
+        post_rows = self._conn.execute(
+            f"SELECT p.id, p.key, p.date_str, p.article, p.has_memberquotes, p.has_quotes, p.has_links, p.raw_json"
+            f" FROM posts p WHERE p.thread_seq = ? AND {condition} ORDER BY p.seq", [seq] + params).fetchall()
+        children = {}
+        for name, column in (("memberquotes", "c.key, c.text"), ("quotes", "c.text"), ("links", "c.url")):
+            for row in self._conn.execute(
+                    f"SELECT c.post_id, {column} FROM {name} c JOIN posts p ON p.id = c.post_id"
+                    f" WHERE p.thread_seq = ? AND {condition} ORDER BY c.post_id, c.seq", [seq] + params):
+                children.setdefault((name, row[0]), []).append(row[1:])
+        table = {} if table is None else table
+        posts = []
+        for post_id, key, date_str, article, has_memberquotes, has_quotes, has_links, raw_json in post_rows:
+            if raw_json is not None:
+                posts.append(Post(key, json.loads(raw_json), table))
+                continue
+            post_data = {'date': date_str, 'article': article}
+            if has_memberquotes: post_data['memberquotes'] = dict(children.get(("memberquotes", post_id), ()))
+            if has_quotes: post_data['quotes'] = [text for (text,) in children.get(("quotes", post_id), ())]
+            if has_links: post_data['links'] = [url for (url,) in children.get(("links", post_id), ())]
+            posts.append(Post(key, post_data, table))
+        return Thread(thread_id, title, sys.intern(category) if isinstance(category, str) else category, tuple(posts))
+
+    def items(self):
+        """Yields (thread_id, Thread) for all threads in export order."""
+        table = {}
+        for seq, thread_id, title, category, has_diary, _, _ in self.iter_thread_rows(None, None):
+            yield thread_id, self.load_thread(seq, thread_id, title, category, has_diary, table=table)
+
+    def __iter__(self):
+        return self.items()
+
+_thread_db = None
+
+def open_thread_db(source_filename):
+    """Opens the thread database and (re)imports the export if it changed; None on errors."""
+    global _thread_db
+    try:
+        if _thread_db is None:
+            _thread_db = ThreadDatabase(THREAD_DB_FILE)
+        _thread_db.ingest(source_filename)
+        return _thread_db
+    except (OSError, ValueError, sqlite3.Error) as e: # json.JSONDecodeError is a ValueError
+        logging.error(f"Fehler beim Aufbau der Themendatenbank '{THREAD_DB_FILE}' aus '{source_filename}': {e}")
+        return None
 
-    # Add all newly created thread parts to the main data dictionary
-    if newly_created_threads:
-         logging.info(f"Füge {len(newly_created_threads)} neu erstellte Thread-Teile hinzu.")
-         data.update(newly_created_threads)
+def close_thread_db():
+    global _thread_db
+    if _thread_db is not None:
+        _thread_db.close()
+        _thread_db = None
+
+def iter_db_filtered_threads(db, spec, stats=None):
+    """
+    Database variant of apply_filter_spec with the same results and ordering
+    (split parts after all threads). Date range, split selection and article
+    length are answered by indexed queries; the surviving threads are loaded
+    one at a time and finished by the per-thread pipeline.
+    """
+    stats = new_filter_stats() if stats is None else stats
+    split_filter = _parse_split_filter(spec.split_targets) if spec.split_active else None
+    split_seqs = db.split_target_seqs(split_filter) if split_filter else set()
+    start_date, end_date = spec.start_date, spec.end_date
+    remaining_spec = replace(spec, start_date=None, end_date=None) # Date range is applied in SQL
+
+    removed_by_thread = {}
+    if start_date is not None or end_date is not None:
+        start_str, end_str = _date_range_labels(start_date, end_date)
+        for thread_id, key, date_str, date_ord in db.iter_posts_outside(start_date, end_date):
+            reason = f"vor {start_str}" if start_date is not None and date_ord < start_date.toordinal() else f"nach {end_str}"
+            _log_post_removed(key, thread_id, start_str, end_str, date_str, reason)
+            removed_by_thread[thread_id] = removed_by_thread.get(thread_id, 0) + 1
+
+    table = {}
+    new_parts = []
+    taken = set() # All thread IDs (every row is listed) before the parts are numbered
+    for seq, thread_id, title, category, has_diary, kept_posts, article_total in db.iter_thread_rows(start_date, end_date):
+        stats["threads_in"] += 1
+        taken.add(thread_id)
+        deleted = removed_by_thread.get(thread_id, 0)
+        stats["date"]["posts_removed"] += deleted
+        if has_diary and deleted and not kept_posts:
+            _log_thread_emptied(thread_id, title)
+            stats["date"]["threads_removed"] += 1
+            continue
+        is_split_target = split_filter is not None and (split_seqs is None or seq in split_seqs)
+        if spec.min_article_length > 0 and has_diary and not is_split_target and article_total < spec.min_article_length:
+            # Decided without loading the posts
+            _log_thread_too_short(thread_id, title, article_total, spec.min_article_length)
+            stats["article_length"]["threads_removed"] += 1
+            stats["article_length"]["posts_removed"] += kept_posts
+            continue
 
-    logging.info(f"Themenaufteilung abgeschlossen: {split_count} Aufteilungen durchgeführt.")
-    return data
+        thread = db.load_thread(seq, thread_id, title, category, has_diary, start_date, end_date, table)
+        if start_date is not None or end_date is not None:
+            for post in thread.posts or ():
+                if post.is_valid and post.date_ord is None:
+                    _log_invalid_post_date(post.date_str, post.key, thread_id)
+        survivors = _apply_spec_to_view(ThreadView.from_source(thread_id, thread), remaining_spec,
+                                        split_filter if is_split_target else None, stats)
+        for part_id, part_view in survivors:
+            if part_id == thread_id:
+                stats["threads_out"] += 1
+                yield part_id, part_view
+            else:
+                new_parts.append((part_id, part_view))
+    for part_id, part_view in new_parts:
+        stats["threads_out"] += 1
+        yield _unique_part(part_id, part_view, taken)
+    log_filter_stats(stats)
+
+
+# --- Laufzeitprofil ---
+class RunProfiler:
+    """
+    Collects wall-clock and CPU time per pipeline stage, optionally the
+    tracemalloc peak per stage, and latency samples (LLM calls, requests,
+    saves) for the report written at the end of the run.
+    """
+
+    def __init__(self):
+        self.stages = {} # name -> totals, in order of first use
+        self.latencies = {} # kind -> list of seconds
+        self.memory = False
+        self._lock = threading.Lock()
+
+    def start(self, memory=False):
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as stage 'name' (repeated stages are summed up)."""
+        if self.memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.add_stage(name, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                entry["peak_mb"] = max(entry.get("peak_mb", 0.0), peak / 2**20)
+                entry["growth_mb"] = entry.get("growth_mb", 0.0) + (current - memory_before) / 2**20
+
+    def add_stage(self, name, wall_seconds, cpu_seconds=0.0):
+        """Adds a measured duration to stage 'name' (also for stages timed elsewhere, e.g. startup)."""
+        with self._lock:
+            entry = self.stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            entry["calls"] += 1
+            entry["wall_seconds"] += wall_seconds
+            entry["cpu_seconds"] += cpu_seconds # All threads of the process
+            return entry
+
+    def record_latency(self, kind, seconds):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+    def stop(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+def latency_histogram(samples):
+    """Count, mean, percentiles and bucket counts (upper bounds from LATENCY_BUCKETS) of latency samples."""
+    ordered = sorted(samples)
+    def percentile(fraction): # Nearest rank: the smallest sample with at least fraction of the samples at or below it
+        return round(ordered[max(0, math.ceil(fraction * len(ordered)) - 1)], 3)
+    buckets = {f"<={bound}s": 0 for bound in LATENCY_BUCKETS}
+    buckets["inf"] = 0
+    for value in ordered:
+        bound = next((b for b in LATENCY_BUCKETS if value <= b), None)
+        buckets[f"<={bound}s" if bound is not None else "inf"] += 1
+    return {"count": len(ordered), "mean": round(sum(ordered) / len(ordered), 3), "p50": percentile(0.5),
+            "p90": percentile(0.9), "p99": percentile(0.99), "max": round(ordered[-1], 3), "buckets": buckets}
+
+def build_profile_report(profiler, summary):
+    """Combines stage totals and latency histograms with the run summary into the report dict."""
+    with profiler._lock:
+        stages = {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()}
+                  for name, entry in profiler.stages.items()}
+        latencies = {kind: latency_histogram(samples) for kind, samples in profiler.latencies.items() if samples}
+    return {
+        "started_at": summary.get("started_at"),
+        "status": summary.get("status"),
+        "provider": summary.get("provider"),
+        "model": summary.get("model"),
+        "threads": summary.get("threads"),
+        "requests": summary.get("requests"),
+        "duration_seconds": round(time.time() - summary["_start_time"], 2) if "_start_time" in summary else None,
+        "memory_traced": profiler.memory,
+        "stages": stages,
+        "latencies": latencies,
+    }
+
+def write_profile_report(report, filename=PROFILE_REPORT_FILE, history_filename=PROFILE_HISTORY_FILE):
+    """Writes the JSON report of this run and appends one CSV line per stage to the history."""
+    directory = Path(LOG_FILE).parent # Next to the log file
+    save_data(report, directory / filename)
+    history_path = directory / history_filename
+    fields = ["started_at", "status", "provider", "model", "requests", "stage", "calls",
+              "wall_seconds", "cpu_seconds", "peak_mb", "growth_mb"]
+    try:
+        new_file = not history_path.exists()
+        with open(history_path, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            for stage, entry in report["stages"].items():
+                writer.writerow({**{key: report.get(key) for key in fields[:5]}, "stage": stage, **entry})
+    except OSError as e:
+        logging.warning(f"Profil-Historie '{history_path}' konnte nicht geschrieben werden: {e}")
+
+def print_profile_report(report):
+    """Prints the stage table and the latency percentiles."""
+    if not report["stages"]:
+        return
+    print("\n--- Laufzeitprofil ---")
+    for name, entry in report["stages"].items():
+        memory = f", Spitze {entry['peak_mb']:.1f} MB" if "peak_mb" in entry else ""
+        print(f"{name:<18} {entry['wall_seconds']:>9.2f}s (CPU {entry['cpu_seconds']:.2f}s{memory})")
+    for kind, histogram in report["latencies"].items():
+        print(f"Latenz {kind:<11} n={histogram['count']}, p50 {histogram['p50']:.2f}s, "
+              f"p90 {histogram['p90']:.2f}s, p99 {histogram['p99']:.2f}s, max {histogram['max']:.2f}s")
+    print(f"Profil gespeichert in '{PROFILE_REPORT_FILE}' (Verlauf: '{PROFILE_HISTORY_FILE}').")
 
+PROFILER = RunProfiler()
 
 # --- LLM-Vorbereitung & Speicherung ---
 def load_system_prompt(filename=SYSTEM_PROMPT_FILE):
@@ -407,42 +1691,90 @@ def load_system_prompt(filename=SYSTEM_PROMPT_FILE):
         logging.warning(f"Fehler beim Lesen des System-Prompts '{filename}': {e}. Verwende leeren Prompt.")
         return ""
 
+# The system prompt is stored once per run; requests only carry its ID
+_system_prompts = {}
+
+def register_system_prompt(text):
+    """Stores a system prompt for this run and returns its ID (content hash)."""
+    text = text or ""
+    prompt_id = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    _system_prompts.setdefault(prompt_id, text)
+    return prompt_id
+
+def request_system_prompt(request):
+    """Returns the system prompt text of a prepared request."""
+    return _system_prompts.get(request.get("system_prompt_id"), "")
+
+POST_SEPARATOR = "\n---\n"
+
+def estimate_tokens(text):
+    """Approximate token count of a text (CHARS_PER_TOKEN characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+def _chunk_post_blocks(header, blocks, budget):
+    """
+    Packs consecutive post blocks into user prompts of at most budget tokens.
+    A single block larger than the budget becomes a chunk of its own.
+    """
+    chunks, current, current_tokens = [], [], estimate_tokens(header)
+    for block in blocks:
+        block_tokens = estimate_tokens(block) + 2 # Separator
+        if current and current_tokens + block_tokens > budget:
+            chunks.append(current)
+            current, current_tokens = [], estimate_tokens(header)
+        current.append(block)
+        current_tokens += block_tokens
+    if current:
+        chunks.append(current)
+    return [(header + POST_SEPARATOR.join(chunk)).strip() for chunk in chunks]
+
 def prepare_llm_requests(data, system_prompt):
-    requests = []
+    """
+    Builds one request per thread. data is a mapping or a stream of
+    (thread_id, thread) pairs, where thread is a ThreadView or a raw thread dict.
+    """
     logging.info("Bereite Daten für LLM-Anfragen vor...")
-    for thread_id, thread_data in data.items():
-        title = thread_data.get('title', 'Unbekanntes Thema')
-        category = thread_data.get('category', 'Unkategorisiert')
-        diary = thread_data.get('diary', {})
+    system_prompt_id = register_system_prompt(system_prompt)
+    thread_items = data.items() if isinstance(data, dict) else data
+    requests = _build_llm_requests(thread_items, system_prompt, system_prompt_id)
+    logging.info(f"{len(requests)} LLM-Anfragen vorbereitet.")
+    ITEM_EVENTS.log_summary()
+    return requests
+
+def _build_llm_requests(thread_items, system_prompt, system_prompt_id):
+    """Request per (thread_id, thread) pair with content; shared by the single- and multi-process variants."""
+    requests = []
+    for thread_id, thread_data in thread_items:
+        view = thread_data if isinstance(thread_data, ThreadView) else ThreadView.from_source(thread_id, thread_data)
+        title = view.title if view.title is not None else 'Unbekanntes Thema'
+        category = view.category if view.category is not None else 'Unkategorisiert'
 
-        if not isinstance(diary, dict) or not diary:
-            logging.debug(f"Überspringe Thema '{thread_id}' ({title}): Kein 'diary' oder leer.")
+        if not view.posts:
+            logging.debug("Überspringe Thema '%s' (%s): Kein 'diary' oder leer.", thread_id, title)
             continue
 
-        user_prompt_parts = [f"# Thema: {title}\n"]
+        header = f"# Thema: {title}\n"
+        post_blocks = [] # Prompt text per post (with content), in chronological order
         links = set()
         post_counter = 0 # Zählt nur Posts mit tatsächlichem 'article' Inhalt
 
-        # Sort posts by date before processing
+        # Sort posts by date before processing (invalid dates last)
         valid_posts_for_prompt = []
-        for item in diary.items():
-             post_key, post_data = item
-             if isinstance(post_data, dict):
-                  post_date = parse_date_safe(post_data.get('date'))
-                  # Include posts even without valid date for prompt generation, sort invalids last
-                  valid_posts_for_prompt.append((post_key, post_data, post_date if post_date else datetime.max.date()))
+        for post in view.posts:
+             if post.is_valid:
+                  valid_posts_for_prompt.append(post)
              else:
-                  logging.warning(f"Ignoriere ungültigen Post-Eintrag '{post_key}' in Thema '{thread_id}' für Prompt-Erstellung.")
+                  _log_invalid_post(post.key, thread_id, "Prompt-Erstellung")
 
-        sorted_posts_for_prompt = sorted(valid_posts_for_prompt, key=lambda item: item[2])
+        max_ord = date.max.toordinal()
+        sorted_posts_for_prompt = sorted(valid_posts_for_prompt, key=lambda post: post.date_ord if post.date_ord is not None else max_ord)
 
         # --- Build the prompt content ---
         last_thought_number = 0 # Track the last thought number assigned
-        for post_key, post_data, post_date_obj in sorted_posts_for_prompt:
-            article = post_data.get('article', '').strip()
-            member_quotes = post_data.get('memberquotes', {})
-            simple_quotes = post_data.get('quotes', []) # Assuming quotes is a list of strings
-            post_links = post_data.get('links', [])
+        for post in sorted_posts_for_prompt:
+            article = post.article.strip() if isinstance(post.article, str) else ''
+            simple_quotes = post.quotes or () # Assuming quotes is a list of strings
+            post_links = post.links or ()
 
             current_post_content = []
             has_article_in_this_post = False
@@ -452,17 +1784,15 @@ def prepare_llm_requests(data, system_prompt):
             if article:
                 post_counter += 1
                 current_thought_number = post_counter # Assign new number
-                date_str = post_date_obj.strftime('%d.%m.%Y') if post_date_obj != datetime.max.date() else post_data.get('date', 'Datum unbekannt')
+                date_str = post.date.strftime('%d.%m.%Y') if post.date_ord is not None else (post.date_str if post.date_str is not None else 'Datum unbekannt')
                 current_post_content.append(f"## Mein Gedanke {current_thought_number} ({date_str})\n{article}")
                 has_article_in_this_post = True
                 last_thought_number = current_thought_number # Update last assigned number
 
             # 2. Add "Kontext" section if quotes exist
             context_parts = []
-            if isinstance(member_quotes, dict):
-                context_parts.extend([f"- Zitat von Mitglied: {text.strip()}" for text in member_quotes.values() if isinstance(text, str) and text.strip()])
-            if isinstance(simple_quotes, list): # Handle potential simple quotes list
-                 context_parts.extend([f"- Zitat: {text.strip()}" for text in simple_quotes if isinstance(text, str) and text.strip()])
+            context_parts.extend([f"- Zitat von Mitglied: {text.strip()}" for _, text in view.member_quotes(post) if isinstance(text, str) and text.strip()])
+            context_parts.extend([f"- Zitat: {text.strip()}" for text in simple_quotes if isinstance(text, str) and text.strip()])
 
             if context_parts:
                  # Refer to the last relevant thought number
@@ -472,19 +1802,14 @@ def prepare_llm_requests(data, system_prompt):
 
             # 3. Add the collected content for this post if any
             if current_post_content:
-                 user_prompt_parts.extend(current_post_content)
-                 user_prompt_parts.append("\n---\n") # Separator between posts
+                 post_blocks.append("".join(current_post_content))
 
             # 4. Collect links
-            if isinstance(post_links, list):
-                 links.update(link for link in post_links if isinstance(link, str) and link.strip())
+            links.update(link for link in post_links if isinstance(link, str) and link.strip())
 
 
-        # Clean up the final prompt
-        if user_prompt_parts and user_prompt_parts[-1] == "\n---\n":
-            user_prompt_parts.pop() # Remove trailing separator
-
-        final_user_prompt = "".join(user_prompt_parts).strip()
+        # Separator only between posts, never trailing
+        final_user_prompt = (header + POST_SEPARATOR.join(post_blocks)).strip()
 
         # Check if the prompt has meaningful content beyond the title
         # Count lines excluding the title line and empty lines
@@ -493,46 +1818,254 @@ def prepare_llm_requests(data, system_prompt):
             logging.warning(f"Thema '{thread_id}' ({title}) hat keinen substantiellen Inhalt für den LLM-Prompt (nur Titel oder leer). Überspringe.")
             continue
 
-        requests.append({
+        request = {
             "thread_id": thread_id,
             "title": title,
             "category": category,
-            "system_prompt": system_prompt,
+            "system_prompt_id": system_prompt_id,
             "user_prompt": final_user_prompt,
             "links": sorted(list(links))
-        })
+        }
+        # Oversized threads: summarize chunks first, then synthesize (map-reduce)
+        if LLM_MAX_PROMPT_TOKENS and estimate_tokens(system_prompt) + estimate_tokens(final_user_prompt) > LLM_MAX_PROMPT_TOKENS:
+            chunk_budget = max(1, LLM_MAX_PROMPT_TOKENS - estimate_tokens(MAP_SYSTEM_PROMPT))
+            request["chunks"] = _chunk_post_blocks(header, post_blocks, chunk_budget)
+            logging.info(f"Thema '{thread_id}' ({title}) übersteigt das Token-Budget ({LLM_MAX_PROMPT_TOKENS}): "
+                         f"Map-Reduce mit {len(request['chunks'])} Abschnitten.")
+        requests.append(request)
+    return requests
 
+# --- Parallele Filterung & Vorbereitung (Prozess-Pool) ---
+# Filter, split and prompt building are independent per thread. With several
+# workers the threads are cut into contiguous shards that worker processes
+# handle; the results are merged in input order, so they equal the
+# single-process run. Views travel between the processes as compact
+# descriptions (post positions within their source thread), the threads
+# themselves are inherited when the platform can fork.
+_shard_sources = None # {source thread ID: Thread} of the worker processes
+
+def resolve_worker_count(workers):
+    """Number of worker processes for a requested count (0 = one per core)."""
+    return max(1, workers if workers > 0 else (os.cpu_count() or 1))
+
+def _encode_view(view):
+    """(thread_id, source ID, title, category, post positions, masked quotes); positions are 'all' for unfiltered threads."""
+    source_posts = view.source.posts
+    if view.posts is None:
+        positions = None
+    elif source_posts is not None and len(view.posts) == len(source_posts) and view.posts == list(source_posts):
+        positions = "all"
+    else:
+        index = {id(post): position for position, post in enumerate(source_posts)}
+        positions = [index[id(post)] for post in view.posts]
+    return (view.thread_id, view.source.thread_id, view.title, view.category, positions, view.dropped_quotes)
+
+def _decode_view(encoded, sources):
+    thread_id, source_id, title, category, positions, dropped_quotes = encoded
+    source = sources[source_id]
+    if positions is None:
+        posts = None
+    elif positions == "all":
+        posts = list(source.posts)
+    else:
+        posts = [source.posts[position] for position in positions]
+    return ThreadView(thread_id, source, title, category, posts, dropped_quotes)
+
+def _init_shard_worker(log_queue, sources):
+    """Runs once per worker process: gets the threads (if not inherited) and logs via the parent."""
+    global _shard_sources
+    if sources is not None:
+        _shard_sources = sources
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if log_queue is not None:
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+def _take_item_event_counts():
+    counts, ITEM_EVENTS.counts = ITEM_EVENTS.counts, Counter()
+    return counts
+
+def _filter_shard(task):
+    """Worker: filters one shard; returns ([(thread_id, [encoded survivors])], stats, item event counts)."""
+    encoded_views, spec = task
+    stats = new_filter_stats()
+    split_filter = _parse_split_filter(spec.split_targets) if spec.split_active else None
+    results = []
+    for encoded in encoded_views:
+        view = _decode_view(encoded, _shard_sources)
+        survivors = _apply_spec_to_view(view, spec, split_filter, stats)
+        results.append((view.thread_id, [_encode_view(part_view) for _, part_view in survivors]))
+    return results, stats, _take_item_event_counts()
+
+def _prepare_shard(task):
+    """Worker: builds the requests of one shard; returns (requests, item event counts)."""
+    encoded_views, system_prompt = task
+    items = ((encoded[0], _decode_view(encoded, _shard_sources)) for encoded in encoded_views)
+    return _build_llm_requests(items, system_prompt, register_system_prompt(system_prompt)), _take_item_event_counts()
+
+def _run_shards(worker, views, extra, workers):
+    """
+    Runs worker over contiguous shards of the views in a process pool and
+    returns the shard results in input order.
+    """
+    views = list(views)
+    sources = {view.source.thread_id: view.source for view in views}
+    if not views:
+        return [], sources
+    shard_size = max(1, -(-len(views) // (workers * FILTER_SHARDS_PER_WORKER)))
+    tasks = [([_encode_view(view) for view in views[start:start + shard_size]], extra)
+             for start in range(0, len(views), shard_size)]
+
+    global _shard_sources
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if can_fork else "spawn")
+    log_queue = listener = None
+    if _log_listener is not None: # Records of the workers go through the same handlers
+        log_queue = context.Queue()
+        listener = logging.handlers.QueueListener(log_queue, *_log_listener.handlers, respect_handler_level=True)
+        listener.start()
+    _shard_sources = sources if can_fork else None # Forked workers inherit the threads instead of unpickling them
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)) or 1, mp_context=context,
+                                 initializer=_init_shard_worker,
+                                 initargs=(log_queue, None if can_fork else sources)) as executor:
+            return list(executor.map(worker, tasks)), sources
+    finally:
+        _shard_sources = None
+        if listener is not None:
+            listener.stop()
+
+def apply_filter_spec_parallel(data, spec, workers):
+    """
+    apply_filter_spec in worker processes; same result, ordering and
+    statistics. Part IDs are made unique when the shards are merged.
+    """
+    workers = resolve_worker_count(workers)
+    views = [_as_view(thread_id, thread) for thread_id, thread in data.items()]
+    logging.info(f"Filtere {len(views)} Themen mit {workers} Prozessen...")
+    shard_results, sources = _run_shards(_filter_shard, views, spec, workers)
+
+    stats = new_filter_stats()
+    def survivors():
+        for results, shard_stats, item_counts in shard_results:
+            for stage in FILTER_STAGES:
+                for key, value in shard_stats[stage].items():
+                    stats[stage][key] += value
+            ITEM_EVENTS.counts.update(item_counts)
+            for thread_id, encoded_parts in results:
+                yield thread_id, [(encoded[0], _decode_view(encoded, sources)) for encoded in encoded_parts]
+    result = merge_filter_results(data.keys(), survivors())
+    stats["threads_in"] = len(data)
+    stats["threads_out"] = len(result)
+    log_filter_stats(stats)
+    return result, stats
+
+def prepare_llm_requests_parallel(data, system_prompt, workers):
+    """prepare_llm_requests in worker processes; the requests keep the order of data."""
+    workers = resolve_worker_count(workers)
+    register_system_prompt(system_prompt)
+    views = [_as_view(thread_id, thread) for thread_id, thread in data.items()]
+    logging.info(f"Bereite {len(views)} LLM-Anfragen mit {workers} Prozessen vor...")
+    shard_results, _ = _run_shards(_prepare_shard, views, system_prompt, workers)
+    requests = []
+    for shard_requests, item_counts in shard_results:
+        requests.extend(shard_requests)
+        ITEM_EVENTS.counts.update(item_counts)
     logging.info(f"{len(requests)} LLM-Anfragen vorbereitet.")
+    ITEM_EVENTS.log_summary()
     return requests
 
-def save_llm_output(title, category, output_text, links, base_dir):
-    """Saves the LLM output to a Markdown file."""
+def _output_footer(category, links):
+    parts = ["\n\n---\n"] # Separator
+    parts.append(f"\n#{category}\n") # Add category as a tag
+    # Collected links
+    if links:
+        parts.append("\n## Links\n")
+        parts.extend(f"- {link}\n" for link in links)
+    return "".join(parts)
+
+def render_note(output_text, category, links):
+    """Complete Markdown note: LLM output plus category tag and links."""
+    return (output_text if output_text else "[Leere LLM Antwort erhalten]") + _output_footer(category, links)
+
+def write_text_atomic(path, text):
+    """Writes to a temporary file next to path and renames it into place (a note is either complete or absent)."""
+    temp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+def partial_output_path(output_path):
+    """Temporary file a streamed answer is written to (next to the final note)."""
+    return output_path.with_name(output_path.name + PARTIAL_OUTPUT_SUFFIX)
+
+def finalize_streamed_output(title, category, links, output_path, overwrite=False):
+    """
+    Appends the footer to the streamed answer and renames it to the final note
+    (atomic, so a note is either complete or absent). Returns True if saved.
+    """
+    partial_path = partial_output_path(output_path)
+    if output_path.exists() and not overwrite:
+        logging.warning(f"Datei '{output_path}' existiert bereits. Überspringe Speichern.")
+        discard_partial_output(output_path, keep=False)
+        return False
+    try:
+        # 'r+' rather than 'a': a missing partial file (discarded after an abort) must not become an empty note
+        with open(partial_path, 'r+', encoding='utf-8') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(_output_footer(category, links))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, output_path)
+        logging.info(f"Ausgabe für '{title}' erfolgreich gespeichert in '{output_path}' (gestreamt).")
+        return True
+    except FileNotFoundError:
+        logging.error(f"Teildatei '{partial_path}' fehlt, '{title}' wird nicht gespeichert.")
+        return False
+    except OSError as e:
+        logging.error(f"E/A-Fehler beim Abschließen von '{partial_path}': {e}")
+        return False
+
+def discard_partial_output(output_path, keep=None):
+    """Removes the partial file of a failed generation, or keeps it for diagnosis (LLM_KEEP_PARTIAL_OUTPUT)."""
+    keep = LLM_KEEP_PARTIAL_OUTPUT if keep is None else keep
+    partial_path = partial_output_path(output_path)
+    if not partial_path.exists():
+        return None
+    if keep and partial_path.stat().st_size:
+        logging.warning(f"Unvollständige Ausgabe aufbewahrt: '{partial_path}'.")
+        return partial_path
+    try:
+        partial_path.unlink()
+    except OSError as e:
+        logging.warning(f"Teildatei '{partial_path}' konnte nicht gelöscht werden: {e}")
+    return None
+
+def save_llm_output(title, category, output_text, links, base_dir, overwrite=False):
+    """Saves the LLM output to a Markdown file (replaces it only if overwrite is set)."""
     sanitized_title = sanitize_filename(title)
     output_path = base_dir / (sanitized_title + '.md')
 
     # Check for existence *before* attempting to write
-    if output_path.exists():
+    if output_path.exists() and not overwrite:
         logging.warning(f"Datei '{output_path}' existiert bereits. Überspringe Speichern.")
         return False # Indicate skipped due to existence
 
     try:
         # Ensure the output directory exists
         base_dir.mkdir(parents=True, exist_ok=True)
-
-        with open(output_path, 'w', encoding='utf-8') as f:
-            # Write the main LLM output
-            f.write(output_text if output_text else "[Leere LLM Antwort erhalten]")
-            f.write("\n\n---\n") # Separator
-
-            # Write metadata (category)
-            f.write(f"\n#{category}\n") # Add category as a tag
-
-            # Write collected links
-            if links:
-                f.write("\n## Links\n")
-                for link in links:
-                    f.write(f"- {link}\n")
-
+        write_text_atomic(output_path, render_note(output_text, category, links))
+        discard_partial_output(output_path, keep=False) # Left over by an earlier, aborted streaming run
         logging.info(f"Ausgabe für '{title}' erfolgreich gespeichert in '{output_path}'.")
         return True # Indicate successful save
 
@@ -543,70 +2076,1120 @@ def save_llm_output(title, category, output_text, links, base_dir):
         logging.error(f"Allgemeiner Fehler beim Speichern der Ausgabe für '{title}' in '{output_path}': {e}")
         return False # Indicate failed save
 
-# --- Angepasste LLM-Aufruffunktion ---
-def invoke_langchain_llm(system_prompt, user_prompt):
-    """Ruft das konfigurierte LLM (Gemini oder Ollama) über LangChain auf."""
-    global LLM_PROVIDER, MODEL_NAME, GEMINI_API_KEY, OLLAMA_BASE_URL, GEMINI_AVAILABLE, OLLAMA_AVAILABLE
+# --- Ausgabeverzeichnis ---
+def output_file_names(request):
+    """Candidate note names of a request: the title, and the title with the thread ID for collisions."""
+    title = request.get('title', 'Unbekannter Titel')
+    return (sanitize_filename(title) + '.md',
+            sanitize_filename(f"{title} ({request.get('thread_id', 'unbekannt')})") + '.md')
 
-    # --- Pre-checks ---
-    if not MODEL_NAME:
-        logging.error("FEHLER: Umgebungsvariable 'MODEL_NAME' ist nicht gesetzt.")
-        return "[FEHLER: Modellname fehlt in .env]"
+def scan_output_dir(output_dir):
+    """Names in the output directory, case-folded (one listing instead of an exists() per note)."""
+    try:
+        with os.scandir(output_dir) as entries:
+            return {entry.name.casefold() for entry in entries}
+    except FileNotFoundError:
+        return set()
+
+def discard_stale_partials(llm_requests, output_dir):
+    """
+    Deletes the partial files an aborted run left for these requests (before
+    they are sent again, e.g. on resume). Returns the number of files removed.
+    """
+    output_dir = Path(output_dir)
+    existing = scan_output_dir(output_dir)
+    removed = 0
+    for request in llm_requests:
+        for name in output_file_names(request):
+            if partial_output_path(output_dir / name).name.casefold() in existing:
+                discard_partial_output(output_dir / name, keep=False)
+                removed += 1
+    return removed
+
+class OutputSink:
+    """
+    Output directory of one LLM run. The directory is listed once; which file a
+    note goes to is decided against that index and the names claimed in this
+    run. Titles that collide after sanitize_filename get the thread ID appended.
+    Notes are written by a background thread (temporary file + atomic rename),
+    so file-system round-trips stay out of the request loop.
+    """
+
+    def __init__(self, output_dir, manifest=None):
+        self.output_dir = Path(output_dir)
+        self._existing = scan_output_dir(self.output_dir)
+        self._claimed = {} # Case-folded name -> thread ID, for this run
+        # Files the manifest knows the producing thread of
+        self._owners = {}
+        for thread_id, entry in (manifest.entries.items() if manifest is not None else ()):
+            if entry.get("output_file"):
+                self._owners[entry["output_file"].casefold()] = thread_id
+        self._dir_ready = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+
+    def claim(self, request):
+        """
+        Reserves the note file for a request. Returns (path, renamed), or
+        (None, False) if an existing note must not be replaced (skip).
+        """
+        thread_id = request.get('thread_id')
+        plain_name, suffixed_name = output_file_names(request)
+        for name in (plain_name, suffixed_name):
+            key = name.casefold()
+            if key in self._claimed:
+                continue # Taken by an earlier request of this run
+            owner = self._owners.get(key)
+            if key in self._existing:
+                if owner is not None and owner != thread_id:
+                    continue # Note of another thread
+                # Claimed even when skipped, so a later thread with the same title gets the suffixed name
+                self._claimed[key] = thread_id
+                if not (request.get('overwrite') and owner == thread_id):
+                    return None, False # Existing note (e.g. from an earlier run) is kept
+            self._claimed[key] = thread_id
+            if name != plain_name:
+                logging.warning(f"Titelkollision: '{plain_name}' ist bereits vergeben, '{request.get('title')}' ({thread_id}) wird als '{name}' gespeichert.")
+            return self.output_dir / name, name != plain_name
+        return None, False
+
+    def path_for(self, request):
+        """Name the request would be saved under, for messages about skipped notes."""
+        return self.output_dir / output_file_names(request)[0]
+
+    def ensure_dir(self):
+        if not self._dir_ready:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._dir_ready = True
+
+    def _timed(self, job, *args):
+        start_time = time.perf_counter()
+        try:
+            self.ensure_dir()
+            return job(*args)
+        except Exception as e:
+            logging.error(f"Fehler beim Speichern der Ausgabe in '{self.output_dir}': {e}", exc_info=True)
+            return False
+        finally:
+            PROFILER.record_latency("save", time.perf_counter() - start_time)
+
+    def write_note(self, path, title, category, output_text, links):
+        """Queues the note for the background writer; the future yields True if it was saved."""
+        return self._writer.submit(self._timed, self._write_note, path, title, category, output_text, links)
+
+    def _drop_stale_partial(self, path):
+        # A partial file from an earlier, aborted streaming run is obsolete once the note exists
+        if partial_output_path(path).name.casefold() in self._existing:
+            discard_partial_output(path, keep=False)
+
+    def finalize_stream(self, path, title, category, links):
+        """Queues footer and rename of a streamed answer (see finalize_streamed_output)."""
+        return self._writer.submit(self._timed, finalize_streamed_output, title, category, links, path, True)
+
+    def _write_note(self, path, title, category, output_text, links):
+        try:
+            write_text_atomic(path, render_note(output_text, category, links))
+        except OSError as e:
+            logging.error(f"E/A-Fehler beim Speichern von '{path}': {e}")
+            return False
+        self._drop_stale_partial(path)
+        logging.info(f"Ausgabe für '{title}' erfolgreich gespeichert in '{path}'.")
+        return True
 
-    logging.info(f"Versuche LLM-Aufruf mit Provider: {LLM_PROVIDER}, Modell: {MODEL_NAME}")
-    llm = None
-    temperature = 0.7 # Standard-Temperatur, kann angepasst werden
+    def close(self):
+        """Waits for the queued writes."""
+        self._writer.shutdown(wait=True)
+
+# --- LLM-Client-Pool ---
+# One LangChain chat model per (provider, model, temperature). The instances keep
+# their underlying HTTP/gRPC client, so connections and TLS sessions are reused
+# across all requests and worker threads of a run.
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+
+# Accumulated wall-clock time for client setup vs. inference
+LLM_CLIENT_STATS = {"setup_seconds": 0.0, "setup_count": 0, "inference_seconds": 0.0, "inference_count": 0,
+                    "input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "prompt_eval_seconds": 0.0,
+                    "stream_count": 0, "ttft_seconds": 0.0, "stream_seconds": 0.0, "stream_tokens": 0, "retries": 0,
+                    "calls": 0} # Model calls actually sent, including retries and map calls
+_llm_stats_lock = threading.Lock()
+
+def _record_llm_timing(kind, seconds):
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS[f"{kind}_seconds"] += seconds
+        LLM_CLIENT_STATS[f"{kind}_count"] += 1
+
+def _record_llm_tokens(input_tokens, output_tokens):
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS["input_tokens"] += input_tokens
+        LLM_CLIENT_STATS["output_tokens"] += output_tokens
+
+def _record_llm_call():
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS["calls"] += 1
+
+def _record_llm_retry():
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS["retries"] += 1
+
+def _record_stream_timing(ttft, duration, tokens):
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS["stream_count"] += 1
+        LLM_CLIENT_STATS["ttft_seconds"] += ttft
+        LLM_CLIENT_STATS["stream_seconds"] += duration
+        LLM_CLIENT_STATS["stream_tokens"] += tokens
+
+def _record_prefix_usage(response):
+    """Collects how much of the prompt the provider served from its cache (if reported)."""
+    usage = getattr(response, 'usage_metadata', None) or {}
+    details = usage.get('input_token_details') or {} if isinstance(usage, dict) else {}
+    metadata = getattr(response, 'response_metadata', None) or {}
+    with _llm_stats_lock:
+        LLM_CLIENT_STATS["cache_read_tokens"] += int(details.get('cache_read') or 0)
+        LLM_CLIENT_STATS["prompt_eval_seconds"] += (metadata.get('prompt_eval_duration') or 0) / 1e9 # Ollama, nanoseconds
+
+# --- Provider-Plugins ---
+# Every LLM provider is a plugin registered under its LLM_PROVIDER name. Its
+# LangChain integration is imported when the first client is built, so runs
+# that only filter, plan or abort never pay for it. A new provider is a
+# subclass of LLMProvider decorated with @register_provider("name").
+_providers = {}
+
+def register_provider(name):
+    """Class decorator: registers a provider plugin under its LLM_PROVIDER name."""
+    def decorator(cls):
+        cls.name = name
+        _providers[name] = cls()
+        return cls
+    return decorator
+
+def get_provider(name):
+    """Returns the registered provider plugin, or None for unknown names."""
+    return _providers.get(name)
+
+class LLMProvider(ABC):
+    """
+    Interface of a provider plugin: configuration, lazy import, client construction
+    and error hints. _import and create_client are abstract, so registering an
+    incomplete plugin fails with TypeError.
+    """
+    name = ""
+    label = ""
+    modules = () # Packages that must be installed (checked without importing)
+    install_hint = ""
+
+    def __init__(self):
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    @property
+    def supports_context_cache(self):
+        """True if the system prompt can be cached at the provider (see get_gemini_prompt_cache)."""
+        return False
 
-    try:
-        # --- Gemini Pfad ---
-        if LLM_PROVIDER == "gemini":
-            if not GEMINI_AVAILABLE: # Checks if API key was loaded and module imported
-                logging.error("FEHLER: Gemini ist konfiguriert, aber nicht verfügbar (API-Schlüssel fehlt oder Importfehler).")
-                return "[FEHLER: Gemini nicht verfügbar]"
-
-            generation_config = {"temperature": temperature, "top_p": 0.95} # Example config
-            # Configure safety settings to be less restrictive if needed
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-            llm = ChatGoogleGenerativeAI(
-                model=MODEL_NAME,
-                google_api_key=GEMINI_API_KEY,
-                generation_config=generation_config,
-                safety_settings=safety_settings,
-                # Optional: Set request options like timeout
-                # client_options={"api_endpoint": "generativelanguage.googleapis.com"},
-                # request_options={"timeout": 600} # Example: 10 minute timeout
-            )
-            logging.info(f"Verwende Gemini ({MODEL_NAME}) via LangChain.")
-
-        # --- Ollama Pfad ---
-        elif LLM_PROVIDER == "ollama":
-            if not OLLAMA_AVAILABLE: # Checks if module was imported
-                 logging.error("FEHLER: Ollama ist konfiguriert, aber nicht verfügbar (langchain-ollama fehlt oder Importfehler).")
-                 return "[FEHLER: Ollama-Modul nicht verfügbar]"
-            if not OLLAMA_BASE_URL:
-                 # Should not happen due to default, but check anyway
-                 logging.error("FEHLER: Ollama ist konfiguriert, aber 'OLLAMA_BASE_URL' fehlt!")
-                 return "[FEHLER: Ollama Base URL fehlt]"
-
-            llm = ChatOllama(
-                base_url=OLLAMA_BASE_URL,
-                model=MODEL_NAME,
-                temperature=temperature,
-                # Optional: Add other Ollama parameters if needed
-                # num_ctx=4096, # Example context window size
-                # request_timeout=300.0 # Example: 5 minute timeout
+    def installed(self):
+        """Cheap check whether the required packages are present, without importing them."""
+        return all(importlib.util.find_spec(module) is not None for module in self.modules)
+
+    def load(self):
+        """Imports the integration on first use; returns True if it is usable."""
+        with self._lock:
+            if self._loaded is None:
+                start_time = time.perf_counter()
+                try:
+                    self._import()
+                    self._loaded = True
+                except ImportError as e:
+                    logging.error(f"Import Error for provider '{self.name}': {e}. Please ensure the required package is installed.")
+                    logging.error(f"-> For {self.label}, run: {self.install_hint}")
+                    self._loaded = False
+                seconds = time.perf_counter() - start_time
+                PROFILER.add_stage("provider_import", seconds)
+                logging.info(f"Provider '{self.name}' in {seconds:.2f}s geladen.")
+            return self._loaded
+
+    @abstractmethod
+    def _import(self):
+        """Imports the LangChain integration (raises ImportError)."""
+
+    @abstractmethod
+    def create_client(self, model, temperature, cached_content=None, base_url=None, api_key=None):
+        """Builds a LangChain chat model; base_url/api_key default to the .env configuration."""
+
+    def default_base_url(self):
+        return ""
+
+    def default_api_key(self):
+        return ""
+
+    def configuration_problem(self):
+        """Why calls with the .env configuration cannot work (None if they can); imports the integration."""
+        return None if self.load() else f"{self.label}-Modul nicht verfügbar ({self.install_hint})"
+
+    def check_configuration(self):
+        """Prints the provider part of the configuration check; returns True if usable."""
+        if not self.installed():
+            print(f"FEHLER: Provider ist '{self.name}', aber benötigte Pakete fehlen.")
+            print(f"        -> Bitte installieren: {self.install_hint}")
+            return False
+        print(f"Pakete:       OK ({self.label})")
+        return True
+
+    def health_check(self, base_url, api_key):
+        """(True/False/None if unknown, message) for one endpoint of this provider."""
+        return None, "Nicht prüfbar"
+
+    def error_hint(self, error, model, base_url):
+        """Provider-specific hint for a classified call error (None if there is none)."""
+        return None
+
+    def estimate_cost(self, input_tokens, cached_tokens, output_tokens):
+        """Estimated price in USD (None if unknown); input_tokens excludes the cached ones."""
+        return None
+
+@register_provider("gemini")
+class GeminiProvider(LLMProvider):
+    label = "Gemini"
+    modules = ("langchain_google_genai",)
+    install_hint = "pip install langchain-google-genai google-generativeai"
+
+    @property
+    def supports_context_cache(self):
+        return GEMINI_CONTEXT_CACHE
+
+    def _import(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # HarmCategory/HarmBlockThreshold needed for safety settings
+        try:
+            from langchain_google_vertexai import HarmCategory, HarmBlockThreshold
+        except ImportError:
+            # Fallback if vertexai is not installed but genai is
+            from google.generativeai.types import HarmCategory, HarmBlockThreshold
+            logging.warning("Imported HarmCategory/HarmBlockThreshold from google.generativeai.types (fallback). Consider installing langchain-google-vertexai.")
+        self.chat_model = ChatGoogleGenerativeAI
+        # Configure safety settings to be less restrictive if needed
+        self.safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+
+    def default_api_key(self):
+        return GEMINI_API_KEY
+
+    def create_client(self, model, temperature, cached_content=None, base_url=None, api_key=None):
+        generation_config = {"temperature": temperature, "top_p": 0.95} # Example config
+        extra = {"cached_content": cached_content} if cached_content else {}
+        llm = self.chat_model(
+            model=model,
+            google_api_key=api_key or GEMINI_API_KEY,
+            generation_config=generation_config,
+            safety_settings=self.safety_settings,
+            **extra,
+            # Optional: Set request options like timeout
+            # client_options={"api_endpoint": "generativelanguage.googleapis.com"},
+            # request_options={"timeout": 600} # Example: 10 minute timeout
+        )
+        logging.info(f"Verwende Gemini ({model}) via LangChain.")
+        return llm
+
+    def configuration_problem(self):
+        if not GEMINI_API_KEY:
+            return "Gemini nicht verfügbar (GEMINI_API_KEY fehlt in .env)"
+        return super().configuration_problem()
+
+    def check_configuration(self):
+        if not GEMINI_API_KEY:
+            print("FEHLER: Provider ist 'gemini', aber 'GEMINI_API_KEY' fehlt in .env!")
+            return False
+        print("API Key:      Vorhanden (Gemini)")
+        return super().check_configuration()
+
+    def health_check(self, base_url, api_key):
+        return (True, "API Key vorhanden") if api_key else (False, "API Key fehlt")
+
+    def error_hint(self, error, model, base_url):
+        return {
+            "auth": "Gemini Fehler: API-Schlüssel ungültig oder keine Berechtigung. Bitte GEMINI_API_KEY in .env prüfen.",
+            "rate_limit": "Gemini Fehler: API-Kontingent bzw. Ratenlimit überschritten.",
+            "timeout": "Gemini Fehler: Zeitüberschreitung bei der Anfrage. Netzwerkproblem oder Anfrage zu komplex?",
+            "blocked": "Gemini Fehler: Inhalt wurde aufgrund von Sicherheitseinstellungen blockiert. Safety Settings im Skript sind auf BLOCK_NONE, prüfe Prompt-Inhalt oder API-Einstellungen.",
+        }.get(error.kind)
+
+    def estimate_cost(self, input_tokens, cached_tokens, output_tokens):
+        return round(input_tokens / 1e6 * GEMINI_PRICE_INPUT_PER_MTOK
+                     + cached_tokens / 1e6 * GEMINI_PRICE_CACHED_INPUT_PER_MTOK
+                     + output_tokens / 1e6 * GEMINI_PRICE_OUTPUT_PER_MTOK, 4)
+
+@register_provider("ollama")
+class OllamaProvider(LLMProvider):
+    label = "Ollama"
+    modules = ("langchain_ollama",)
+    install_hint = "pip install langchain-ollama"
+
+    def _import(self):
+        from langchain_ollama import ChatOllama
+        self.chat_model = ChatOllama
+
+    def default_base_url(self):
+        return OLLAMA_BASE_URL
+
+    def create_client(self, model, temperature, cached_content=None, base_url=None, api_key=None):
+        base_url = base_url or OLLAMA_BASE_URL
+        llm = self.chat_model(
+            base_url=base_url,
+            model=model,
+            temperature=temperature,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            # Optional: Add other Ollama parameters if needed
+            # num_ctx=4096, # Example context window size
+            # request_timeout=300.0 # Example: 5 minute timeout
+        )
+        logging.info(f"Verwende Ollama ({model}) unter {base_url} via LangChain.")
+        return llm
+
+    def check_configuration(self):
+        print(f"Basis URL:    {OLLAMA_BASE_URL} (Ollama)")
+        if not super().check_configuration():
+            return False
+        # Zusätzlich prüfen, ob Ollama Server läuft (optional, einfacher Test)
+        reachable, message = self.health_check(OLLAMA_BASE_URL, None)
+        print(f"Server Status: {message}")
+        if reachable is False:
+            logging.warning(f"Ollama Server unter {OLLAMA_BASE_URL}: {message}.")
+        return reachable is not False # Assume ok if requests isn't available for check
+
+    def health_check(self, base_url, api_key):
+        return probe_ollama_server(base_url)
+
+    def error_hint(self, error, model, base_url):
+        if error.kind == "unavailable":
+            return f"Ollama Fehler: Kann keine Verbindung zu '{base_url}' herstellen. Läuft der Ollama-Server?"
+        if error.kind == "not_found":
+            return f"Ollama Fehler: Modell '{model}' nicht gefunden. Wurde es mit 'ollama pull {model}' heruntergeladen?"
+        if error.kind == "timeout":
+            return "Ollama Fehler: Zeitüberschreitung bei der Anfrage. Modell könnte sehr beschäftigt sein oder Anfrage zu komplex."
+        return None
+
+    def estimate_cost(self, input_tokens, cached_tokens, output_tokens):
+        return 0.0 # Local inference
+
+def _create_llm_client(provider, model, temperature, cached_content=None, base_url=None, api_key=None):
+    """
+    Builds a new LangChain chat model through the provider plugin (optionally bound
+    to a Gemini context cache). base_url/api_key default to the .env configuration.
+    """
+    plugin = get_provider(provider)
+    if plugin is None:
+        raise ValueError(f"Unbekannter Provider '{provider}'")
+    if not plugin.load():
+        raise ImportError(f"Provider '{provider}' nicht verfügbar ({plugin.install_hint})")
+    return plugin.create_client(model, temperature, cached_content, base_url, api_key)
+
+def get_llm_client(provider, model, temperature, cached_content=None, base_url=None, api_key=None):
+    """Returns the shared client for (provider, model, temperature, context cache, endpoint), creating it once."""
+    key = (provider, model, temperature, cached_content, base_url, api_key)
+    with _llm_clients_lock:
+        llm = _llm_clients.get(key)
+        if llm is None:
+            start_time = time.perf_counter()
+            llm = _create_llm_client(provider, model, temperature, cached_content, base_url, api_key)
+            _record_llm_timing("setup", time.perf_counter() - start_time)
+            _llm_clients[key] = llm
+            logging.info(f"Neuer LLM-Client erstellt für {provider}/{model} (Temperatur {temperature}).")
+        return llm
+
+def log_llm_client_stats():
+    """Prints and logs how much time went to client setup versus inference."""
+    with _llm_stats_lock:
+        stats = dict(LLM_CLIENT_STATS)
+    avg_inference = stats["inference_seconds"] / stats["inference_count"] if stats["inference_count"] else 0.0
+    summary = (f"Client-Setup: {stats['setup_seconds']:.2f}s ({stats['setup_count']} Clients), "
+               f"Inferenz: {stats['inference_seconds']:.2f}s ({stats['inference_count']} Aufrufe, Ø {avg_inference:.2f}s)")
+    print(summary)
+    logging.info(f"LLM-Zeitaufteilung: {summary}")
+    pool = _backend_pool
+    if pool is not None and pool.configured:
+        backend_summary = f"Backends: {pool.summary()}"
+        print(backend_summary)
+        logging.info(backend_summary)
+    if stats["retries"]:
+        pauses = sum(breaker.pauses for breaker in _circuit_breakers.values())
+        retry_summary = f"Wiederholte Aufrufe: {stats['retries']}, Pausen durch Circuit-Breaker: {pauses}"
+        print(retry_summary)
+        logging.info(retry_summary)
+    if stats["stream_count"]:
+        stream_summary = (f"Streaming: Ø {stats['ttft_seconds'] / stats['stream_count']:.2f}s bis zum ersten Token, "
+                          f"Ø {stats['stream_tokens'] / stats['stream_seconds'] if stats['stream_seconds'] else 0.0:.1f} Tokens/s "
+                          f"({stats['stream_count']} Antworten)")
+        print(stream_summary)
+        logging.info(stream_summary)
+    if stats["cache_read_tokens"] or stats["prompt_eval_seconds"]:
+        prefix_summary = (f"Prompt-Verarbeitung: {stats['prompt_eval_seconds']:.2f}s, "
+                          f"aus dem Provider-Cache gelesen: {stats['cache_read_tokens']} Tokens")
+        print(prefix_summary)
+        logging.info(prefix_summary)
+
+# --- LLM-Antwort-Cache (SQLite) ---
+class LLMResponseCache:
+    """
+    Persistent, content-addressed cache for LLM completions. Entries are keyed by
+    a hash of (system prompt, user prompt, provider, model, temperature) and evicted
+    by age and total size. Safe to share across worker threads.
+    """
+
+    def __init__(self, filename, max_age_days=LLM_CACHE_MAX_AGE_DAYS, max_mb=LLM_CACHE_MAX_MB):
+        self.filename = filename
+        self.max_age_seconds = max_age_days * 86400 if max_age_days > 0 else 0
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb > 0 else 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT,"
+            " size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(system_prompt, user_prompt, provider, model, temperature):
+        payload = json.dumps([system_prompt or "", user_prompt or "", provider, model, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, *keys):
+        """
+        Returns the completion cached under the first of the keys that has a
+        valid entry, or None. One call counts as one hit or miss.
+        """
+        now = time.time()
+        with self._lock:
+            rows = {key: (response, created) for key, response, created in self._conn.execute(
+                f"SELECT key, response, created FROM responses WHERE key IN ({', '.join('?' * len(keys))})", keys)} if keys else {}
+            for key in keys:
+                row = rows.get(key)
+                if row is not None and not (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                    break
+            else:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, key, provider, model, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, response, size, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, len(response.encode('utf-8')), now, now)
             )
-            logging.info(f"Verwende Ollama ({MODEL_NAME}) unter {OLLAMA_BASE_URL} via LangChain.")
+            self._conn.commit()
+            self.stats["stores"] += 1
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones until under the size limit."""
+        with self._lock:
+            evicted = 0
+            if self.max_age_seconds:
+                cursor = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,))
+                evicted += cursor.rowcount
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        total -= size
+                        evicted += 1
+            self._conn.commit()
+            self.stats["evicted"] += evicted
+        if evicted:
+            logging.info(f"LLM-Cache: {evicted} Einträge entfernt (Alter/Größe).")
+        return evicted
+
+    def summary(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (100.0 * stats["hits"] / lookups) if lookups else 0.0
+        return (f"LLM-Cache: {stats['hits']} Treffer, {stats['misses']} Fehlschläge ({hit_rate:.0f}% Trefferquote), "
+                f"{stats['stores']} neu gespeichert, {stats['evicted']} entfernt; "
+                f"{entries} Einträge ({total / (1024 * 1024):.1f} MB)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Opens the response cache on first use (None if disabled or unavailable)."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            try:
+                _llm_cache = LLMResponseCache(LLM_CACHE_FILE)
+                _llm_cache.evict()
+                logging.info(f"LLM-Cache '{LLM_CACHE_FILE}' geöffnet.")
+            except sqlite3.Error as e:
+                logging.warning(f"LLM-Cache '{LLM_CACHE_FILE}' konnte nicht geöffnet werden: {e}. Fahre ohne Cache fort.")
+                return None
+        return _llm_cache
+
+def close_llm_cache():
+    """Evicts, reports statistics and closes the response cache if it was opened."""
+    global _llm_cache
+    with _llm_cache_lock:
+        cache, _llm_cache = _llm_cache, None
+    if cache is not None:
+        cache.evict()
+        summary = cache.summary()
+        print(summary)
+        logging.info(summary)
+        cache.close()
+
+# --- Prompt-Präfix-Cache (Gemini) ---
+_gemini_prompt_caches = {} # (model, API key, system prompt ID) -> cache name, None if not usable
+_gemini_prompt_caches_lock = threading.Lock()
+_gemini_cache_clients = {} # API key -> cache service client
+_gemini_disabled_caches = [] # (API key, cache name) no longer used, deleted with the others
+
+def _gemini_cache_client(api_key):
+    """Cache service client bound to one API key (genai.configure would switch the key process-wide)."""
+    if api_key not in _gemini_cache_clients:
+        from google.ai import generativelanguage_v1beta as glm
+        _gemini_cache_clients[api_key] = glm.CacheServiceClient(client_options={"api_key": api_key})
+    return _gemini_cache_clients[api_key]
+
+def _gemini_cache_key(system_prompt, model_name, api_key):
+    return (model_name or MODEL_NAME, api_key or GEMINI_API_KEY, register_system_prompt(system_prompt))
+
+def get_gemini_prompt_cache(system_prompt, model_name=None, api_key=None):
+    """
+    Returns the name of a Gemini context cache holding the system prompt, creating
+    it on first use. None if disabled, too small or the cache cannot be created.
+    Caches belong to one API key, so backends with different keys get their own.
+    """
+    if not GEMINI_CONTEXT_CACHE or estimate_tokens(system_prompt) < GEMINI_CACHE_MIN_TOKENS:
+        return None
+    key = _gemini_cache_key(system_prompt, model_name, api_key)
+    model_name, api_key = key[0], key[1]
+    with _gemini_prompt_caches_lock:
+        if key not in _gemini_prompt_caches:
+            try:
+                from google.ai import generativelanguage_v1beta as glm
+                model = model_name if model_name.startswith("models/") else f"models/{model_name}"
+                cached = _gemini_cache_client(api_key).create_cached_content(cached_content=glm.CachedContent(
+                    model=model, display_name="allmy_notes",
+                    system_instruction=glm.Content(parts=[glm.Part(text=system_prompt)]),
+                    ttl=timedelta(seconds=GEMINI_CACHE_TTL_SECONDS)))
+                _gemini_prompt_caches[key] = cached.name
+                logging.info(f"Gemini-Kontext-Cache '{cached.name}' für den System-Prompt erstellt (TTL {GEMINI_CACHE_TTL_SECONDS}s).")
+            except Exception as e:
+                _gemini_prompt_caches[key] = None
+                logging.warning(f"Gemini-Kontext-Cache konnte nicht erstellt werden ({type(e).__name__}: {e}). System-Prompt wird pro Anfrage gesendet.")
+        return _gemini_prompt_caches[key]
+
+def disable_gemini_prompt_cache(system_prompt, model_name=None, api_key=None):
+    key = _gemini_cache_key(system_prompt, model_name, api_key)
+    with _gemini_prompt_caches_lock:
+        if _gemini_prompt_caches.get(key):
+            _gemini_disabled_caches.append((key[1], _gemini_prompt_caches[key]))
+        _gemini_prompt_caches[key] = None
+
+def release_gemini_prompt_caches():
+    """Deletes the context caches of this run so no storage is billed after it."""
+    with _gemini_prompt_caches_lock:
+        caches = [(key[1], name) for key, name in _gemini_prompt_caches.items() if name] + _gemini_disabled_caches
+        _gemini_prompt_caches.clear()
+        _gemini_disabled_caches.clear()
+    for api_key, name in caches:
+        try:
+            _gemini_cache_client(api_key).delete_cached_content(name=name)
+            logging.info(f"Gemini-Kontext-Cache '{name}' gelöscht.")
+        except Exception as e:
+            logging.warning(f"Gemini-Kontext-Cache '{name}' konnte nicht gelöscht werden (läuft nach TTL ab): {e}")
+
+# --- Fehlerklassifikation & Wiederholungen ---
+class LLMCallError(Exception):
+    """Classified failure of one LLM call."""
+
+    def __init__(self, kind, message, retryable, retry_after=None):
+        super().__init__(message)
+        self.kind = kind # rate_limit, timeout, unavailable, server, auth, not_found, blocked, invalid, aborted, unknown
+        self.retryable = retryable
+        self.retry_after = retry_after # Seconds requested by the provider, if any
+
+RETRYABLE_ERROR_KINDS = ("rate_limit", "timeout", "unavailable", "server")
+
+# HTTP status -> kind (also used for gRPC errors mapped to HTTP by google-api-core)
+_STATUS_ERROR_KINDS = {408: "timeout", 429: "rate_limit", 500: "server", 502: "unavailable", 503: "unavailable",
+                       504: "timeout", 400: "invalid", 401: "auth", 403: "auth", 404: "not_found"}
+# Exception class names of httpx, google-api-core, ollama and the standard library
+_NAMED_ERROR_KINDS = {
+    "ResourceExhausted": "rate_limit", "TooManyRequests": "rate_limit",
+    "DeadlineExceeded": "timeout", "TimeoutError": "timeout", "ReadTimeout": "timeout", "ConnectTimeout": "timeout",
+    "WriteTimeout": "timeout", "PoolTimeout": "timeout", "TimeoutException": "timeout",
+    "ServiceUnavailable": "unavailable", "ConnectError": "unavailable", "ConnectionError": "unavailable",
+    "ConnectionRefusedError": "unavailable", "ConnectionResetError": "unavailable", "RemoteProtocolError": "unavailable",
+    "InternalServerError": "server", "BadGateway": "unavailable", "GatewayTimeout": "timeout",
+    "Unauthenticated": "auth", "PermissionDenied": "auth", "NotFound": "not_found", "InvalidArgument": "invalid",
+}
+# Last resort for wrapped errors that only keep the text
+_TEXT_ERROR_KINDS = (
+    ("rate_limit", ("429", "quota", "rate limit", "resource exhausted", "too many requests")),
+    ("auth", ("api key not valid", "permission denied", "unauthenticated", "401", "403")),
+    ("blocked", ("safety feedback", "blocked")),
+    ("not_found", ("404", "not found")),
+    ("timeout", ("timeout", "timed out", "deadline")),
+    ("unavailable", ("connection refused", "failed to connect", "unavailable", "502", "503", "connection reset")),
+    ("server", ("500", "internal error", "internal server error")),
+)
+_RETRY_AFTER_PATTERN = re.compile(r"retry(?:[ _-]?after|[ _]in|[ _]delay)\D{0,20}?(\d+(?:\.\d+)?)\s*(ms|s)?", re.IGNORECASE)
+
+def _error_chain(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+def _error_status(exc):
+    for value in (getattr(exc, 'status_code', None), getattr(exc, 'code', None),
+                  getattr(getattr(exc, 'response', None), 'status_code', None)):
+        try:
+            status = int(value)
+        except (TypeError, ValueError):
+            continue
+        if 100 <= status < 600:
+            return status
+    return None
 
-        # --- Unbekannter Provider ---
+def _error_retry_after(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        if value:
+            return max(0.0, float(value))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    match = _RETRY_AFTER_PATTERN.search(str(exc))
+    if match:
+        seconds = float(match.group(1))
+        return seconds / 1000 if (match.group(2) or '').lower() == 'ms' else seconds
+    return None
+
+def classify_llm_error(exc):
+    """
+    Maps an exception from a provider call to an LLMCallError: by HTTP status,
+    then by exception type along the cause chain, then by message text.
+    """
+    if isinstance(exc, LLMCallError):
+        return exc
+    kind = None
+    retry_after = None
+    for error in _error_chain(exc):
+        status = _error_status(error)
+        kind = kind or _STATUS_ERROR_KINDS.get(status) or (("server" if status and status >= 500 else None))
+        kind = kind or next((_NAMED_ERROR_KINDS[cls.__name__] for cls in type(error).__mro__
+                             if cls.__name__ in _NAMED_ERROR_KINDS), None)
+        retry_after = retry_after if retry_after is not None else _error_retry_after(error)
+    if kind is None:
+        text = " ".join(str(error) for error in _error_chain(exc)).lower()
+        kind = next((candidate for candidate, needles in _TEXT_ERROR_KINDS if any(needle in text for needle in needles)), "unknown")
+    return LLMCallError(kind, f"{type(exc).__name__}: {exc}", kind in RETRYABLE_ERROR_KINDS, retry_after)
+
+def retry_delay(attempt, retry_after=None):
+    """Exponential backoff with jitter (half fixed, half random); a longer Retry-After wins."""
+    delay = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0.0)
+
+# Set on Ctrl+C: workers stop retrying and give up waiting (backoff, rate limit,
+# backend slot) and streaming, instead of sleeping through it
+_llm_shutdown = threading.Event()
+
+class CircuitBreaker:
+    """
+    Pauses all calls to a provider after consecutive failures that point to an
+    outage. After the cooldown a single probe call is let through; its success
+    closes the breaker, its failure reopens it with a doubled cooldown.
+    """
+
+    def __init__(self, threshold, cooldown, max_cooldown, name=""):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.pauses = 0
+        self._condition = threading.Condition()
+
+    def try_enter(self):
+        """
+        Non-blocking check: 'closed' if calls may pass, 'probe' if this caller is
+        the single probe after the cooldown (half-open), None while open.
+        """
+        with self._condition:
+            if self.open_until - time.monotonic() > 0 or self.probing:
+                return None
+            if self.open_until:
+                self.probing = True # Half-open: this caller is the probe
+                return "probe"
+            return "closed"
+
+    @property
+    def is_closed(self):
+        return not self.open_until
+
+    def trip(self, error):
+        """Opens the breaker at once (e.g. a backend failed its health check)."""
+        with self._condition:
+            self.probing = False
+            self._open(error)
+
+    def record_success(self):
+        with self._condition:
+            self._close()
+
+    def record_failure(self, error):
+        with self._condition:
+            if not error.retryable:
+                # The provider answered, only this request was rejected
+                self._close()
+            elif self.probing:
+                self.probing = False
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open(error)
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold and not self.open_until:
+                    self._open(error)
+            self._condition.notify_all()
+
+    def _close(self):
+        if self.open_until:
+            logging.info(f"Circuit-Breaker: {self.name or 'Provider'} antwortet wieder, setze Verarbeitung fort.")
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.cooldown = self.base_cooldown
+        self._condition.notify_all()
+
+    def _open(self, error):
+        pause = max(self.cooldown, error.retry_after or 0.0)
+        self.open_until = time.monotonic() + pause
+        self.pauses += 1
+        logging.warning(f"Circuit-Breaker{f' {self.name}' if self.name else ''}: {self.failures} Fehler in Folge ({error.kind}), "
+                        f"pausiere die LLM-Aufrufe für {pause:.1f}s.")
+        print(f"WARNUNG: {self.name or 'Provider'} nicht erreichbar oder überlastet ({error.kind}) – Pause für {pause:.1f}s.")
+
+_circuit_breakers = {}
+
+def get_circuit_breaker(name):
+    """Returns the shared circuit breaker for a provider or pool backend (created on first use)."""
+    with _rate_limiters_lock:
+        breaker = _circuit_breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS, LLM_BREAKER_MAX_COOLDOWN_SECONDS, name)
+            _circuit_breakers[name] = breaker
+        return breaker
+
+# --- Backend-Pool ---
+def probe_ollama_server(base_url):
+    """Reachability probe of an Ollama server: (True/False/None if unknown, message)."""
+    try:
+        import requests
+    except ImportError:
+        return None, "'requests' Paket nicht installiert, kann Status nicht prüfen."
+    try:
+        response = requests.get(base_url, timeout=2)
+    except requests.exceptions.ConnectionError:
+        return False, f"Nicht erreichbar (Verbindungsfehler zu {base_url})"
+    except requests.exceptions.Timeout:
+        return False, f"Zeitüberschreitung bei Verbindung zu {base_url}"
+    except Exception as e:
+        return False, f"Fehler beim Prüfen ({type(e).__name__})"
+    if response.status_code == 200:
+        return True, "Erreichbar"
+    return False, f"Nicht erreichbar (Status: {response.status_code})"
+
+class LLMBackend:
+    """One endpoint of the backend pool (an Ollama host or a Gemini key) with its own limits."""
+
+    def __init__(self, name, provider, model, base_url="", api_key="", concurrency=0, overflow=False,
+                 rate=None, burst=None):
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.concurrency = concurrency # Max. calls in flight, 0 = limited by the dispatcher only
+        self.overflow = overflow # Only used while all regular backends are busy or down
+        self.limiter = get_rate_limiter(provider, name, rate, burst)
+        self.breaker = get_circuit_breaker(name)
+        self.in_flight = 0
+        self.latency = None # Smoothed response time in seconds
+        self.calls = 0
+        self.failures = 0
+        # Totals of the successful calls, for LLM_HISTORY_FILE
+        self.busy_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def health_check(self):
+        """Like the reachability probe of the configuration check; True if the backend can be used."""
+        reachable, _ = get_provider(self.provider).health_check(self.base_url, self.api_key)
+        return reachable is not False
+
+class BackendPool:
+    """
+    Spreads the calls over several backends: each call takes the free backend
+    with the lowest expected wait (smoothed latency x load), regular backends
+    before overflow ones. Backends whose circuit breaker is open are skipped,
+    so calls fail over to the others; after the cooldown a health check and a
+    single probe call decide whether the backend rejoins.
+    """
+
+    def __init__(self, backends, configured=False):
+        self.backends = backends
+        self.configured = configured # False: implicit single backend from .env
+        self.max_in_flight = 0 # Calls in flight over all backends, 0 = unlimited (set by the dispatcher)
+        self._condition = threading.Condition()
+
+    @property
+    def capacity(self):
+        """Sum of the backend limits (0 if any backend is unlimited)."""
+        return 0 if any(not backend.concurrency for backend in self.backends) else sum(b.concurrency for b in self.backends)
+
+    def _order(self, backend, avoid):
+        known = [b.latency for b in self.backends if b.latency is not None]
+        # Backends without measurements yet are tried optimistically
+        latency = backend.latency if backend.latency is not None else (min(known) if known else 0.0)
+        load = (backend.in_flight + 1) / (backend.concurrency or 1)
+        return (backend.overflow, backend.name == avoid, latency * load)
+
+    def acquire(self, avoid=None):
+        """Blocks until a backend slot is free; returns the backend (None on shutdown)."""
+        while True:
+            if _llm_shutdown.is_set():
+                return None
+            with self._condition:
+                chosen = state = None
+                in_flight = sum(b.in_flight for b in self.backends)
+                # A retry waits for another healthy backend rather than reusing the one that failed
+                skip = avoid if any(b.name != avoid and b.breaker.is_closed for b in self.backends) else None
+                free = [] if self.max_in_flight and in_flight >= self.max_in_flight else [
+                    b for b in self.backends if b.name != skip and (not b.concurrency or b.in_flight < b.concurrency)]
+                for backend in sorted(free, key=lambda b: self._order(b, avoid)):
+                    state = backend.breaker.try_enter()
+                    if state:
+                        chosen = backend
+                        chosen.in_flight += 1
+                        break
+                if chosen is None:
+                    self._condition.wait(timeout=0.5) # Slots free up, cooldowns end or the run is aborted
+                    continue
+            if state == "probe" and self.configured and not chosen.health_check():
+                logging.warning(f"Backend '{chosen.name}': Health-Check fehlgeschlagen, bleibt pausiert.")
+                self.release(chosen, error=LLMCallError("unavailable", "Health-Check fehlgeschlagen", True))
+                continue
+            return chosen
+
+    def cancel(self, backend):
+        """Frees a slot that was not used for a call (abort), without touching the statistics."""
+        with self._condition:
+            backend.in_flight -= 1
+            self._condition.notify_all()
+
+    def release(self, backend, duration=None, error=None, tokens=(0, 0)):
+        """Frees the slot and feeds the result (tokens: input, output) into the statistics and circuit breaker."""
+        with self._condition:
+            backend.in_flight -= 1
+            if error is None:
+                backend.calls += 1
+                backend.input_tokens += tokens[0]
+                backend.output_tokens += tokens[1]
+                if duration is not None:
+                    backend.busy_seconds += duration
+                    backend.latency = duration if backend.latency is None else (
+                        BACKEND_LATENCY_SMOOTHING * duration + (1 - BACKEND_LATENCY_SMOOTHING) * backend.latency)
+            else:
+                backend.failures += 1
+            self._condition.notify_all()
+        if error is None:
+            backend.breaker.record_success()
         else:
+            backend.breaker.record_failure(error)
+
+    def has_alternative(self, backend):
+        """True if another backend is currently usable (then a retry needs no backoff)."""
+        return any(other is not backend and other.breaker.is_closed for other in self.backends)
+
+    def summary(self):
+        return ", ".join(f"{b.name}: {b.calls} Aufrufe"
+                         + (f", Ø {b.latency:.2f}s" if b.latency is not None else "")
+                         + (f", {b.failures} Fehler" if b.failures else "") for b in self.backends)
+
+def load_backend_pool(filename=BACKENDS_FILE):
+    """
+    Reads the backend definitions (JSON: {"backends": [...]}). Backends whose
+    provider package is missing are left out. Raises ValueError on invalid files.
+    """
+    data = load_data(filename)
+    if not isinstance(data, dict) or not isinstance(data.get("backends"), list) or not data["backends"]:
+        raise ValueError(f"Backend-Datei '{filename}' muss eine nicht-leere Liste 'backends' enthalten")
+    backends = []
+    for number, entry in enumerate(data["backends"], start=1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Backend-Eintrag {number} ist kein Objekt")
+        provider = str(entry.get("provider", "")).lower()
+        name = entry.get("name") or f"{provider}-{number}"
+        if any(backend.name == name for backend in backends):
+            raise ValueError(f"Backend-Name '{name}' ist doppelt")
+        if not (entry.get("model") or MODEL_NAME):
+            raise ValueError(f"Backend-Eintrag {number} ('{name}') hat kein 'model' und MODEL_NAME ist nicht gesetzt")
+        plugin = get_provider(provider)
+        if plugin is None:
+            logging.error(f"Backend '{name}' wird ausgelassen (unbekannter Provider '{provider}').")
+            continue
+        if not plugin.installed():
+            logging.error(f"Backend '{name}' wird ausgelassen (Provider '{provider}' nicht installiert: {plugin.install_hint}).")
+            continue
+        backends.append(LLMBackend(
+            name, provider, entry.get("model") or MODEL_NAME,
+            base_url=entry.get("base_url") or plugin.default_base_url(),
+            api_key=os.environ.get(entry["api_key_env"], "") if entry.get("api_key_env") else plugin.default_api_key(),
+            concurrency=max(1, int(entry.get("concurrency", 1))),
+            overflow=bool(entry.get("overflow", False)),
+            rate=entry.get("rate"), burst=entry.get("burst"),
+        ))
+    return BackendPool(backends, configured=True)
+
+_backend_pool = None
+_backend_pool_lock = threading.Lock()
+
+def get_backend_pool():
+    """Returns the backend pool: from BACKENDS_FILE if present, else the single backend from .env."""
+    global _backend_pool
+    with _backend_pool_lock:
+        if _backend_pool is None:
+            if Path(BACKENDS_FILE).exists():
+                _backend_pool = load_backend_pool(BACKENDS_FILE)
+                logging.info(f"Backend-Pool aus '{BACKENDS_FILE}': {', '.join(b.name for b in _backend_pool.backends)}")
+            else:
+                _backend_pool = _env_backend_pool()
+        return _backend_pool
+
+def _env_backend_pool():
+    """The single backend from LLM_PROVIDER / MODEL_NAME in .env."""
+    plugin = get_provider(LLM_PROVIDER)
+    return BackendPool([LLMBackend(LLM_PROVIDER, LLM_PROVIDER, MODEL_NAME,
+                                   base_url=plugin.default_base_url() if plugin else "",
+                                   api_key=plugin.default_api_key() if plugin else "")])
+
+def get_planning_backend_pool():
+    """
+    The backend pool for estimates; an invalid BACKENDS_FILE (possible with
+    --dry-run, which skips the configuration check) falls back to the .env backend.
+    """
+    try:
+        return get_backend_pool()
+    except (ValueError, TypeError) as e:
+        logging.warning(f"Backend-Datei '{BACKENDS_FILE}' ist ungültig ({e}), Planung mit dem Backend aus der .env.")
+        return _env_backend_pool()
+
+def effective_concurrency(concurrency):
+    """Calls in flight during the run: the capacity of a configured backend pool, else concurrency."""
+    pool = get_planning_backend_pool()
+    return pool.capacity if pool.configured and pool.capacity else concurrency
+
+def _llm_error_text(error, exc, backend=None):
+    """
+    Error string returned to the dispatcher, naming the backend that failed (the
+    .env provider if none was chosen yet); marks retryable failures for re-queueing.
+    """
+    cause = exc.__cause__ if isinstance(exc, LLMCallError) and exc.__cause__ else exc
+    if backend is None:
+        source = LLM_PROVIDER
+    else:
+        source = backend.name if backend.name == backend.provider else f"{backend.name}, {backend.provider}"
+    return f"[FEHLER bei LLM-Aufruf ({source}): {type(cause).__name__}, {error.kind}{', wiederholbar' if error.retryable else ''}]"
+
+def _is_retryable_llm_error(text):
+    return bool(text) and text.startswith("[FEHLER") and text.endswith(", wiederholbar]")
+
+# --- Angepasste LLM-Aufruffunktion ---
+def _stream_llm_response(llm, messages, stream_to):
+    """
+    Consumes the token stream, writing every chunk to stream_to as it arrives.
+    Returns (text, time to first token, output tokens).
+    """
+    start_time = time.perf_counter()
+    ttft = None
+    parts = []
+    usage_tokens = 0
+    for chunk in llm.stream(messages):
+        if _llm_shutdown.is_set():
+            raise LLMCallError("aborted", "Abbruch angefordert", False)
+        text = getattr(chunk, 'content', '') or ''
+        if not isinstance(text, str): # Some providers stream content blocks
+            text = "".join(block.get('text', '') if isinstance(block, dict) else str(block) for block in text)
+        _record_prefix_usage(chunk)
+        usage = getattr(chunk, 'usage_metadata', None) or {}
+        usage_tokens += int(usage.get('output_tokens') or 0) if isinstance(usage, dict) else 0
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - start_time
+        stream_to.write(text)
+        stream_to.flush()
+        parts.append(text)
+    text = "".join(parts)
+    return text, (ttft if ttft is not None else time.perf_counter() - start_time), usage_tokens or estimate_tokens(text)
+
+def _rewind_stream(stream_to):
+    stream_to.seek(0)
+    stream_to.truncate()
+
+def invoke_langchain_llm(system_prompt, user_prompt, stream_to=None):
+    """Ruft das konfigurierte LLM (Provider-Plugin, z. B. Gemini oder Ollama) über LangChain auf."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    backend = None
+    temperature = 0.7 # Standard-Temperatur, kann angepasst werden
+
+    try:
+        pool = get_backend_pool()
+        if pool.configured:
+            # Every backend carries its own model (checked in load_backend_pool)
+            if not pool.backends:
+                logging.error(f"FEHLER: Kein Backend aus '{BACKENDS_FILE}' verfügbar.")
+                return "[FEHLER: Kein Backend verfügbar]"
+        elif not MODEL_NAME:
+            logging.error("FEHLER: Umgebungsvariable 'MODEL_NAME' ist nicht gesetzt.")
+            return "[FEHLER: Modellname fehlt in .env]"
+        elif get_provider(LLM_PROVIDER) is None:
+            # --- Unbekannter Provider ---
             logging.error(f"FEHLER: Unbekannter LLM_PROVIDER '{LLM_PROVIDER}' in .env konfiguriert.")
             return f"[FEHLER: Unbekannter Provider '{LLM_PROVIDER}']"
+        else:
+            problem = get_provider(LLM_PROVIDER).configuration_problem()
+            if problem:
+                logging.error(f"FEHLER: {problem}")
+                return f"[FEHLER: {problem}]"
 
         # --- Gemeinsamer Aufruf ---
         messages = []
@@ -624,367 +3207,1497 @@ def invoke_langchain_llm(system_prompt, user_prompt):
              return "[FEHLER: Keine Nachrichten für LLM]"
 
 
-        logging.info(f"Sende Anfrage an {LLM_PROVIDER} ({MODEL_NAME})...")
-        start_time = time.time()
-        response = llm.invoke(messages)
-        end_time = time.time()
-        duration = end_time - start_time
-        logging.info(f"Antwort von {LLM_PROVIDER} erhalten (Dauer: {duration:.2f}s).")
-
-
-        # Extract content safely
-        generated_text = getattr(response, 'content', '')
+        # Return identical prompts from the persistent cache without calling the model
+        # (an answer of any pool backend with the same provider and model counts; one lookup per request)
+        cache = get_llm_cache()
+        if cache is not None:
+            cached_text = cache.get(*(LLMResponseCache.make_key(system_prompt, user_prompt, provider, model, temperature)
+                                      for provider, model in dict.fromkeys((b.provider, b.model) for b in pool.backends)))
+            if cached_text is not None:
+                logging.info("LLM-Cache-Treffer, kein Aufruf nötig.")
+                if stream_to is not None:
+                    stream_to.write(cached_text)
+                return cached_text
+
+        no_prompt_cache = set() # Backends whose Gemini context cache was rejected
+
+        def call(client, call_messages):
+            _record_llm_call()
+            if stream_to is None:
+                response = client.invoke(call_messages)
+                _record_prefix_usage(response)
+                return getattr(response, 'content', ''), None, None
+            return _stream_llm_response(client, call_messages, stream_to)
+
+        def call_once(backend):
+            # With a Gemini context cache the system prompt is not sent again
+            prompt_cache = None
+            if get_provider(backend.provider).supports_context_cache and len(messages) > 1 and backend.name not in no_prompt_cache:
+                prompt_cache = get_gemini_prompt_cache(system_prompt, backend.model, backend.api_key)
+            if prompt_cache:
+                try:
+                    return call(get_llm_client(backend.provider, backend.model, temperature, prompt_cache, api_key=backend.api_key), messages[1:])
+                except Exception as e:
+                    if classify_llm_error(e).retryable:
+                        raise
+                    # Cache expired or rejected: continue without it
+                    logging.warning(f"Aufruf mit Gemini-Kontext-Cache fehlgeschlagen ({type(e).__name__}: {e}), wiederhole ohne Cache.")
+                    disable_gemini_prompt_cache(system_prompt, backend.model, backend.api_key)
+                    no_prompt_cache.add(backend.name)
+                    if stream_to is not None:
+                        _rewind_stream(stream_to)
+            # Reuse the pooled client instead of constructing a new one per call
+            return call(get_llm_client(backend.provider, backend.model, temperature,
+                                       base_url=backend.base_url or None, api_key=backend.api_key or None), messages)
+
+        # Retry transient failures: at once on another backend, else with backoff.
+        # If every backend's breaker is open, all workers wait in acquire()
+        avoid = None
+        attempt = 0
+        while True:
+            backend = pool.acquire(avoid)
+            if backend is None:
+                raise LLMCallError("aborted", "Abbruch angefordert", False)
+            if not backend.limiter.acquire():
+                pool.cancel(backend)
+                raise LLMCallError("aborted", "Abbruch angefordert", False)
+            logging.info(f"Sende Anfrage an {backend.name} ({backend.model})..." + (f" (Versuch {attempt + 1})" if attempt else ""))
+            start_time = time.perf_counter()
+            try:
+                generated_text, ttft, output_tokens = call_once(backend)
+            except Exception as e:
+                error = classify_llm_error(e)
+                pool.release(backend, error=error)
+                if not error.retryable or attempt >= LLM_RETRY_MAX:
+                    raise error from e
+                delay = 0.0 if pool.has_alternative(backend) else retry_delay(attempt, error.retry_after)
+                avoid = backend.name
+                _record_llm_retry()
+                logging.warning(f"LLM-Aufruf an {backend.name} fehlgeschlagen ({error.kind}: {e}), neuer Versuch {attempt + 2}/{LLM_RETRY_MAX + 1} in {delay:.1f}s.")
+                if stream_to is not None:
+                    _rewind_stream(stream_to)
+                if _llm_shutdown.wait(delay):
+                    raise error from e
+                attempt += 1
+                continue
+            duration = time.perf_counter() - start_time
+            usage = (estimate_tokens(system_prompt) + estimate_tokens(user_prompt), estimate_tokens(generated_text or ''))
+            pool.release(backend, duration, tokens=usage)
+            break
+        _record_llm_timing("inference", duration)
+        PROFILER.record_latency("llm_call", duration)
+        _record_llm_tokens(*usage)
+        if ttft is None:
+            logging.info(f"Antwort von {backend.name} erhalten (Dauer: {duration:.2f}s).")
+        else:
+            generation_seconds = max(duration - ttft, 1e-6)
+            _record_stream_timing(ttft, generation_seconds, output_tokens)
+            logging.info(f"Antwort von {backend.name} gestreamt (Dauer: {duration:.2f}s, erstes Token nach {ttft:.2f}s, "
+                         f"{output_tokens / generation_seconds:.1f} Tokens/s).")
 
         if not generated_text or not generated_text.strip():
-            logging.warning(f"LangChain LLM ({LLM_PROVIDER}) hat leeren oder nur Whitespace-Text zurückgegeben.")
+            logging.warning(f"LangChain LLM ({backend.name}) hat leeren oder nur Whitespace-Text zurückgegeben.")
             return "" # Return empty string for empty/whitespace response
         else:
              # Log only a preview of the response
              log_preview = (generated_text[:150] + '...') if len(generated_text) > 150 else generated_text
              logging.info(f"LLM-Antwort (Vorschau): {log_preview.replace(os.linesep, ' ')}") # Replace newlines for compact log
+             if cache is not None:
+                 try:
+                     cache.put(LLMResponseCache.make_key(system_prompt, user_prompt, backend.provider, backend.model, temperature),
+                               backend.provider, backend.model, generated_text.strip())
+                 except sqlite3.Error as e:
+                     logging.warning(f"Konnte LLM-Antwort nicht im Cache speichern: {e}")
              return generated_text.strip() # Return stripped text
 
     except Exception as e:
-        logging.error(f"Schwerwiegender Fehler beim Aufruf des LangChain LLM ({LLM_PROVIDER}): {e}", exc_info=True)
-        # Provide more specific hints based on provider and error type
-        error_message = f"[FEHLER bei LLM-Aufruf ({LLM_PROVIDER}): {type(e).__name__}]"
-        if LLM_PROVIDER == "ollama":
-             if "Connection refused" in str(e) or "failed to connect" in str(e).lower():
-                 logging.error(f"-> Ollama Fehler: Kann keine Verbindung zu '{OLLAMA_BASE_URL}' herstellen. Läuft der Ollama-Server?")
-                 error_message += " (Connection refused)"
-             elif "404" in str(e) and "model" in str(e).lower():
-                 logging.error(f"-> Ollama Fehler: Modell '{MODEL_NAME}' nicht gefunden. Wurde es mit 'ollama pull {MODEL_NAME}' heruntergeladen?")
-                 error_message += " (Model not found)"
-             elif "timeout" in str(e).lower():
-                  logging.error(f"-> Ollama Fehler: Zeitüberschreitung bei der Anfrage. Modell könnte sehr beschäftigt sein oder Anfrage zu komplex.")
-                  error_message += " (Timeout)"
-        elif LLM_PROVIDER == "gemini":
-             if "API key not valid" in str(e):
-                 logging.error("-> Gemini Fehler: API-Schlüssel ist ungültig. Bitte GEMINI_API_KEY in .env prüfen.")
-                 error_message += " (Invalid API Key)"
-             elif "permission denied" in str(e).lower() or "quota" in str(e).lower():
-                 logging.error("-> Gemini Fehler: Möglicherweise Berechtigungsproblem oder API-Kontingent überschritten.")
-                 error_message += " (Permission/Quota Issue)"
-             elif "DeadlineExceeded" in str(e) or "timeout" in str(e).lower():
-                 logging.error(f"-> Gemini Fehler: Zeitüberschreitung bei der Anfrage. Netzwerkproblem oder Anfrage zu komplex?")
-                 error_message += " (Timeout/Deadline Exceeded)"
-             elif "Safety feedback" in str(e) or "blocked" in str(e).lower():
-                  logging.error(f"-> Gemini Fehler: Inhalt wurde aufgrund von Sicherheitseinstellungen blockiert. Safety Settings im Skript sind auf BLOCK_NONE, prüfe Prompt-Inhalt oder API-Einstellungen.")
-                  error_message += " (Blocked by Safety Filter)"
-
-
-        return error_message # Return specific error message
+        error = classify_llm_error(e)
+        if error.kind == "aborted":
+            logging.info("LLM-Aufruf wegen Abbruch nicht (weiter) ausgeführt.")
+            return _llm_error_text(error, e, backend)
+        provider = backend.provider if backend is not None else LLM_PROVIDER
+        logging.error(f"Schwerwiegender Fehler beim Aufruf des LangChain LLM ({backend.name if backend is not None else provider}, {error.kind}): {e}",
+                      exc_info=error.kind == "unknown")
+        # Provide more specific hints based on provider and error kind
+        plugin = get_provider(provider)
+        hint = plugin.error_hint(error, backend.model if backend is not None else MODEL_NAME,
+                                 backend.base_url if backend is not None else plugin.default_base_url()) if plugin else None
+        if hint:
+            logging.error(f"-> {hint}")
+
+        return _llm_error_text(error, e, backend) # Return specific error message
+
+
+# --- Inkrementelle Verarbeitung (Manifest) ---
+class RunManifest:
+    """
+    Per-thread record of what was generated: hash of the prepared request, model
+    and output file. Lets a run send only the threads that are new or changed.
+    """
+
+    def __init__(self, filename=MANIFEST_FILE):
+        self.filename = filename
+        self.entries = {}
+        self.dirty = False
+        if Path(filename).exists():
+            data = load_data(filename)
+            if isinstance(data, dict) and isinstance(data.get("threads"), dict):
+                self.entries = data["threads"]
+            else:
+                logging.warning(f"Manifest '{filename}' ist ungültig und wird neu aufgebaut.")
+
+    @staticmethod
+    def content_hash(request, provider=None, model=None):
+        """Hash over everything that ends up in the output file."""
+        payload = json.dumps([
+            request_system_prompt(request), request.get("user_prompt") or "",
+            request.get("title"), request.get("category"), request.get("links") or [],
+            provider or LLM_PROVIDER, model or MODEL_NAME,
+        ], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def classify(self, request, existing_files):
+        """
+        Returns 'new', 'changed' or 'unchanged' and stores the hash on the request.
+        existing_files: case-folded names in the output directory (scan_output_dir).
+        """
+        content_hash = request.get("content_hash") or self.content_hash(request)
+        request["content_hash"] = content_hash
+        entry = self.entries.get(request.get("thread_id"))
+        if entry is None:
+            return "new"
+        output_file = entry.get("output_file")
+        if entry.get("hash") == content_hash and output_file and output_file.casefold() in existing_files:
+            return "unchanged"
+        return "changed"
+
+    def record(self, request, output_path):
+        self.entries[request["thread_id"]] = {
+            "hash": request.get("content_hash") or self.content_hash(request),
+            "provider": LLM_PROVIDER,
+            "model": MODEL_NAME,
+            "title": request.get("title"),
+            "output_file": output_path.name,
+            "updated_at": datetime.now().isoformat(timespec='seconds'),
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return True
+        if save_data({"version": 1, "threads": self.entries}, self.filename):
+            self.dirty = False
+            return True
+        return False
 
+def plan_incremental_run(llm_requests, manifest, output_dir):
+    """
+    Splits the prepared requests by manifest state. Returns the requests still to
+    send (new and changed) and the counters. Changed threads may overwrite the
+    output file this script produced for them earlier.
+    """
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    pending = []
+    existing_files = scan_output_dir(output_dir)
+    for request in llm_requests:
+        state = manifest.classify(request, existing_files)
+        counts[state] += 1
+        if state == "unchanged":
+            logging.debug("Thema '%s' unverändert seit letztem Lauf, wird übersprungen.", request.get('thread_id'))
+            continue
+        if state == "changed":
+            entry = manifest.entries[request["thread_id"]]
+            old_file = entry.get("output_file")
+            request["overwrite"] = old_file in output_file_names(request)
+            if old_file and not request["overwrite"]:
+                logging.info(f"Titel von '{request['thread_id']}' hat sich geändert, alte Ausgabe '{old_file}' bleibt bestehen.")
+            logging.info(f"Thema '{request['thread_id']}' hat sich seit dem letzten Lauf geändert.")
+        pending.append(request)
+    logging.info(f"Manifest: {counts['new']} neu, {counts['changed']} geändert, {counts['unchanged']} unverändert.")
+    return pending, counts
+
+
+# --- Laufjournal (Fortsetzen nach Abbruch) ---
+class RunJournal:
+    """
+    Append-only journal (JSON lines) of one LLM run: a header with the filter
+    settings and system prompts, every prepared request and each state change
+    (inflight, requeued, done, failed, skipped). Enough to resume an interrupted
+    run without filtering or preparing the prompts again.
+    """
+    UNFINISHED_STATES = ("queued", "inflight", "requeued")
+    SYNC_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, filename=RUN_JOURNAL_FILE):
+        self.filename = filename
+        self._file = None
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+
+    def start(self, llm_requests, info):
+        """Begins a new journal (replaces the previous one once completely written)."""
+        prompt_ids = {request.get("system_prompt_id") for request in llm_requests}
+        header = dict(info, event="run", started_at=datetime.now().isoformat(timespec='seconds'),
+                      provider=LLM_PROVIDER, model=MODEL_NAME,
+                      system_prompts={prompt_id: _system_prompts.get(prompt_id, "") for prompt_id in prompt_ids})
+        temp_path = Path(str(self.filename) + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for journal_id, request in enumerate(llm_requests):
+                request["journal_id"] = journal_id
+                f.write(json.dumps({"event": "queued", "id": journal_id, "request": request}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.filename)
+        self._file = open(self.filename, 'a', encoding='utf-8')
+        logging.info(f"Laufjournal '{self.filename}' mit {len(llm_requests)} Anfragen angelegt.")
+
+    def load(self):
+        """
+        Reads the journal. Returns (header, unfinished requests in original order,
+        counters per state). Failed requests with a retryable error count as unfinished.
+        """
+        header = None
+        requests = {}
+        states = {}
+        reasons = {}
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line incomplete
+                    logging.warning(f"Laufjournal '{self.filename}': Zeile {line_number} unvollständig, wird ignoriert.")
+                    continue
+                kind = event.get("event")
+                if kind == "run":
+                    header = event
+                elif kind == "queued":
+                    requests[event["id"]] = event["request"]
+                    states[event["id"]] = "queued"
+                elif "id" in event:
+                    states[event["id"]] = kind
+                    reasons[event["id"]] = event.get("reason")
+        if header is None:
+            raise ValueError(f"Laufjournal '{self.filename}' enthält keinen Laufkopf")
+        for prompt_id, text in (header.get("system_prompts") or {}).items():
+            if register_system_prompt(text) != prompt_id:
+                logging.warning(f"Laufjournal: System-Prompt '{prompt_id}' passt nicht zu seinem Inhalt.")
+        pending = [requests[journal_id] for journal_id in sorted(requests)
+                   if states[journal_id] in self.UNFINISHED_STATES
+                   or (states[journal_id] == "failed" and _is_retryable_llm_error(reasons.get(journal_id)))]
+        counts = {}
+        for state in states.values():
+            counts[state] = counts.get(state, 0) + 1
+        return header, pending, counts
+
+    def reopen(self):
+        """Continues appending to an existing journal (resume)."""
+        self._file = open(self.filename, 'a', encoding='utf-8')
+        self.event("resume", started_at=datetime.now().isoformat(timespec='seconds'))
+
+    def record(self, request, state, **details):
+        if "journal_id" in request:
+            self.event(state, id=request["journal_id"], **details)
+
+    def event(self, kind, **details):
+        if self._file is None:
+            return
+        line = json.dumps(dict(details, event=kind), ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                self._file.write(line)
+                self._file.flush()
+                now = time.monotonic()
+                if now - self._last_sync >= self.SYNC_INTERVAL_SECONDS:
+                    os.fsync(self._file.fileno())
+                    self._last_sync = now
+            except OSError as e:
+                logging.warning(f"Laufjournal '{self.filename}' konnte nicht geschrieben werden: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+            self._file.close()
+            self._file = None
+
+
+# --- Planung vor dem Senden ---
+def _history_key(provider=None, model=None):
+    return f"{provider or LLM_PROVIDER}/{model or MODEL_NAME}"
+
+def load_llm_history(filename=LLM_HISTORY_FILE, provider=None, model=None):
+    """Returns the measured totals for a provider/model (default: the .env one; empty dict if none)."""
+    if not Path(filename).exists():
+        return {}
+    history = load_data(filename)
+    entry = history.get(_history_key(provider, model)) if isinstance(history, dict) else None
+    return entry if isinstance(entry, dict) else {}
+
+def save_llm_history(filename=LLM_HISTORY_FILE):
+    """Adds the inference time and tokens of this run to the history of each provider/model used."""
+    pool = _backend_pool
+    if pool is not None and pool.configured:
+        measured = [(_history_key(b.provider, b.model), b.calls, b.busy_seconds, b.input_tokens, b.output_tokens)
+                    for b in pool.backends if b.calls]
+    else:
+        with _llm_stats_lock:
+            stats = dict(LLM_CLIENT_STATS)
+        measured = [(_history_key(), stats["inference_count"], stats["inference_seconds"],
+                     stats["input_tokens"], stats["output_tokens"])] if stats["inference_count"] else []
+    if not measured:
+        return False
+    history = load_data(filename) if Path(filename).exists() else None
+    history = history if isinstance(history, dict) else {}
+    for key, calls, seconds, input_tokens, output_tokens in measured:
+        entry = history.setdefault(key, {"calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0})
+        entry["calls"] += calls
+        entry["seconds"] = round(entry["seconds"] + seconds, 3)
+        entry["input_tokens"] += input_tokens
+        entry["output_tokens"] += output_tokens
+        entry["updated_at"] = datetime.now().isoformat(timespec='seconds')
+    return save_data(history, filename)
+
+def build_llm_plan(llm_requests, max_workers=LLM_MAX_CONCURRENCY):
+    """
+    Estimates tokens, Gemini cost and wall-clock time of sending the requests,
+    and flags requests (or map-reduce chunks) exceeding the context window.
+    Nothing is sent. The estimate covers the backends the run will use (see
+    get_backend_pool) with max_workers calls at once; time and output size
+    come from LLM_HISTORY_FILE if available.
+    """
+    # One lane per backend: its parallel calls and measured seconds per token
+    lanes = []
+    for backend in get_planning_backend_pool().backends:
+        history = load_llm_history(provider=backend.provider, model=backend.model)
+        lanes.append({"backend": backend, "slots": backend.concurrency or max_workers, "history": history,
+                      "seconds_per_token": history["seconds"] / max(1, history["input_tokens"] + history["output_tokens"])
+                                           if history.get("calls") else None})
+    measured = [lane["history"] for lane in lanes if lane["seconds_per_token"] is not None]
+    calls_measured = sum(history["calls"] for history in measured)
+    if calls_measured:
+        output_per_call = sum(history["output_tokens"] for history in measured) / calls_measured
+        seconds_per_token = (sum(history["seconds"] for history in measured)
+                             / max(1, sum(history["input_tokens"] + history["output_tokens"] for history in measured)))
+    else:
+        output_per_call = LLM_EXPECTED_OUTPUT_TOKENS
+        seconds_per_token = None
+
+    items = []
+    map_system_tokens = estimate_tokens(MAP_SYSTEM_PROMPT)
+    for request in llm_requests:
+        system_tokens = estimate_tokens(request_system_prompt(request))
+        user_tokens = estimate_tokens(request['user_prompt'])
+        chunks = request.get("chunks")
+        if chunks:
+            # Map calls per chunk, then one synthesis over the summaries
+            call_inputs = [map_system_tokens + estimate_tokens(chunk) for chunk in chunks]
+            call_inputs.append(system_tokens + int(len(chunks) * output_per_call))
+        else:
+            call_inputs = [system_tokens + user_tokens]
+        items.append({
+            "thread_id": request.get("thread_id"),
+            "title": request.get("title"),
+            "system_tokens": system_tokens,
+            "user_tokens": user_tokens,
+            "calls": len(call_inputs),
+            "input_tokens": sum(call_inputs),
+            "output_tokens": int(len(call_inputs) * output_per_call),
+            "map_reduce": bool(chunks),
+            "over_context": any(tokens + output_per_call > LLM_CONTEXT_TOKENS for tokens in call_inputs),
+        })
 
-# --- Hauptfunktion (main) ---
-def main():
-    """Hauptfunktion des Skripts."""
-    global LLM_PROVIDER, MODEL_NAME, GEMINI_API_KEY, OLLAMA_BASE_URL, GEMINI_AVAILABLE, OLLAMA_AVAILABLE
+    # Packed small threads share one call and one copy of the system prompt
+    for batch_number, group in enumerate(pack_llm_batches(llm_requests), start=1):
+        if len(group) < 2: continue
+        for position in group:
+            items[position]["batch"] = batch_number
+        for position in group[1:]:
+            items[position]["calls"] = 0
+            items[position]["input_tokens"] -= items[position]["system_tokens"]
+
+    input_tokens = sum(item["input_tokens"] for item in items)
+    output_tokens = sum(item["output_tokens"] for item in items)
+    calls = sum(item["calls"] for item in items)
+
+    # The dispatcher runs at most max_workers calls, spread over the backends by their speed
+    total_slots = sum(lane["slots"] for lane in lanes)
+    scale = min(1.0, max(1, max_workers) / total_slots) if total_slots else 0.0
+    for lane in lanes:
+        # Backends without measurements are assumed to be as fast as the measured ones
+        lane_seconds_per_token = lane["seconds_per_token"] or seconds_per_token
+        lane["throughput"] = lane["slots"] * scale / lane_seconds_per_token if lane_seconds_per_token else None
+    throughput = sum(lane["throughput"] for lane in lanes) if seconds_per_token is not None else None
+    for lane in lanes:
+        lane["share"] = lane["throughput"] / throughput if throughput else lane["slots"] / total_slots
+
+    # With a Gemini context cache only the first call pays the full price for the system prompt
+    cacheable = [item for item in items if item["system_tokens"] >= GEMINI_CACHE_MIN_TOKENS and item["calls"]]
+    cacheable_tokens = max(0, sum(item["system_tokens"] for item in cacheable) - (cacheable[0]["system_tokens"] if cacheable else 0))
+    cached_tokens = 0
+    cost = 0.0 if lanes else None
+    for lane in lanes:
+        plugin = get_provider(lane["backend"].provider)
+        lane_cached = int(cacheable_tokens * lane["share"]) if plugin is not None and plugin.supports_context_cache else 0
+        cached_tokens += lane_cached
+        lane_cost = plugin.estimate_cost(int(input_tokens * lane["share"]) - lane_cached, lane_cached,
+                                         int(output_tokens * lane["share"])) if plugin is not None else None
+        cost = None if cost is None or lane_cost is None else cost + lane_cost
+    cost = round(cost, 4) if cost is not None else None
+
+    eta_seconds = None
+    if throughput:
+        eta_seconds = (input_tokens + output_tokens) / throughput
+        rates = [lane["backend"].limiter.rate for lane in lanes]
+        if all(rate > 0 for rate in rates):
+            eta_seconds = max(eta_seconds, calls / sum(rates)) # The rate limits can be the bottleneck
+        eta_seconds = round(eta_seconds, 1)
+
+    return {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "provider": LLM_PROVIDER,
+        "model": MODEL_NAME,
+        "requests": len(items),
+        "llm_calls": calls,
+        "input_tokens": input_tokens,
+        "output_tokens_estimate": output_tokens,
+        "cached_input_tokens_estimate": cached_tokens,
+        "cost_usd_estimate": cost,
+        "context_window": LLM_CONTEXT_TOKENS,
+        "over_context": [item["thread_id"] for item in items if item["over_context"]],
+        "concurrency": max_workers,
+        "backends": [{"name": lane["backend"].name, "provider": lane["backend"].provider, "model": lane["backend"].model,
+                      "concurrency": lane["slots"], "share": round(lane["share"], 3),
+                      "history_calls": lane["history"].get("calls", 0)} for lane in lanes],
+        "history_calls": calls_measured,
+        "seconds_per_token": seconds_per_token,
+        "eta_seconds": eta_seconds,
+        "items": items,
+    }
+
+def print_llm_plan(plan):
+    print(f"\n--- Planung ---")
+    print(f"LLM-Aufrufe: {plan['llm_calls']} für {plan['requests']} Anfragen")
+    input_str = f"{plan['input_tokens']:,}".replace(',', '.')
+    output_str = f"{plan['output_tokens_estimate']:,}".replace(',', '.')
+    print(f"Tokens (geschätzt):  {input_str} Eingabe, {output_str} Ausgabe")
+    if plan["cached_input_tokens_estimate"]:
+        cached_str = f"{plan['cached_input_tokens_estimate']:,}".replace(',', '.')
+        print(f"                     davon {cached_str} aus dem Gemini-Kontext-Cache (System-Prompt)")
+    if plan["cost_usd_estimate"] is not None:
+        print(f"Kosten (geschätzt):  {plan['cost_usd_estimate']:.2f} USD")
+    if len(plan["backends"]) > 1:
+        print("Backends:            " + ", ".join(f"{b['name']} ({b['model']}, {b['concurrency']} gleichzeitig, ~{b['share']:.0%})"
+                                                  for b in plan["backends"]))
+    if plan["eta_seconds"] is not None:
+        print(f"Dauer (geschätzt):   {timedelta(seconds=round(plan['eta_seconds']))} (aus {plan['history_calls']} gemessenen Aufrufen)")
+    else:
+        print(f"Dauer (geschätzt):   unbekannt (noch keine Messwerte in '{LLM_HISTORY_FILE}')")
+    if plan["over_context"]:
+        print(f"WARNUNG: {len(plan['over_context'])} Anfragen überschreiten das Kontextfenster ({plan['context_window']} Tokens): "
+              f"{', '.join(map(str, plan['over_context'][:10]))}{' ...' if len(plan['over_context']) > 10 else ''}")
+        print("         -> LLM_MAX_PROMPT_TOKENS setzen, um sie per Map-Reduce zu verarbeiten.")
+    print("---------------")
+    logging.info(f"Planung: {plan['llm_calls']} Aufrufe, {plan['input_tokens']} Eingabe-Tokens, Kosten {plan['cost_usd_estimate']}, "
+                 f"Dauer {plan['eta_seconds']}s, {len(plan['over_context'])} über Kontextfenster.")
+
+
+# --- Parallele LLM-Verarbeitung ---
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests may start per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate # Tokens refilled per second (<= 0 disables limiting)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it; False if the run is aborted meanwhile."""
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if _llm_shutdown.wait(wait):
+                return False
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider, name=None, rate=None, burst=None):
+    """Returns the shared token bucket for a provider or pool backend (created on first use)."""
+    key = name or provider
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            default_rate, default_burst = DEFAULT_RATE_LIMITS.get(provider, (1.0, 1))
+            rate = float(rate if rate is not None else os.environ.get("LLM_RATE_LIMIT", default_rate))
+            burst = int(burst if burst is not None else os.environ.get("LLM_RATE_BURST", default_burst))
+            limiter = TokenBucket(rate, burst)
+            _rate_limiters[key] = limiter
+            logging.info(f"Ratenbegrenzung für '{key}': {rate} Anfragen/s (Burst {burst}).")
+        return limiter
+
+def _is_llm_error(text):
+    return not text or text.startswith("[FEHLER")
+
+def _reduce_prompt(title, summaries):
+    sections = [f"## Abschnitt {i} von {len(summaries)}\n{summary}" for i, summary in enumerate(summaries, start=1)]
+    return (f"# Thema: {title}\n\n"
+            "Die folgenden Abschnitte fassen aufeinanderfolgende Teile dieses Themas in chronologischer Reihenfolge zusammen.\n\n"
+            + POST_SEPARATOR.join(sections))
+
+def synthesize_map_reduce(request, map_executor=None):
+    """
+    Map-reduce for oversized threads: summarizes the chunks (in parallel on the
+    dispatcher's shared map_executor, else one after another), merges summaries
+    that are still too long for one call, and runs the final synthesis with the
+    normal system prompt. Returns the text or an "[FEHLER ...]" string.
+    """
+    title = request.get('title', 'Unbekannter Titel')
+    texts = request["chunks"]
+    level = 1
+    summarize = lambda text: invoke_langchain_llm(MAP_SYSTEM_PROMPT, text)
+    while True:
+        logging.info(f"Map-Reduce '{title}': Stufe {level}, {len(texts)} Abschnitte werden zusammengefasst.")
+        summaries = list(map_executor.map(summarize, texts) if map_executor is not None else map(summarize, texts))
+        failed = [summary for summary in summaries if _is_llm_error(summary)]
+        if failed:
+            logging.error(f"Map-Reduce '{title}': {len(failed)} von {len(summaries)} Abschnitten fehlgeschlagen.")
+            return failed[0] or "[FEHLER: Leere Zusammenfassung eines Abschnitts]"
+        reduce_prompt = _reduce_prompt(title, summaries)
+        if (len(summaries) == 1 or not LLM_MAX_PROMPT_TOKENS
+                or estimate_tokens(request_system_prompt(request)) + estimate_tokens(reduce_prompt) <= LLM_MAX_PROMPT_TOKENS):
+            break
+        # Summaries together are still too long: group and summarize them again
+        chunk_budget = max(1, LLM_MAX_PROMPT_TOKENS - estimate_tokens(MAP_SYSTEM_PROMPT))
+        texts = _chunk_post_blocks(f"# Thema: {title}\n", summaries, chunk_budget)
+        if len(texts) >= len(summaries):
+            logging.warning(f"Map-Reduce '{title}': Zusammenfassungen lassen sich nicht weiter verdichten.")
+            break
+        level += 1
+    logging.info(f"Map-Reduce '{title}': finale Synthese aus {len(summaries)} Zusammenfassungen.")
+    return invoke_langchain_llm(request_system_prompt(request), reduce_prompt)
+
+def run_llm_request(request, map_executor=None):
+    """Worker for one prepared request: a single call, or map-reduce if the request was chunked."""
+    if request.get("chunks"):
+        return synthesize_map_reduce(request, map_executor)
+    return invoke_langchain_llm(request_system_prompt(request), request['user_prompt'])
+
+def stream_llm_request(request, output_path):
+    """Worker for streaming mode: writes the answer to the partial file of output_path while it arrives."""
+    partial_path = partial_output_path(output_path)
+    try:
+        # The output directory already exists (OutputSink.ensure_dir in the dispatcher)
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            return invoke_langchain_llm(request_system_prompt(request), request['user_prompt'], stream_to=f)
+    except OSError as e:
+        logging.error(f"E/A-Fehler beim Schreiben von '{partial_path}': {e}")
+        return f"[FEHLER beim Streamen: {type(e).__name__}]"
+
+def pack_llm_batches(llm_requests):
+    """
+    Groups the requests into calls: small requests sharing a system prompt are
+    packed together up to LLM_BATCH_MAX_TOKENS / LLM_BATCH_MAX_THREADS, all
+    others stay alone. Returns lists of positions into llm_requests.
+    """
+    if not LLM_BATCH_MAX_TOKENS:
+        return [[position] for position in range(len(llm_requests))]
+    item_limit = LLM_BATCH_MAX_TOKENS // 4 # Only threads well below the budget count as small
+    groups, open_batches = [], {} # system prompt -> (positions, tokens)
+    for position, request in enumerate(llm_requests):
+        tokens = estimate_tokens(request['user_prompt'])
+        if request.get("chunks") or tokens > item_limit:
+            groups.append([position])
+            continue
+        key = request.get('system_prompt_id')
+        positions, batch_tokens = open_batches.get(key, ([], 0))
+        if positions and (batch_tokens + tokens > LLM_BATCH_MAX_TOKENS or len(positions) >= LLM_BATCH_MAX_THREADS):
+            groups.append(positions)
+            positions, batch_tokens = [], 0
+        positions.append(position)
+        open_batches[key] = (positions, batch_tokens + tokens)
+    groups.extend(positions for positions, _ in open_batches.values() if positions)
+    return groups
+
+def build_batch_prompt(requests):
+    """One user prompt with a delimited section per thread."""
+    sections = [BATCH_MARKER.format(number=number) + "\n" + request['user_prompt']
+                for number, request in enumerate(requests, start=1)]
+    return (f"Die folgenden {len(requests)} Themen sind voneinander unabhängig. Bearbeite jedes Thema für sich "
+            "genau nach den Anweisungen, als wäre es die einzige Anfrage. Beginne die Antwort zu jedem Thema mit "
+            "seiner Markierungszeile (z. B. " + BATCH_MARKER.format(number=1) + ") und schreibe sonst nichts außerhalb der Antworten.\n\n"
+            + "\n\n".join(sections))
+
+_BATCH_MARKER_RE = re.compile(r"^\s*<<<THEMA (\d+)>>>\s*$", re.MULTILINE)
+
+def parse_batch_response(text, count):
+    """Splits a batched answer at the marker lines; returns {number: text} for the usable sections."""
+    sections = {}
+    matches = list(_BATCH_MARKER_RE.finditer(text or ""))
+    for match, following in zip(matches, matches[1:] + [None]):
+        number = int(match.group(1))
+        body = text[match.end():following.start() if following else len(text)].strip()
+        if 1 <= number <= count and body:
+            if number in sections: # Duplicate marker: unclear which one is right
+                sections[number] = None
+            else:
+                sections[number] = body
+    return {number: body for number, body in sections.items() if body}
+
+def run_llm_batch(requests, map_executor=None):
+    """
+    Worker for packed small requests: one call for all of them, split back per
+    thread. Threads whose section is missing are sent individually; a retryable
+    error is returned for every thread so the dispatcher re-queues them.
+    Returns the outputs in the order of requests.
+    """
+    if len(requests) == 1:
+        return [run_llm_request(requests[0], map_executor)]
+    answer = invoke_langchain_llm(request_system_prompt(requests[0]), build_batch_prompt(requests))
+    if _is_retryable_llm_error(answer):
+        # Backends busy or unreachable: the dispatcher re-queues every thread of the batch
+        logging.warning(f"Sammelanfrage mit {len(requests)} Themen vorübergehend fehlgeschlagen, wird wiederholt.")
+        return [answer] * len(requests)
+    sections = {} if _is_llm_error(answer) else parse_batch_response(answer, len(requests))
+    missing = [number for number in range(1, len(requests) + 1) if number not in sections]
+    if missing:
+        logging.warning(f"Sammelanfrage mit {len(requests)} Themen: {len(missing)} Abschnitte fehlen oder sind unklar, "
+                        f"diese werden einzeln gesendet.")
+    else:
+        logging.info(f"Sammelanfrage mit {len(requests)} Themen erfolgreich aufgeteilt.")
+    return [sections[number] if number in sections else run_llm_request(request, map_executor)
+            for number, request in enumerate(requests, start=1)]
+
+def _save_dispatched_output(request, llm_output, output_path, sink, counts, progress, streamed=False, journal=None):
+    """
+    Checks one finished answer and queues it for the writer (or the finalizing
+    of the streamed file). Returns the write future, or None if nothing is saved.
+    """
+    req_title = request.get('title', 'Unbekannter Titel')
+    req_id = request.get('thread_id', 'Unbekannte ID')
+    print(f"\n{progress} Fertig: '{req_title}' ({req_id})")
+
+    # Check for errors or empty output from LLM
+    if _is_llm_error(llm_output):
+        counts["error"] += 1
+        # Error message already logged by invoke_langchain_llm
+        print(f"  -> FEHLER oder leere Antwort vom LLM. Nicht gespeichert. Siehe Log für Details.")
+        logging.error(f"Fehler oder leere Antwort vom LLM für '{req_title}'. Ergebnis: {llm_output}")
+        if journal is not None:
+            journal.record(request, "failed", reason=llm_output or "[FEHLER: leere Antwort]")
+        if streamed:
+            kept = discard_partial_output(output_path)
+            if kept:
+                print(f"  -> Unvollständige Ausgabe aufbewahrt in '{kept.name}'.")
+        return None
 
-    # --- Initial Configuration Check ---
+    # --- Save LLM Output (in the background, overlaps with the calls still in flight) ---
+    if streamed:
+        return sink.finalize_stream(output_path, req_title, request['category'], request['links'])
+    return sink.write_note(output_path, req_title, request['category'], llm_output, request['links'])
+
+def _record_saved_output(request, output_path, save_success, counts, manifest, journal=None):
+    """Updates the counters, manifest and journal once the writer has finished a note."""
+    if save_success:
+        counts["processed"] += 1
+        if manifest is not None:
+            manifest.record(request, output_path)
+        if journal is not None:
+            journal.record(request, "done", output=output_path.name)
+        print(f"  -> ERFOLGREICH gespeichert in '{output_path.name}'.")
+    else:
+        counts["error"] += 1
+        if journal is not None:
+            journal.record(request, "failed", reason="[FEHLER beim Speichern]")
+        # Error message already logged by the writer
+        print(f"  -> FEHLER beim Speichern der LLM-Antwort '{output_path.name}'. Siehe Log.")
+
+def dispatch_llm_requests(llm_requests, output_dir, max_workers=LLM_MAX_CONCURRENCY, manifest=None, journal=None):
+    """
+    Sends the requests to the LLM with bounded parallelism and saves each
+    answer as soon as it arrives, while the remaining calls are still running.
+    Target files are resolved against an index of output_dir (see OutputSink);
+    notes are written by a background writer.
+    Small requests are packed into shared calls (see pack_llm_batches); with
+    LLM_STREAM_OUTPUT single calls are streamed to disk (see stream_llm_request).
+    Saved outputs are recorded in the manifest, if given.
+    Requests that still fail with a retryable error are queued again (LLM_REQUEUE_MAX).
+    Every state change is appended to the run journal, if given.
+    Returns the counters (processed, skipped_exist, renamed, error, llm_jobs, llm_calls, requeued):
+    llm_jobs are the submitted worker jobs, llm_calls the model calls they made.
+    """
+    counts = {"processed": 0, "skipped_exist": 0, "renamed": 0, "error": 0, "llm_jobs": 0, "llm_calls": 0, "requeued": 0}
+    with _llm_stats_lock:
+        calls_before = LLM_CLIENT_STATS["calls"]
+    total_requests = len(llm_requests)
+    sink = OutputSink(output_dir, manifest)
+    pending = [] # (index, request, output path) still to send
+    futures = {}
+    writes = {} # Write future -> (request, output path)
+    streamed = set() # Indexes whose answer is streamed to a partial file
+
+    logging.info(f"Starte parallele LLM-Verarbeitung: {total_requests} Anfragen, max. {max_workers} gleichzeitig.")
+    # The limit covers every model call, including the map calls of map-reduce requests:
+    # those run on one shared pool while their dispatcher worker only waits
+    get_backend_pool().max_in_flight = max_workers
+    _llm_shutdown.clear() # Set by the Ctrl+C of an earlier dispatch in this process
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+    map_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-map")
+    try:
+        for i, request in enumerate(llm_requests):
+            req_title = request.get('title', 'Unbekannter Titel')
+            req_id = request.get('thread_id', 'Unbekannte ID')
+
+            # Resolve the output file against the directory index (existing notes, earlier requests)
+            output_path_check, renamed = sink.claim(request)
+            if output_path_check is None:
+                output_path_check = sink.path_for(request)
+                counts["skipped_exist"] += 1
+                if journal is not None:
+                    journal.record(request, "skipped", reason="exists", output=output_path_check.name)
+                logging.warning(f"Datei '{output_path_check}' existiert bereits für Titel '{req_title}'. Überspringe LLM-Aufruf und Speichern.")
+                print(f"[{i+1}/{total_requests}] '{req_title}' ({req_id}) -> ÜBERSPRUNGEN (Datei existiert bereits)")
+                continue
+
+            counts["renamed"] += renamed
+            logging.info(f"Reihe Request {i+1}/{total_requests} ein: '{req_title}' ({req_id})")
+            pending.append((i, request, output_path_check))
+
+        def submit(entries):
+            requests = [request for _, request, _ in entries]
+            if len(entries) == 1 and LLM_STREAM_OUTPUT and not requests[0].get("chunks"):
+                sink.ensure_dir()
+                streamed.add(entries[0][0])
+                output_path_check = entries[0][2]
+                work = lambda: [stream_llm_request(requests[0], output_path_check)]
+            else:
+                work = lambda: run_llm_batch(requests, map_executor)
+
+            def run():
+                if journal is not None: # Marked when a worker picks it up, not while waiting in the queue
+                    for request in requests:
+                        journal.record(request, "inflight")
+                start_time = time.perf_counter()
+                try:
+                    return work()
+                finally:
+                    PROFILER.record_latency("request", time.perf_counter() - start_time)
+            futures[executor.submit(run)] = entries
+            counts["llm_jobs"] += 1
+
+        for group in pack_llm_batches([request for _, request, _ in pending]):
+            entries = [pending[position] for position in group]
+            if len(entries) > 1:
+                logging.info(f"Sammelanfrage: {', '.join(str(request.get('thread_id')) for _, request, _ in entries)}")
+            submit(entries)
+
+        finished = 0
+        requeued = {} # index -> rounds
+        outstanding = set(futures)
+        while outstanding:
+            done, outstanding = wait(outstanding, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in writes:
+                    request, output_path_check = writes.pop(future)
+                    _record_saved_output(request, output_path_check, future.result(), counts, manifest, journal)
+                    continue
+                entries = futures.pop(future)
+                try:
+                    llm_outputs = future.result()
+                except Exception as e:
+                    logging.error(f"Unerwarteter Fehler im LLM-Worker für '{entries[0][1].get('title')}': {e}", exc_info=True)
+                    llm_outputs = [f"[FEHLER im Worker: {type(e).__name__}]"] * len(entries)
+
+                for (i, request, output_path_check), llm_output in zip(entries, llm_outputs):
+                    # Transient failures go to the back of the queue instead of being dropped
+                    if _is_retryable_llm_error(llm_output) and requeued.get(i, 0) < LLM_REQUEUE_MAX:
+                        requeued[i] = requeued.get(i, 0) + 1
+                        counts["requeued"] += 1
+                        if journal is not None:
+                            journal.record(request, "requeued", reason=llm_output)
+                        logging.warning(f"'{request.get('title')}' erneut eingereiht (Runde {requeued[i]}/{LLM_REQUEUE_MAX}): {llm_output}")
+                        print(f"  -> '{request.get('title')}' vorübergehend fehlgeschlagen, erneut eingereiht.")
+                        submit([(i, request, output_path_check)])
+                        continue
+                    finished += 1
+                    write = _save_dispatched_output(request, llm_output, output_path_check, sink, counts,
+                                                    f"[{finished}/{len(pending)}]", streamed=i in streamed, journal=journal)
+                    if write is not None:
+                        writes[write] = (request, output_path_check)
+            outstanding |= (set(futures) | set(writes)) - outstanding
+
+    except KeyboardInterrupt:
+        # Drop everything that has not started yet and stop retries, backoff and rate-limit
+        # waits of the running workers (only calls already on the wire are waited for),
+        # then let the caller handle the interrupt
+        _llm_shutdown.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        map_executor.shutdown(wait=False, cancel_futures=True)
+        # Finished answers still queued for finalize_stream keep their partial file
+        queued = {output_path_check for _, output_path_check in writes.values()}
+        for i, request, output_path_check in pending:
+            if i in streamed and output_path_check not in queued:
+                discard_partial_output(output_path_check)
+        raise
+    finally:
+        # Finish the queued writes and keep what was saved so far, also after an interrupt
+        sink.close()
+        for write, (request, output_path_check) in writes.items():
+            _record_saved_output(request, output_path_check, write.result(), counts, manifest, journal)
+        if manifest is not None and not manifest.save():
+            logging.warning(f"Manifest '{manifest.filename}' konnte nicht gespeichert werden.")
+    executor.shutdown(wait=True)
+    map_executor.shutdown(wait=True)
+    with _llm_stats_lock:
+        counts["llm_calls"] = LLM_CLIENT_STATS["calls"] - calls_before
+    if journal is not None:
+        journal.event("finished", counts=counts, finished_at=datetime.now().isoformat(timespec='seconds'))
+    return counts
+
+
+# --- Kommandozeile & Batch-Modus ---
+@dataclass
+class RunOptions:
+    """Decisions that would otherwise be asked interactively (None = ask)."""
+    batch: bool = False
+    intermediate: Optional[str] = None # 'use' or 'replace'
+    filter_spec: Optional[FilterSpec] = None
+    send: Optional[bool] = None
+    stream: bool = False
+    stream_output: bool = False
+    use_db: bool = False
+    dry_run: bool = False
+    plan_file: str = PLAN_FILE
+    concurrency: int = 1
+    workers: int = 1 # Processes for filtering and prompt preparation of a loaded export
+    incremental: bool = True # Skip threads the manifest reports as unchanged
+    summary_file: str = RUN_SUMMARY_FILE
+    resume: bool = False # Continue the run recorded in the journal
+    trace_memory: bool = False # tracemalloc peak per stage in the profile report
+    cprofile_file: Optional[str] = None # cProfile statistics of the main thread
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Synthetisiert Allmystery-Beiträge pro Thema mit einem LLM zu Markdown-Notizen. "
+                    "Ohne Optionen läuft das Skript interaktiv.")
+    parser.add_argument("--batch", action="store_true", default=None,
+                        help="Nicht-interaktiv: keine Rückfragen, fehlende Angaben werden mit Standardwerten belegt.")
+    parser.add_argument("--profile", metavar="DATEI",
+                        help="Laufprofil (JSON oder TOML) mit denselben Einstellungen wie die Optionen.")
+    parser.add_argument("--intermediate", choices=("use", "replace"),
+                        help=f"Vorhandene Zwischendatei '{INTERMEDIATE_STORE_FILE}' verwenden oder ersetzen (Batch-Standard: replace).")
+    parser.add_argument("--filter-spec", metavar="DATEI",
+                        help=f"Filterspezifikation aus JSON-Datei laden (Format wie '{FILTER_SPEC_FILE}').")
+    parser.add_argument("--start-date", metavar="DD.MM.YYYY", help="Startdatum (einschließlich).")
+    parser.add_argument("--end-date", metavar="DD.MM.YYYY", help="Enddatum (einschließlich).")
+    parser.add_argument("--split", metavar="AUSWAHL", help="Kategorien/IDs für Zeitlücken-Split, kommasepariert, oder '*alle*'.")
+    parser.add_argument("--split-gap", type=int, metavar="TAGE", help="Max. Tage Lücke für Split.")
+    parser.add_argument("--min-article-length", type=int, metavar="N", help="Min. Artikel-Gesamtlänge pro Thema.")
+    parser.add_argument("--min-quote-length", type=int, metavar="N", help="Min. Länge einzelner Mitgliedszitate.")
+    send_group = parser.add_mutually_exclusive_group()
+    send_group.add_argument("--send", dest="send", action="store_true", default=None, help="Anfragen ohne Rückfrage an das LLM senden.")
+    send_group.add_argument("--no-send", dest="send", action="store_false", help="Nur filtern und vorbereiten, nichts senden.")
+    parser.add_argument("--stream", action="store_true", default=None, help="Streaming-Einlesen (wie STREAM_INGEST=1).")
+    parser.add_argument("--stream-output", action="store_true", default=None,
+                        help="LLM-Antworten gestreamt auf die Platte schreiben (wie LLM_STREAM_OUTPUT=1).")
+    parser.add_argument("--db", action="store_true", default=None,
+                        help=f"Export in die SQLite-Themendatenbank '{THREAD_DB_FILE}' übernehmen und dort filtern (wie THREAD_DB=1).")
+    parser.add_argument("--dry-run", action="store_true", default=None,
+                        help="Nur planen: Tokens, Kosten und Dauer schätzen und als JSON speichern, nichts senden.")
+    parser.add_argument("--plan", metavar="DATEI", help=f"Pfad des JSON-Plans bei --dry-run (Standard: '{PLAN_FILE}').")
+    parser.add_argument("--concurrency", type=int, metavar="N", help="Max. gleichzeitige LLM-Anfragen (wie LLM_MAX_CONCURRENCY).")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Prozesse für Filterung und Vorbereitung (wie FILTER_WORKERS; 0 = einer pro Kern, 1 = keine).")
+    parser.add_argument("--ignore-manifest", action="store_true", default=None,
+                        help=f"Alle Themen senden, auch wenn sie laut '{MANIFEST_FILE}' unverändert sind.")
+    parser.add_argument("--summary", metavar="DATEI", help=f"Pfad der JSON-Laufzusammenfassung (Standard: '{RUN_SUMMARY_FILE}').")
+    parser.add_argument("--resume", action="store_true", default=None,
+                        help=f"Unterbrochenen Lauf aus '{RUN_JOURNAL_FILE}' fortsetzen, ohne neu zu filtern oder vorzubereiten.")
+    parser.add_argument("--trace-memory", action="store_true", default=None,
+                        help=f"Speicherspitze pro Phase im Laufzeitprofil '{PROFILE_REPORT_FILE}' messen (wie PROFILE_MEMORY=1, langsamer).")
+    parser.add_argument("--cprofile", metavar="DATEI",
+                        help="Hauptthread mit cProfile messen und die Statistik in DATEI speichern (auswertbar mit pstats/snakeviz).")
+    return parser
+
+def load_run_profile(filename):
+    """Reads a run profile from JSON or TOML; raises ValueError on problems."""
+    filepath = Path(filename)
+    if not filepath.exists():
+        raise ValueError(f"Profil '{filename}' nicht gefunden")
+    if filepath.suffix.lower() == '.toml':
+        try:
+            import tomllib # Python 3.11+
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("TOML-Profile benötigen Python 3.11+ oder das Paket 'tomli'")
+        with open(filepath, 'rb') as f:
+            return tomllib.load(f)
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def resolve_run_options(args):
+    """Merges profile and command line flags (flags win); raises ValueError on invalid values."""
+    profile = load_run_profile(args.profile) if args.profile else {}
+    if not isinstance(profile, dict):
+        raise ValueError("Profil muss ein Objekt/Tabelle sein")
+
+    def pick(arg_value, key, default=None):
+        return arg_value if arg_value is not None else profile.get(key, default)
+
+    spec_values = {}
+    spec_file = pick(args.filter_spec, "filter_spec")
+    if spec_file:
+        loaded = load_data(spec_file)
+        if not isinstance(loaded, dict):
+            raise ValueError(f"Filterspezifikation '{spec_file}' konnte nicht gelesen werden")
+        spec_values.update(loaded)
+    spec_values.update(profile.get("filter") or {})
+    for key, value in (("start_date", args.start_date), ("end_date", args.end_date), ("split_targets", args.split),
+                       ("split_gap_days", args.split_gap), ("min_article_length", args.min_article_length),
+                       ("min_memberquote_length", args.min_quote_length)):
+        if value is not None:
+            spec_values[key] = value
+
+    intermediate = pick(args.intermediate, "intermediate")
+    if intermediate not in (None, "use", "replace"):
+        raise ValueError(f"Ungültiger Wert für 'intermediate': {intermediate}")
+    send = pick(args.send, "send")
+    workers = int(pick(args.workers, "workers", FILTER_WORKERS))
+    if workers < 0:
+        raise ValueError(f"Ungültiger Wert für 'workers': {workers}")
+    return RunOptions(
+        batch=bool(pick(args.batch, "batch", False)),
+        intermediate=intermediate,
+        filter_spec=FilterSpec.from_dict(spec_values) if spec_values else None,
+        send=None if send is None else bool(send),
+        stream=bool(pick(args.stream, "stream", STREAM_INGEST)),
+        stream_output=bool(pick(args.stream_output, "stream_output", LLM_STREAM_OUTPUT)),
+        use_db=bool(pick(args.db, "db", THREAD_DB_ENABLED)),
+        dry_run=bool(pick(args.dry_run, "dry_run", False)),
+        plan_file=pick(args.plan, "plan", PLAN_FILE),
+        concurrency=max(1, int(pick(args.concurrency, "concurrency", LLM_MAX_CONCURRENCY))),
+        workers=resolve_worker_count(workers),
+        incremental=not args.ignore_manifest and bool(profile.get("incremental", True)),
+        summary_file=pick(args.summary, "summary", RUN_SUMMARY_FILE),
+        resume=bool(pick(args.resume, "resume", False)),
+        trace_memory=bool(pick(args.trace_memory, "trace_memory", PROFILE_MEMORY)),
+        cprofile_file=pick(args.cprofile, "cprofile"),
+    )
+
+def write_run_summary(summary, filename):
+    """Writes the machine-readable summary of this run as JSON."""
+    summary["finished_at"] = datetime.now().isoformat(timespec='seconds')
+    summary["duration_seconds"] = round(time.time() - summary.pop("_start_time", time.time()), 2)
+    if save_data(summary, filename):
+        logging.info(f"Laufzusammenfassung in '{filename}' geschrieben (Status: {summary['status']}).")
+
+def _finish(summary, status, exit_code):
+    summary["status"] = status
+    summary["exit_code"] = exit_code
+    return exit_code
+
+def check_backends():
+    """Prints the backend pool and health-checks every backend; returns True if at least one is usable."""
+    try:
+        pool = get_backend_pool()
+    except (ValueError, TypeError) as e:
+        print(f"FEHLER: Backend-Datei '{BACKENDS_FILE}' ist ungültig: {e}")
+        logging.error(f"Backend-Datei '{BACKENDS_FILE}' ist ungültig: {e}")
+        return False
+    print(f"Backend-Pool ({BACKENDS_FILE}):")
+    usable = 0
+    for backend in pool.backends:
+        target = backend.base_url or "API Key " + ("vorhanden" if backend.api_key else "fehlt")
+        role = ", Überlauf" if backend.overflow else ""
+        if backend.health_check():
+            usable += 1
+            status = "OK"
+        else:
+            # Keep the backend out of rotation until a probe after the cooldown succeeds
+            backend.breaker.trip(LLMCallError("unavailable", "Health-Check fehlgeschlagen", True))
+            status = "NICHT ERREICHBAR"
+        print(f"  {backend.name:<14} {backend.provider}/{backend.model} ({target}, max. {backend.concurrency} parallel{role}): {status}")
+    if not usable:
+        print("FEHLER: Kein Backend des Pools ist erreichbar.")
+    print("---------------------------------")
+    return usable > 0
+
+def check_llm_configuration():
+    """Prints the provider configuration and checks it; returns True if usable."""
     print("\n--- LLM Konfigurationsprüfung ---")
+    if Path(BACKENDS_FILE).exists():
+        return check_backends()
     print(f"Provider (.env): {LLM_PROVIDER}")
     if not MODEL_NAME:
         print("FEHLER: 'MODEL_NAME' fehlt in der .env Datei!")
         logging.error("FEHLER: Umgebungsvariable 'MODEL_NAME' fehlt!")
-        return
+        return False
     print(f"Modell (.env):   {MODEL_NAME}")
 
-    config_ok = False
-    if LLM_PROVIDER == "gemini":
-        if not GEMINI_API_KEY:
-            print("FEHLER: Provider ist 'gemini', aber 'GEMINI_API_KEY' fehlt in .env!")
-            # Error already logged during import check
-        elif not GEMINI_AVAILABLE:
-             print("FEHLER: Provider ist 'gemini', aber benötigte Pakete fehlen (langchain-google-genai?). Siehe Log.")
-        else:
-            print("API Key:      Vorhanden (Gemini)")
-            print("Pakete:       OK (Gemini)")
-            config_ok = True
-    elif LLM_PROVIDER == "ollama":
-        if not OLLAMA_AVAILABLE:
-             print("FEHLER: Provider ist 'ollama', aber benötigtes Paket 'langchain-ollama' fehlt oder konnte nicht importiert werden.")
-             print("        -> Bitte installieren: pip install langchain-ollama")
-             # Error already logged during import check
-        else:
-            print(f"Basis URL:    {OLLAMA_BASE_URL} (Ollama)")
-            print("Pakete:       OK (Ollama)")
-            # Zusätzlich prüfen, ob Ollama Server läuft (optional, einfacher Test)
-            try:
-                 import requests
-                 response = requests.get(OLLAMA_BASE_URL, timeout=2)
-                 if response.status_code == 200:
-                      print("Server Status: Erreichbar")
-                      config_ok = True
-                 else:
-                      print(f"Server Status: Nicht erreichbar (Status: {response.status_code})")
-                      logging.warning(f"Ollama Server unter {OLLAMA_BASE_URL} antwortet nicht wie erwartet (Status: {response.status_code}).")
+    plugin = get_provider(LLM_PROVIDER)
+    if plugin is None:
+        print(f"FEHLER: Unbekannter LLM_PROVIDER '{LLM_PROVIDER}' in .env konfiguriert!")
+        print(f"        Verfügbar: {', '.join(sorted(_providers))}")
+        config_ok = False
+    else:
+        config_ok = plugin.check_configuration()
 
-            except ImportError:
-                 print("Server Status: 'requests' Paket nicht installiert, kann Status nicht prüfen.")
-                 config_ok = True # Assume ok if requests isn't available for check
-            except requests.exceptions.ConnectionError:
-                 print(f"Server Status: Nicht erreichbar (Verbindungsfehler zu {OLLAMA_BASE_URL})")
-                 logging.warning(f"Ollama Server unter {OLLAMA_BASE_URL} nicht erreichbar.")
-            except requests.exceptions.Timeout:
-                 print(f"Server Status: Zeitüberschreitung bei Verbindung zu {OLLAMA_BASE_URL}")
-                 logging.warning(f"Zeitüberschreitung bei Verbindung zu Ollama Server {OLLAMA_BASE_URL}.")
-            except Exception as e:
-                 print(f"Server Status: Fehler beim Prüfen ({type(e).__name__})")
-                 logging.warning(f"Fehler beim Prüfen des Ollama Servers: {e}")
+    print("---------------------------------")
+    return config_ok
 
 
-    else:
-        print(f"FEHLER: Unbekannter LLM_PROVIDER '{LLM_PROVIDER}' in .env konfiguriert!")
-        # Error already logged during import check
+# --- Hauptfunktion (main) ---
+def run_llm_stage(llm_requests, output_dir, options, manifest, journal, summary):
+    """Sends the requests, prints the statistics and returns the exit code."""
+    # --- LLM Processing Stage ---
+    print("\n--- Starte LLM-Verarbeitung ---")
+    logging.info(f"Ausgaben werden in das Verzeichnis '{output_dir}' gespeichert.")
+    summary["output_dir"] = str(output_dir)
+
+    # With a backend pool the per-backend limits decide how many calls run at once
+    concurrency = effective_concurrency(options.concurrency)
+    try:
+        with PROFILER.stage("llm"):
+            counts = dispatch_llm_requests(llm_requests, output_dir, concurrency, manifest, journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    summary.update(counts)
+
+    # --- Processing Finished ---
+    print("\n--- LLM-Verarbeitung abgeschlossen ---")
+    print(f"Erfolgreich verarbeitet & gespeichert: {counts['processed']}")
+    print(f"Übersprungen (Datei existierte):     {counts['skipped_exist']}")
+    if counts['renamed']:
+        print(f"Mit Themen-ID gespeichert (Titel doppelt): {counts['renamed']}")
+    print(f"Fehler (LLM oder Speichern):         {counts['error']}")
+    print(f"LLM-Aufträge (inkl. Sammelanfragen): {counts['llm_jobs']}")
+    print(f"LLM-Aufrufe (inkl. Wiederholungen):  {counts['llm_calls']}")
+    if counts['requeued']:
+        print(f"Erneut eingereiht:                   {counts['requeued']}")
+    log_llm_client_stats()
+    save_llm_history()
+    release_gemini_prompt_caches()
+    close_llm_cache()
+    print("--------------------------------------")
+    if counts['error']:
+        return _finish(summary, "completed_with_errors", EXIT_LLM_ERRORS)
+    return _finish(summary, "completed", EXIT_OK) # Exit script successfully after processing
+
+def resume_run(options, summary):
+    """Continues the run recorded in the journal: only unfinished requests are sent."""
+    journal = RunJournal()
+    if not Path(journal.filename).exists():
+        print(f"Kein Laufjournal '{journal.filename}' gefunden, nichts fortzusetzen.")
+        return _finish(summary, "data_error", EXIT_DATA_ERROR)
+    try:
+        with PROFILER.stage("load"):
+            header, llm_requests, state_counts = journal.load()
+    except (OSError, ValueError) as e:
+        logging.error(f"Laufjournal '{journal.filename}' konnte nicht gelesen werden: {e}")
+        print(f"Laufjournal '{journal.filename}' konnte nicht gelesen werden. Skript wird beendet.")
+        return _finish(summary, "data_error", EXIT_DATA_ERROR)
+
+    output_dir = Path(header.get("output_dir") or Path(__file__).parent.parent)
+    summary.update({"resumed": True, "data_source": header.get("data_source"), "filter_spec": header.get("filter_spec"),
+                    "requests": len(llm_requests), "journal_states": state_counts})
+    print(f"\n--- Fortsetzen: Lauf vom {header.get('started_at')} ({header.get('provider')}, {header.get('model')}) ---")
+    print(f"Filtereinstellungen: {json.dumps(header.get('filter_spec'), ensure_ascii=False)}")
+    print(f"Stand laut Journal: {', '.join(f'{state} {count}' for state, count in sorted(state_counts.items()))}")
+    if (header.get("provider"), header.get("model")) != (LLM_PROVIDER, MODEL_NAME):
+        print(f"WARNUNG: Der Lauf wurde mit {header.get('provider')} ({header.get('model')}) begonnen, "
+              f"fortgesetzt wird mit {LLM_PROVIDER} ({MODEL_NAME}).")
+    if not llm_requests:
+        print("Alle Anfragen des Laufs sind abgeschlossen, nichts fortzusetzen.")
+        return _finish(summary, "nothing_to_do", EXIT_OK)
+    print(f"{len(llm_requests)} unvollständige Anfragen werden erneut gesendet.")
+
+    with PROFILER.stage("plan"):
+        plan = build_llm_plan(llm_requests, effective_concurrency(options.concurrency))
+    print_llm_plan(plan)
+    summary["plan"] = {key: value for key, value in plan.items() if key != "items"}
+    if options.dry_run:
+        if not save_data(plan, options.plan_file):
+            return _finish(summary, "failed", EXIT_FAILURE)
+        print(f"Plan gespeichert in '{options.plan_file}' (--dry-run, nichts gesendet).")
+        return _finish(summary, "planned", EXIT_OK)
+    if options.send is False:
+        print("Senden deaktiviert (--no-send).")
+        return _finish(summary, "prepared", EXIT_OK)
+    if options.batch and options.send is None:
+        print("Senden nicht vorgegeben (--batch ohne --send), Lauf bleibt vorbereitet.")
+        return _finish(summary, "prepared", EXIT_OK)
 
-    print("---------------------------------")
-    if not config_ok:
-         print("Konfiguration unvollständig oder fehlerhaft. Skript wird beendet.")
-         return
+    try:
+        journal.reopen()
+    except OSError as e:
+        logging.warning(f"Laufjournal '{journal.filename}' kann nicht fortgeschrieben werden: {e}")
+        journal = None
+    # Answers streamed before the abort are incomplete; the requests start over
+    removed = discard_stale_partials(llm_requests, output_dir)
+    if removed:
+        logging.info(f"{removed} Teildateien des abgebrochenen Laufs gelöscht.")
+        print(f"{removed} unvollständige Teildateien (.partial) des abgebrochenen Laufs gelöscht.")
+    manifest = RunManifest() if options.incremental else None
+    return run_llm_stage(llm_requests, output_dir, options, manifest, journal, summary)
+
+def run_pipeline(options, summary):
+    """Steuert den Ablauf; gibt den Exit-Code zurück und füllt summary."""
+    global STREAM_INGEST, THREAD_DB_ENABLED, LLM_STREAM_OUTPUT
+    STREAM_INGEST = options.stream
+    LLM_STREAM_OUTPUT = options.stream_output
+    THREAD_DB_ENABLED = options.use_db
 
+    # --- Initial Configuration Check ---
+    if not check_llm_configuration():
+         if not options.dry_run:
+             print("Konfiguration unvollständig oder fehlerhaft. Skript wird beendet.")
+             return _finish(summary, "config_error", EXIT_CONFIG_ERROR)
+         print("Konfiguration unvollständig, für die Planung (--dry-run) wird trotzdem fortgefahren.")
+
+    if options.resume:
+        return resume_run(options, summary)
+
+    script_dir = Path(__file__).parent
+    output_dir = script_dir.parent # Output in the parent directory (e.g., Zettelkasten/)
 
     # --- Intermediate File Handling ---
     skip_filtering = False
     data_source_file = INPUT_JSON_FILE # Default source
-    intermediate_file_path = Path(INTERMEDIATE_JSON_FILE)
+    # Prefer the thread store; a JSON file from older runs is still accepted
+    intermediate_file = next((name for name in (INTERMEDIATE_STORE_FILE, INTERMEDIATE_JSON_FILE) if Path(name).exists()), None)
 
-    if intermediate_file_path.exists():
-        print(f"\nZwischendatei '{INTERMEDIATE_JSON_FILE}' gefunden.")
+    if intermediate_file:
+        print(f"\nZwischendatei '{intermediate_file}' gefunden.")
         while True:
-            # Updated choices for clarity
-            choice = input("Aktion? [(v)erwenden, (e)rsetzen & neu filtern, (b)eenden]: ").lower()
+            if options.intermediate is not None or options.batch:
+                choice = 'v' if options.intermediate == 'use' else 'e'
+                print(f"Aktion (vorgegeben): {'verwenden' if choice == 'v' else 'ersetzen & neu filtern'}")
+            else:
+                # Updated choices for clarity
+                choice = read_input("Aktion? [(v)erwenden, (e)rsetzen & neu filtern, (b)eenden]: ").lower()
             if choice == 'v':
-                data_source_file = INTERMEDIATE_JSON_FILE
+                data_source_file = intermediate_file
                 skip_filtering = True
-                logging.info(f"Verwende vorhandene Zwischendatei: {INTERMEDIATE_JSON_FILE}")
+                logging.info(f"Verwende vorhandene Zwischendatei: {intermediate_file}")
                 break
             elif choice == 'e':
                 data_source_file = INPUT_JSON_FILE
                 skip_filtering = False
                 logging.info(f"Ersetze Zwischendatei. Lade Originaldaten: {INPUT_JSON_FILE}")
-                try: # Attempt to delete the old intermediate file
-                     intermediate_file_path.unlink()
-                     logging.info(f"Alte Zwischendatei '{INTERMEDIATE_JSON_FILE}' gelöscht.")
-                except OSError as e:
-                     logging.warning(f"Konnte alte Zwischendatei '{INTERMEDIATE_JSON_FILE}' nicht löschen: {e}")
+                for old_file in (INTERMEDIATE_STORE_FILE, INTERMEDIATE_JSON_FILE):
+                    if not Path(old_file).exists(): continue
+                    try: # Attempt to delete the old intermediate file
+                         Path(old_file).unlink()
+                         logging.info(f"Alte Zwischendatei '{old_file}' gelöscht.")
+                    except OSError as e:
+                         logging.warning(f"Konnte alte Zwischendatei '{old_file}' nicht löschen: {e}")
                 break
             elif choice == 'b':
                 print("Skript beendet.")
                 logging.info("Benutzer hat Skript über Zwischendatei-Auswahl beendet.")
-                return
+                return _finish(summary, "aborted", EXIT_ABORTED)
             else:
                 print("Ungültige Wahl. Bitte 'v', 'e' oder 'b' eingeben.")
     else:
-        logging.info(f"Keine Zwischendatei '{INTERMEDIATE_JSON_FILE}' gefunden. Lade Originaldaten: {INPUT_JSON_FILE}")
+        logging.info(f"Keine Zwischendatei '{INTERMEDIATE_STORE_FILE}' gefunden. Lade Originaldaten: {INPUT_JSON_FILE}")
         data_source_file = INPUT_JSON_FILE
         skip_filtering = False
 
     # --- Load Initial Data ---
-    initial_data = load_data(data_source_file)
+    summary["data_source"] = data_source_file
+    with PROFILER.stage("load"): # Streamed sources are only opened here and read while preparing
+        initial_data = load_source_data(data_source_file)
     if initial_data is None:
         print(f"Konnte Daten aus '{data_source_file}' nicht laden. Skript wird beendet.")
-        return # Exit if loading failed
+        return _finish(summary, "data_error", EXIT_DATA_ERROR) # Exit if loading failed
+
+    preset_spec = options.filter_spec # Used for the first pass only; 'n' asks again
 
     # --- Main Processing Loop (allows restarting filtering) ---
     while True:
-        processed_data = copy.deepcopy(initial_data) # Work on a copy
+        # Streamed sources (file stream, thread store, thread database) are read anew on every pass
+        streaming = not isinstance(initial_data, dict)
+        if streaming:
+            processed_data = None
+            thread_items = iter(initial_data) # Re-reads the file on every pass
+        else:
+            # The filters return views over the untouched model, no copy per pass needed
+            processed_data = initial_data
+        filter_stats = None
 
         # --- Filtering Stage ---
         if not skip_filtering:
             print("\n--- Datenfilterung ---")
-            original_thread_count = len(processed_data)
-
-            # 1. Date Range Filter (Applied First - potentially removes most posts)
-            print("Datumsbereich (leer lassen für keine Grenze):")
-            start_date = get_date_input("  Startdatum (einschließlich DD.MM.YYYY): ")
-            end_date = get_date_input("  Enddatum (einschließlich DD.MM.YYYY):   ")
-            processed_data = filter_by_date_range(processed_data, start_date, end_date)
-            logging.info(f"Nach Datumsfilter: {len(processed_data)} von {original_thread_count} Themen übrig.")
-
-            # 2. Split by Time Gap Filter
-            print("\nThemen für Zeitlückenprüfung (kommasepariert: Kategorie/IDs ODER '*alle*'):")
-            filter_list = get_comma_separated_list("  Auswahl (leer=kein Split): ")
-            days_threshold = 0
-            if filter_list:
-                days_threshold = get_int_threshold("  Max. Tage Lücke für Split (0=kein Split): ", 0)
-                if days_threshold > 0:
-                    processed_data = split_threads_by_time_gap(processed_data, filter_list, days_threshold)
-                    logging.info(f"Nach Zeitlücken-Split: {len(processed_data)} Themen vorhanden.")
+            if preset_spec is not None:
+                filter_spec, preset_spec = preset_spec, None
+                print(f"Filtereinstellungen (vorgegeben): {json.dumps(filter_spec.to_dict(), ensure_ascii=False)}")
+            elif options.batch:
+                filter_spec = FilterSpec()
+                print("Keine Filtereinstellungen vorgegeben, es wird nicht gefiltert.")
+            else:
+                filter_spec = get_filter_spec()
+            summary["filter_spec"] = filter_spec.to_dict()
+            if save_filter_spec(filter_spec):
+                logging.info(f"Filterspezifikation in '{FILTER_SPEC_FILE}' gespeichert: {filter_spec.to_dict()}")
+
+            if streaming:
+                # All filters are applied per thread while the source is read
+                if options.workers > 1:
+                    logging.info("Streaming-Quelle: Filterung und Vorbereitung laufen in einem Prozess.")
+                filter_stats = new_filter_stats()
+                if isinstance(initial_data, ThreadDatabase):
+                    filtered_items = iter_db_filtered_threads(initial_data, filter_spec, filter_stats)
                 else:
-                     logging.info("Zeitlücken-Split übersprungen (Schwellenwert=0).")
-
-            # 3. Total Article Length Filter
-            length_threshold = get_int_threshold("Min. Artikel-Gesamtlänge pro Thema (0=kein Filter): ", 0)
-            processed_data = filter_by_total_article_length(processed_data, length_threshold)
-            logging.info(f"Nach Artikellängenfilter: {len(processed_data)} Themen übrig.")
-
-            # 4. Member Quote Length Filter
-            memberquote_threshold = get_int_threshold("Min. Länge einzelner Mitgliedszitate (0=kein Filter): ", 0)
-            processed_data = filter_by_memberquote_length(processed_data, memberquote_threshold)
-            logging.info(f"Nach Zitatlängenfilter: {len(processed_data)} Themen übrig.")
-
+                    # Part IDs are checked against every input thread, not only those read so far
+                    input_ids = initial_data.keys() if filter_spec.split_active else None
+                    filtered_items = iter_filtered_threads(thread_items, filter_spec, filter_stats, input_ids)
+                thread_items = save_thread_store_stream(filtered_items, INTERMEDIATE_STORE_FILE)
+                if INTERMEDIATE_JSON_EXPORT:
+                    thread_items = save_data_stream(thread_items, INTERMEDIATE_JSON_FILE)
+            else:
+                # All stages run in a single traversal per thread
+                with PROFILER.stage("filter"):
+                    if options.workers > 1:
+                        processed_data, filter_stats = apply_filter_spec_parallel(processed_data, filter_spec, options.workers)
+                    else:
+                        processed_data, filter_stats = apply_filter_spec(processed_data, filter_spec)
+                logging.info("Filterung abgeschlossen.")
 
+                # --- Save Intermediate Results ---
+                with PROFILER.stage("save_intermediate"):
+                    if save_thread_store(processed_data.items(), INTERMEDIATE_STORE_FILE):
+                        logging.info(f"Gefilterte Daten erfolgreich in '{INTERMEDIATE_STORE_FILE}' gespeichert.")
+                    else:
+                         # Warn if saving fails, but continue processing
+                         logging.warning(f"Konnte gefilterte Daten nicht in '{INTERMEDIATE_STORE_FILE}' speichern. Verarbeitung geht weiter.")
+                    if INTERMEDIATE_JSON_EXPORT:
+                        save_data(materialize_threads(processed_data), INTERMEDIATE_JSON_FILE) # Readable copy
             print("----------------------")
-            logging.info("Filterung abgeschlossen.")
-
-            # --- Save Intermediate Results ---
-            if save_data(processed_data, INTERMEDIATE_JSON_FILE):
-                logging.info(f"Gefilterte Daten erfolgreich in '{INTERMEDIATE_JSON_FILE}' gespeichert.")
-            else:
-                 # Warn if saving fails, but continue processing
-                 logging.warning(f"Konnte gefilterte Daten nicht in '{INTERMEDIATE_JSON_FILE}' speichern. Verarbeitung geht weiter.")
 
         else: # skip_filtering == True
-            print(f"\nFilterung übersprungen, '{INTERMEDIATE_JSON_FILE}' wird verwendet.")
-            logging.info(f"Filterung übersprungen, verwende Daten aus {INTERMEDIATE_JSON_FILE}.")
+            print(f"\nFilterung übersprungen, '{data_source_file}' wird verwendet.")
+            logging.info(f"Filterung übersprungen, verwende Daten aus {data_source_file}.")
+
+        # --- Load System Prompt & Prepare Requests ---
+        system_prompt = load_system_prompt()
+        if streaming:
+            thread_counter = {"count": 0}
+            def counted(items):
+                for item in items:
+                    thread_counter["count"] += 1
+                    yield item
+            try:
+                # Streaming: reading, filtering and writing the thread store happen in this stage
+                with PROFILER.stage("prepare"):
+                    llm_requests = prepare_llm_requests(counted(thread_items), system_prompt)
+            except (OSError, ValueError, sqlite3.Error) as e: # json.JSONDecodeError is a ValueError
+                logging.error(f"Fehler beim Streaming von '{data_source_file}': {e}")
+                print(f"Konnte Daten aus '{data_source_file}' nicht lesen. Skript wird beendet.")
+                return _finish(summary, "data_error", EXIT_DATA_ERROR)
+            final_thread_count = thread_counter["count"]
+        else:
+            final_thread_count = len(processed_data)
+            with PROFILER.stage("prepare"):
+                if not final_thread_count:
+                    llm_requests = []
+                elif options.workers > 1:
+                    llm_requests = prepare_llm_requests_parallel(processed_data, system_prompt, options.workers)
+                else:
+                    llm_requests = prepare_llm_requests(processed_data, system_prompt)
+        summary["filter_stats"] = filter_stats
+        summary["threads"] = final_thread_count
+        summary["requests"] = len(llm_requests)
+
+        # --- Incremental run: only new or changed threads are sent ---
+        manifest = None
+        prepared_count = len(llm_requests)
+        if options.incremental and llm_requests:
+            with PROFILER.stage("manifest"):
+                manifest = RunManifest()
+                llm_requests, manifest_counts = plan_incremental_run(llm_requests, manifest, output_dir)
+            summary["manifest"] = manifest_counts
 
         # --- Prepare for LLM ---
-        final_thread_count = len(processed_data)
         print(f"\n--- Zusammenfassung nach Filterung ---")
         print(f"Themen zur LLM-Verarbeitung: {final_thread_count}")
-
-        if final_thread_count == 0:
-            print("Keine Themen nach Filterung übrig.")
+        if manifest is not None:
+            print(f"Seit letztem Lauf: {manifest_counts['new']} neu, {manifest_counts['changed']} geändert, {manifest_counts['unchanged']} unverändert (übersprungen)")
+
+        if final_thread_count == 0 or not llm_requests:
+            if final_thread_count == 0:
+                print("Keine Themen nach Filterung übrig.")
+            elif prepared_count:
+                print(f"Alle Themen unverändert seit dem letzten Lauf (siehe '{MANIFEST_FILE}').")
+            else:
+                print("Keine LLM-Anfragen vorbereitet (möglicherweise nur leere Themen oder Fehler bei Vorbereitung).")
+            if options.batch:
+                return _finish(summary, "nothing_to_do", EXIT_OK)
             while True:
-                action_empty = input("Aktion? [(n)eu filtern, (b)eenden]: ").lower()
+                action_empty = read_input("Aktion? [(n)eu filtern, (b)eenden]: ").lower()
                 if action_empty == 'n':
                     # Reset state to re-filter from original file
                     skip_filtering = False
                     data_source_file = INPUT_JSON_FILE
-                    initial_data = load_data(data_source_file)
-                    if initial_data is None: return # Exit if reload fails
+                    summary["data_source"] = data_source_file
+                    initial_data = load_source_data(data_source_file)
+                    if initial_data is None: return _finish(summary, "data_error", EXIT_DATA_ERROR) # Exit if reload fails
                     break # Break inner loop, outer loop will restart filtering
                 elif action_empty == 'b':
                     print("Skript beendet.")
-                    return
-                else: print("Ungültige Wahl.")
-            if action_empty == 'n': continue # Restart outer loop for filtering
-
-        # --- Load System Prompt & Prepare Requests ---
-        system_prompt = load_system_prompt()
-        llm_requests = prepare_llm_requests(processed_data, system_prompt)
-
-        if not llm_requests:
-            print("Keine LLM-Anfragen vorbereitet (möglicherweise nur leere Themen oder Fehler bei Vorbereitung).")
-            while True:
-                action_empty_req = input("Aktion? [(n)eu filtern, (b)eenden]: ").lower()
-                if action_empty_req == 'n':
-                    skip_filtering = False; data_source_file = INPUT_JSON_FILE
-                    initial_data = load_data(data_source_file)
-                    if initial_data is None: return
-                    break # Break inner loop, outer loop will restart
-                elif action_empty_req == 'b':
-                    print("Skript beendet."); return
+                    return _finish(summary, "nothing_to_do", EXIT_OK)
                 else: print("Ungültige Wahl.")
-            if action_empty_req == 'n': continue # Restart outer loop
+            continue # Restart outer loop for filtering
 
         print(f"{len(llm_requests)} LLM-Anfragen bereit zum Senden.")
 
+        # --- Pre-flight plan ---
+        with PROFILER.stage("plan"):
+            plan = build_llm_plan(llm_requests, effective_concurrency(options.concurrency))
+        print_llm_plan(plan)
+        summary["plan"] = {key: value for key, value in plan.items() if key != "items"}
+        if options.dry_run:
+            if not save_data(plan, options.plan_file):
+                return _finish(summary, "failed", EXIT_FAILURE)
+            print(f"Plan gespeichert in '{options.plan_file}' (--dry-run, nichts gesendet).")
+            return _finish(summary, "planned", EXIT_OK)
+
         # --- User Confirmation to Send to LLM ---
         while True:
-            action_send = input("Anfragen an LLM senden? [(j)a, (n)eu filtern, (b)eenden]: ").lower()
+            if options.send is not None or options.batch:
+                action_send = 'j' if options.send else 'b'
+                print(f"Anfragen an LLM senden (vorgegeben): {'ja' if action_send == 'j' else 'nein'}")
+            else:
+                action_send = read_input("Anfragen an LLM senden? [(j)a, (n)eu filtern, (b)eenden]: ").lower()
             if action_send == 'j':
-                # --- LLM Processing Stage ---
-                print("\n--- Starte LLM-Verarbeitung ---")
-                script_dir = Path(__file__).parent
-                output_dir = script_dir.parent # Output in the parent directory (e.g., Zettelkasten/)
-                logging.info(f"Ausgaben werden in das Verzeichnis '{output_dir}' gespeichert.")
-
-                processed_count, skipped_exist_count, error_count = 0, 0, 0
-                total_requests = len(llm_requests)
-
-                for i, request in enumerate(llm_requests):
-                    req_title = request.get('title', 'Unbekannter Titel')
-                    req_id = request.get('thread_id', 'Unbekannte ID')
-                    print(f"\n[{i+1}/{total_requests}] Verarbeite: '{req_title}' ({req_id})")
-                    logging.info(f"Starte Verarbeitung für Request {i+1}/{total_requests}: '{req_title}' ({req_id})")
-
-                    # Check if output file already exists
-                    output_path_check = output_dir / (sanitize_filename(req_title) + '.md')
-                    if output_path_check.exists():
-                        skipped_exist_count += 1
-                        logging.warning(f"Datei '{output_path_check}' existiert bereits für Titel '{req_title}'. Überspringe LLM-Aufruf und Speichern.")
-                        print(f"  -> ÜBERSPRUNGEN (Datei existiert bereits)")
-                        continue # Skip to the next request
-
-                    # --- Invoke LLM ---
-                    llm_output = invoke_langchain_llm(request['system_prompt'], request['user_prompt'])
-                    # --- End LLM Invocation ---
-
-                    # Check for errors or empty output from LLM
-                    if not llm_output or llm_output.startswith("[FEHLER"):
-                        error_count += 1
-                        # Error message already logged by invoke_langchain_llm
-                        print(f"  -> FEHLER oder leere Antwort vom LLM. Nicht gespeichert. Siehe Log für Details.")
-                        logging.error(f"Fehler oder leere Antwort vom LLM für '{req_title}'. Ergebnis: {llm_output}")
-                        # Optional: Add a longer delay after errors?
-                        time.sleep(2) # Slightly longer pause after an error
-                    else:
-                        # --- Save LLM Output ---
-                        save_success = save_llm_output(
-                            req_title,
-                            request['category'],
-                            llm_output,
-                            request['links'],
-                            output_dir
-                        )
-                        if save_success:
-                            processed_count += 1
-                            print(f"  -> ERFOLGREICH gespeichert in '{output_path_check.name}'.")
-                        else:
-                            error_count += 1
-                            # Error message already logged by save_llm_output
-                            print(f"  -> FEHLER beim Speichern der LLM-Antwort. Siehe Log.")
-                            time.sleep(1) # Pause after save error
-
-                    # --- Delay between requests ---
-                    # Add a small delay to avoid overwhelming APIs or local server
-                    delay_seconds = 1.5
-                    logging.debug(f"Warte {delay_seconds}s vor der nächsten Anfrage...")
-                    time.sleep(delay_seconds)
-
-
-                # --- Processing Finished ---
-                print("\n--- LLM-Verarbeitung abgeschlossen ---")
-                print(f"Erfolgreich verarbeitet & gespeichert: {processed_count}")
-                print(f"Übersprungen (Datei existierte):     {skipped_exist_count}")
-                print(f"Fehler (LLM oder Speichern):         {error_count}")
-                print("--------------------------------------")
-                return # Exit script successfully after processing
+                journal = RunJournal()
+                try:
+                    journal.start(llm_requests, {"data_source": summary.get("data_source"),
+                                                 "filter_spec": summary.get("filter_spec"),
+                                                 "output_dir": str(output_dir)})
+                except OSError as e:
+                    logging.warning(f"Laufjournal konnte nicht angelegt werden, --resume ist für diesen Lauf nicht möglich: {e}")
+                    journal = None
+                return run_llm_stage(llm_requests, output_dir, options, manifest, journal, summary)
 
             elif action_send == 'n':
                 print("\nFilterung wird neu gestartet...")
                 skip_filtering = False; data_source_file = INPUT_JSON_FILE
-                initial_data = load_data(data_source_file)
-                if initial_data is None: return # Exit if reload fails
+                summary["data_source"] = data_source_file
+                initial_data = load_source_data(data_source_file)
+                if initial_data is None: return _finish(summary, "data_error", EXIT_DATA_ERROR) # Exit if reload fails
                 break # Exit inner loop, outer loop restarts filtering
 
             elif action_send == 'b':
+                if options.send is False:
+                    print("Anfragen vorbereitet, Senden deaktiviert (--no-send).")
+                    return _finish(summary, "prepared", EXIT_OK)
+                if options.batch and options.send is None:
+                    print("Anfragen vorbereitet, Senden nicht vorgegeben (--batch ohne --send).")
+                    return _finish(summary, "prepared", EXIT_OK)
                 print("Skript vor LLM-Verarbeitung beendet.")
                 logging.info("Benutzer hat Skript vor dem Senden an LLM beendet.")
-                return # Exit script
+                return _finish(summary, "aborted", EXIT_ABORTED) # Exit script
 
             else:
                 print("Ungültige Wahl. Bitte 'j', 'n' oder 'b' eingeben.")
-        # End of 'action_send' loop
-
-        # If 'n' was chosen in action_send, the 'continue' jumps here to restart outer loop
-        if action_send == 'n':
-            continue
-        else:
-            # Should only be reached if 'j' or 'b' was chosen, which include returns.
-            # Added as a safeguard.
-            break
+        # 'n' was chosen in action_send: restart outer loop for filtering
 
-# --- Script Entry Point ---
-if __name__ == "__main__":
+def save_cprofile_stats(cprofiler, filename):
+    """Saves the cProfile statistics and logs the functions with the highest cumulative time."""
+    import io
+    import pstats
+    try:
+        cprofiler.dump_stats(filename)
+    except OSError as e:
+        logging.warning(f"cProfile-Statistik konnte nicht in '{filename}' gespeichert werden: {e}")
+        return
+    listing = io.StringIO()
+    pstats.Stats(cprofiler, stream=listing).sort_stats("cumulative").print_stats(20)
+    logging.info(f"cProfile (Hauptthread, Top 20 nach kumulierter Zeit):\n{listing.getvalue()}")
+    print(f"cProfile-Statistik gespeichert in '{filename}'.")
+
+def main(argv=None):
+    """Hauptfunktion des Skripts; gibt den Exit-Code zurück."""
+    args = build_arg_parser().parse_args(argv)
+    setup_logging()
+    startup_seconds = time.perf_counter() - _IMPORT_START
+    PROFILER.add_stage("startup", startup_seconds, time.process_time())
+    logging.info(f"Startzeit (Modulimport bis Start): {startup_seconds:.3f}s")
+    summary = {
+        "status": None,
+        "exit_code": None,
+        "started_at": datetime.now().isoformat(timespec='seconds'),
+        "_start_time": time.time(),
+        "provider": LLM_PROVIDER,
+        "model": MODEL_NAME,
+        "startup_seconds": round(startup_seconds, 3),
+    }
+    try:
+        options = resolve_run_options(args)
+    except (ValueError, TypeError, OSError) as e:
+        print(f"FEHLER in Optionen/Profil: {e}")
+        logging.error(f"Ungültige Optionen/Profil: {e}")
+        _finish(summary, "config_error", EXIT_CONFIG_ERROR)
+        write_run_summary(summary, args.summary or RUN_SUMMARY_FILE)
+        return EXIT_CONFIG_ERROR
+    summary["batch"] = options.batch
+
+    PROFILER.start(memory=options.trace_memory)
+    cprofiler = None
+    if options.cprofile_file:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
     try:
-        main()
+        exit_code = run_pipeline(options, summary)
     except KeyboardInterrupt:
         print("\nSkript durch Benutzer unterbrochen (Strg+C).")
         logging.info("Skript durch Benutzer unterbrochen (KeyboardInterrupt).")
+        exit_code = _finish(summary, "interrupted", EXIT_INTERRUPTED)
+    except Exception:
+        _finish(summary, "failed", EXIT_FAILURE)
+        write_run_summary(summary, options.summary_file)
+        raise
+    finally:
+        close_thread_db()
+        if cprofiler is not None:
+            cprofiler.disable()
+            save_cprofile_stats(cprofiler, options.cprofile_file)
+        report = build_profile_report(PROFILER, summary)
+        PROFILER.stop()
+        write_profile_report(report)
+    flush_logging()
+    print_profile_report(report)
+    write_run_summary(summary, options.summary_file)
+    return exit_code
+
+# --- Script Entry Point ---
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
     except Exception as e:
         logging.exception("Ein unerwarteter Fehler ist im Hauptprogramm aufgetreten:")
         print(f"\nFATALER FEHLER: {e}")
-        print("Siehe Logdatei '{LOG_FILE}' für Details.")
+        print(f"Siehe Logdatei '{LOG_FILE}' für Details.")
+        sys.exit(EXIT_FAILURE)